@@ -1,13 +1,32 @@
 from django.contrib import admin
+from django.urls import reverse
+from . import broadcasts
+from .pagination import EstimatedCountPaginator
 from .models import (
     UserProfile, EcoTask, TaskSubmission, 
-    CoinTransaction, MerchItem, Order, Notification
+    CoinTransaction, MerchItem, Order, Notification, Broadcast, OutboxEvent, Campaign
 )
 
 
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables with millions of rows: a cached, capped
+    count instead of COUNT(*) (and no second count of the unfiltered table),
+    ordering by the primary key index, no date_hierarchy (it scans for
+    distinct dates), and autocomplete widgets instead of full FK dropdowns.
+    Search is only an exact username match, so it uses the unique index; an
+    icontains field ORed with it would turn every search into a full scan.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ['-id']
+    list_per_page = 50
+
+
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ['user', 'location', 'age', 'coin_balance']
+    list_select_related = ['user']
     search_fields = ['user__username', 'location']
     list_filter = ['location']
 
@@ -18,23 +37,35 @@ class EcoTaskAdmin(admin.ModelAdmin):
     list_filter = ['is_active', 'created_at']
     search_fields = ['title', 'description']
     date_hierarchy = 'created_at'
+    actions = ['announce']
+    
+    @admin.action(description="Announce to everyone")
+    def announce(self, request, queryset):
+        for task in queryset:
+            broadcasts.announce(
+                f"New task: {task.title} (+{task.coin_reward} coins)",
+                link=reverse('task_detail', args=[task.id]),
+            )
+        self.message_user(request, f"Announced {queryset.count()} task(s).")
 
 
 @admin.register(TaskSubmission)
-class TaskSubmissionAdmin(admin.ModelAdmin):
+class TaskSubmissionAdmin(LargeTableAdmin):
     list_display = ['user', 'task', 'status', 'created_at', 'reviewed_at']
     list_filter = ['status', 'created_at']
-    search_fields = ['user__username', 'task__title']
-    date_hierarchy = 'created_at'
+    list_select_related = ['user', 'task']
+    search_fields = ['user__username__exact']
+    autocomplete_fields = ['user', 'task']
     readonly_fields = ['created_at']
 
 
 @admin.register(CoinTransaction)
-class CoinTransactionAdmin(admin.ModelAdmin):
+class CoinTransactionAdmin(LargeTableAdmin):
     list_display = ['user', 'amount', 'transaction_type', 'description', 'created_at']
     list_filter = ['transaction_type', 'created_at']
-    search_fields = ['user__username', 'description']
-    date_hierarchy = 'created_at'
+    list_select_related = ['user']
+    search_fields = ['user__username__exact']
+    autocomplete_fields = ['user']
 
 
 @admin.register(MerchItem)
@@ -45,16 +76,50 @@ class MerchItemAdmin(admin.ModelAdmin):
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
     list_display = ['id', 'user', 'merch_item', 'status', 'created_at', 'updated_at']
     list_filter = ['status', 'created_at']
-    search_fields = ['user__username', 'merch_item__name']
-    date_hierarchy = 'created_at'
+    list_select_related = ['user', 'merch_item']
+    search_fields = ['user__username__exact']
+    autocomplete_fields = ['user', 'merch_item']
 
 
 @admin.register(Notification)
-class NotificationAdmin(admin.ModelAdmin):
+class NotificationAdmin(LargeTableAdmin):
     list_display = ['user', 'message', 'notification_type', 'is_read', 'created_at']
     list_filter = ['notification_type', 'is_read', 'created_at']
-    search_fields = ['user__username', 'message']
-    date_hierarchy = 'created_at'
+    list_select_related = ['user']
+    search_fields = ['user__username__exact']
+    autocomplete_fields = ['user']
+
+
+@admin.register(Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ['message', 'notification_type', 'link', 'created_at']
+    list_filter = ['notification_type']
+    search_fields = ['message']
+    
+    def save_model(self, request, obj, form, change):
+        if change:
+            super().save_model(request, obj, form, change)
+        else:
+            # Through announce(), so open pages hear about it; then obj is the saved row
+            broadcast = broadcasts.announce(obj.message, obj.link, obj.notification_type)
+            for field in Broadcast._meta.concrete_fields:
+                setattr(obj, field.attname, getattr(broadcast, field.attname))
+            obj._state.adding = False
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'event_type', 'status', 'attempts', 'available_at', 'created_at', 'processed_at']
+    list_filter = ['status', 'event_type']
+    readonly_fields = ['created_at', 'processed_at']
+
+
+@admin.register(Campaign)
+class CampaignAdmin(admin.ModelAdmin):
+    list_display = ['name', 'coin_amount', 'location', 'status', 'granted_count', 'created_at', 'completed_at']
+    list_filter = ['status']
+    search_fields = ['name']
+    readonly_fields = ['status', 'granted_count', 'started_at', 'completed_at']
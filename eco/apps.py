@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class EcoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'eco'
+
+    def ready(self):
+        # Signal receivers that keep the cached submitted-task sets current
+        from . import submitted  # noqa: F401
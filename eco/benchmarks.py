@@ -0,0 +1,74 @@
+"""
+Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks drive the real URLconf and middleware stack through Django's test
+client against the configured database, so run them on a copy of production
+data rather than on the live site.
+"""
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+BENCH_USERNAME = 'bench_user'
+BENCH_PASSWORD = 'bench-password-123'
+
+
+def get_bench_user():
+    """Create (once) and return the user the benchmarks log in as"""
+    user, created = User.objects.get_or_create(username=BENCH_USERNAME)
+    if created:
+        user.set_password(BENCH_PASSWORD)
+        user.save()
+    return user
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed=None):
+    """Throughput and latency summary (milliseconds) for a list of durations in seconds"""
+    elapsed = elapsed if elapsed is not None else sum(latencies)
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def format_summary(label, summary):
+    return (
+        f"{label:<32} {summary['requests']:>6} req  {summary['rps']:>9.1f} req/s  "
+        f"mean {summary['mean_ms']:>7.2f} ms  p95 {summary['p95_ms']:>7.2f} ms  "
+        f"p99 {summary['p99_ms']:>7.2f} ms"
+    )
+
+
+def run_requests(client, method, path, count, data=None, expect=(200, 302)):
+    """
+    Issue ``count`` requests and return (latencies, queries).
+
+    ``queries`` is the list of SQL statements captured during the run, useful
+    for asserting on per-request query counts.
+    """
+    send = getattr(client, method.lower())
+    latencies = []
+    with CaptureQueriesContext(connection) as ctx:
+        for _ in range(count):
+            start = time.perf_counter()
+            response = send(path, data) if data is not None else send(path)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code not in expect:
+                raise RuntimeError(f"{method} {path} returned {response.status_code}")
+    return latencies, ctx.captured_queries
@@ -0,0 +1,84 @@
+"""
+Announcements to every user ("a new task is up"), stored once.
+
+A ``Broadcast`` is a single row however many users there are. Instead of a
+Notification row per user, each UserProfile holds ``last_seen_broadcast_id``:
+broadcasts with a higher id are unread for that user. Announcing is one
+INSERT plus one event to the open streams; marking broadcasts read is one
+UPDATE of the watermark.
+
+The inbox merges the newest personal notifications with the newest
+broadcasts, each an indexed query capped at ``limit`` rows. Broadcasts older
+than BROADCAST_MAX_AGE_DAYS drop out of the inbox and the unread count, so
+the count stays a short range scan however long the app runs.
+"""
+from datetime import timedelta
+from heapq import merge
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import events
+from .models import Broadcast, Notification, UserProfile
+
+FIELDS = ('id', 'message', 'notification_type', 'link', 'created_at')
+
+
+def announce(message, link='', notification_type='announcement'):
+    """Notify every user with one row"""
+    with transaction.atomic():
+        broadcast = Broadcast.objects.create(message=message, link=link, notification_type=notification_type)
+        events.publish_all(
+            'broadcast',
+            id=broadcast.id,
+            message=message,
+            notification_type=notification_type,
+            link=link,
+            created_at=broadcast.created_at,
+        )
+    return broadcast
+
+
+def recent():
+    return Broadcast.objects.filter(
+        created_at__gte=timezone.now() - timedelta(days=settings.BROADCAST_MAX_AGE_DAYS)
+    )
+
+
+def watermark(user_id):
+    return UserProfile.objects.filter(user_id=user_id).values_list('last_seen_broadcast_id', flat=True).first() or 0
+
+
+def unread_count(user_id, seen=None):
+    """Unread personal notifications plus broadcasts past the user's watermark"""
+    if seen is None:
+        seen = watermark(user_id)
+    personal = Notification.objects.filter(user_id=user_id, is_read=False).count()
+    return personal + recent().filter(id__gt=seen).count()
+
+
+def inbox(user, limit):
+    """
+    The newest ``limit`` notifications and broadcasts, newest first, as dicts
+    with ``kind`` ('personal' or 'broadcast') and ``is_read``.
+    """
+    seen = watermark(user.id)
+    personal = [
+        {**row, 'kind': 'personal'}
+        for row in Notification.objects.filter(user=user).order_by('-created_at', '-id')
+        .values(*FIELDS, 'is_read')[:limit]
+    ]
+    broadcasts = [
+        {**row, 'kind': 'broadcast', 'is_read': row['id'] <= seen}
+        for row in recent().order_by('-id').values(*FIELDS)[:limit]
+    ]
+    return list(islice(merge(personal, broadcasts, key=lambda row: row['created_at'], reverse=True), limit))
+
+
+def mark_seen(user_id, upto=None):
+    """Mark broadcasts up to ``upto`` (default: all of them) read; the watermark never moves back"""
+    if upto is None:
+        upto = Broadcast.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    UserProfile.objects.filter(user_id=user_id, last_seen_broadcast_id__lt=upto).update(last_seen_broadcast_id=upto)
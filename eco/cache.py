@@ -0,0 +1,253 @@
+"""
+Cache helpers for the eco app.
+
+Cached data is grouped into namespaces (e.g. ``catalog`` for anything derived
+from the task list). Keys embed the namespace's current version, so bumping
+the version invalidates every key in the namespace at once, in every worker,
+without having to know or delete the individual keys.
+
+``get_or_set()`` reads through two tiers: a per-process LRU bounded by
+CACHE_LOCAL_MAX_BYTES, then the shared Django cache (CACHE_SHARED_ALIAS).
+Workers pick up a namespace bump within CACHE_VERSION_TTL seconds, because
+that is how long they trust their local copy of the version. Values are
+recomputed once, not once per worker:
+
+* single flight: on a miss, one thread per process and one process per key
+  (a ``cache.add()`` lock) computes while the others wait for its result.
+  Across processes this needs an atomic ``add()``: Redis, Memcached or the
+  database cache. The file cache checks and then writes, so two processes
+  may now and then both compute;
+* early refresh (XFetch): shortly before an entry expires, a reader now and
+  then recomputes it ahead of time, so popular keys never all expire at once;
+* stale while revalidate: shared entries outlive their timeout by the same
+  amount again, and readers that lose the lock race get the stale value.
+
+Values from the local tier are shared between requests: treat them as
+read-only.
+"""
+import math
+import pickle
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache, caches
+
+from . import metrics
+
+CATALOG = 'catalog'
+STORE = 'store'
+LEADERBOARD = 'leaderboard'
+
+MISSING = object()
+
+# Per-process tallies of get_or_set() results; see stats()
+_counts = {'local': 0, 'shared': 0, 'miss': 0, 'early_refresh': 0, 'stale': 0, 'waited': 0}
+
+
+def _version_key(namespace):
+    return f'eco:ns:{namespace}'
+
+
+# Versions this process has seen recently: namespace -> (version, monotonic time read)
+_versions = {}
+
+
+def _new_version():
+    # A fresh value rather than a counter: if the version key is ever evicted,
+    # the next one cannot coincide with a version that old entries still carry
+    return time.time_ns()
+
+
+def namespace_version(namespace):
+    seen = _versions.get(namespace)
+    if seen is not None and time.monotonic() - seen[1] < settings.CACHE_VERSION_TTL:
+        return seen[0]
+    version = cache.get(_version_key(namespace))
+    if version is None:
+        version = _new_version()
+        cache.add(_version_key(namespace), version, timeout=None)
+        version = cache.get(_version_key(namespace), version)
+    _versions[namespace] = (version, time.monotonic())
+    return version
+
+
+def bump_namespace(namespace):
+    """Invalidate every key in ``namespace``"""
+    # Not incr(): outside Redis and Memcached it re-sets the key with the default timeout
+    version = _new_version()
+    cache.set(_version_key(namespace), version, timeout=None)
+    _versions[namespace] = (version, time.monotonic())
+    return version
+
+
+def versioned_key(namespace, key):
+    return f'eco:{namespace}:{namespace_version(namespace)}:{key}'
+
+
+class LocalLRU:
+    """Least recently used entries go first once the byte or entry limit is reached"""
+
+    def __init__(self, max_bytes, max_entries):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (value, expires at, size)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            if entry[1] <= time.monotonic():
+                self._remove(key)
+                return MISSING
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, timeout, size):
+        if size > self.max_bytes // 10:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, time.monotonic() + timeout, size)
+            self.size += size
+            while self.size > self.max_bytes or len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def delete(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        self.size -= self.entries.pop(key)[2]
+
+
+local = LocalLRU(settings.CACHE_LOCAL_MAX_BYTES, settings.CACHE_LOCAL_MAX_ENTRIES)
+
+# Threads of one process computing the same key queue on the same lock
+_key_locks = [threading.Lock() for _ in range(64)]
+
+
+def _key_lock(key):
+    return _key_locks[zlib.crc32(key.encode()) % len(_key_locks)]
+
+
+def _count(name, result):
+    _counts[result] += 1
+    metrics.CACHE_REQUESTS.inc(1, name, result)
+
+
+def full_key(key, namespace=None):
+    return versioned_key(namespace, key) if namespace else f'eco:{key}'
+
+
+def _store(shared, key, value, timeout, delta):
+    """Save to both tiers; the shared entry carries what XFetch needs and outlives its timeout"""
+    envelope = (value, delta, time.time() + timeout)
+    shared.set(key, envelope, timeout * 2)
+    local.set(key, value, min(timeout, settings.CACHE_LOCAL_TIMEOUT), len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+
+
+def _compute(shared, key, compute, timeout):
+    started = time.monotonic()
+    value = compute()
+    _store(shared, key, value, timeout, time.monotonic() - started)
+    return value
+
+
+def get_or_set(key, compute, timeout, namespace=None, name='default', beta=1.0):
+    """
+    The cached value for ``key``, calling ``compute()`` to fill it in.
+    ``name`` labels the hit/miss counts in the metrics; ``beta`` > 1 favours
+    earlier refreshes.
+    """
+    if not settings.CACHE_ENABLED:
+        return compute()
+    key = full_key(key, namespace)
+    value = local.get(key)
+    if value is not MISSING:
+        _count(name, 'local')
+        return value
+
+    shared = caches[settings.CACHE_SHARED_ALIAS]
+    lock_key = f'{key}:lock'
+    envelope = shared.get(key)
+    if envelope is not None:
+        value, delta, expires = envelope
+        # XFetch: -log(random) is exponentially distributed, so the chance of
+        # refreshing grows as the expiry approaches, scaled by the compute time
+        if time.time() - delta * beta * math.log(1 - random.random()) < expires:
+            local.set(key, value, min(expires - time.time(), settings.CACHE_LOCAL_TIMEOUT),
+                      len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+            _count(name, 'shared')
+            return value
+        if not shared.add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT):
+            # Someone else is refreshing it
+            _count(name, 'stale')
+            return value
+        _count(name, 'early_refresh')
+        try:
+            return _compute(shared, key, compute, timeout)
+        finally:
+            shared.delete(lock_key)
+
+    _count(name, 'miss')
+    with _key_lock(key):
+        value = local.get(key)
+        if value is not MISSING:
+            return value
+        if shared.add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT):
+            try:
+                return _compute(shared, key, compute, timeout)
+            finally:
+                shared.delete(lock_key)
+        # Another process is computing it: wait for its result, up to CACHE_LOCK_WAIT
+        deadline = time.monotonic() + settings.CACHE_LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(0.02)
+            envelope = shared.get(key)
+            if envelope is not None:
+                _counts['waited'] += 1
+                local.set(key, envelope[0], min(timeout, settings.CACHE_LOCAL_TIMEOUT),
+                          len(pickle.dumps(envelope[0], pickle.HIGHEST_PROTOCOL)))
+                return envelope[0]
+        return _compute(shared, key, compute, timeout)
+
+
+def delete(key, namespace=None):
+    """
+    Drop ``key`` from the shared cache and this process's LRU. Other
+    processes keep their local copy for up to CACHE_LOCAL_TIMEOUT; bump the
+    namespace to reach them sooner.
+    """
+    key = full_key(key, namespace)
+    local.delete(key)
+    caches[settings.CACHE_SHARED_ALIAS].delete(key)
+
+
+def stats():
+    """This process's get_or_set() results so far, with the overall hit rate"""
+    counts = dict(_counts)
+    lookups = counts['local'] + counts['shared'] + counts['miss'] + counts['early_refresh'] + counts['stale']
+    hits = counts['local'] + counts['shared'] + counts['stale']
+    counts['hit_rate'] = hits / lookups if lookups else 0.0
+    counts['local_entries'] = len(local.entries)
+    counts['local_bytes'] = local.size
+    return counts
+
+
+def reset_stats():
+    for name in _counts:
+        _counts[name] = 0
@@ -0,0 +1,178 @@
+"""
+Live per-user events (new notifications, unread count, coin balance) pushed
+to browsers over server-sent events at /events/stream/.
+
+``publish()`` is called from ordinary synchronous code and is delivered only
+if the surrounding transaction commits; ``publish_all()`` reaches every open
+stream (broadcast announcements). Subscribers are asyncio queues, one
+per open stream, living in the ASGI process: an idle connection costs one
+coroutine and one small queue, no thread and no database connection.
+
+EVENTS_BACKEND selects how events reach the ASGI processes:
+
+* ``local`` delivers to subscribers in the publishing process only (a single
+  ASGI process that also runs the outbox worker, or development).
+* ``postgres`` sends events with ``pg_notify`` on the ``eco_events`` channel
+  and every ASGI process keeps one LISTEN connection, so events published by
+  gunicorn workers and the outbox worker reach every stream.
+
+WSGI deployments without an ASGI process use ``snapshot()`` through
+/events/poll/ instead (see base.html).
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'eco_events'
+
+_subscribers = defaultdict(set)  # user id -> {(loop, queue)}
+_lock = threading.Lock()
+_listeners = {}  # event loop -> LISTEN task
+
+
+def publish(user_id, event, **data):
+    """Send ``event`` to the user's open streams once the current transaction commits"""
+    message = json.dumps({'user_id': user_id, 'event': event, 'data': data}, cls=DjangoJSONEncoder)
+    if settings.EVENTS_BACKEND == 'postgres':
+        # NOTIFY is transactional: listeners see it only after commit
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, message])
+    else:
+        transaction.on_commit(lambda: dispatch(message))
+
+
+def publish_many(messages):
+    """``publish()`` for many ``(user_id, event, data)`` at once: one statement on postgres"""
+    messages = [
+        json.dumps({'user_id': user_id, 'event': event, 'data': data}, cls=DjangoJSONEncoder)
+        for user_id, event, data in messages
+    ]
+    if not messages:
+        return
+    if settings.EVENTS_BACKEND == 'postgres':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, message) FROM unnest(%s::text[]) AS message', [CHANNEL, messages])
+    else:
+        def deliver():
+            for message in messages:
+                dispatch(message)
+        transaction.on_commit(deliver)
+
+
+def publish_all(event, **data):
+    """Send ``event`` to every open stream once the current transaction commits"""
+    publish(None, event, **data)
+
+
+def dispatch(message):
+    """Hand a published message to this process's subscribers; safe from any thread"""
+    message = json.loads(message)
+    with _lock:
+        if message['user_id'] is None:
+            targets = [entry for entries in _subscribers.values() for entry in entries]
+        else:
+            targets = list(_subscribers.get(message['user_id'], ()))
+    for loop, queue in targets:
+        loop.call_soon_threadsafe(_put, queue, message)
+
+
+def _put(queue, message):
+    try:
+        queue.put_nowait(message)
+    except asyncio.QueueFull:
+        # A stalled client; drop its backlog and send a fresh snapshot instead
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait({'event': 'resync'})
+
+
+def subscribe(user_id):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+    with _lock:
+        _subscribers[user_id].add((loop, queue))
+    if settings.EVENTS_BACKEND == 'postgres' and loop not in _listeners:
+        _listeners[loop] = loop.create_task(listen())
+    return queue
+
+
+def unsubscribe(user_id, queue):
+    with _lock:
+        entries = _subscribers.get(user_id, set())
+        entries.difference_update({entry for entry in entries if entry[1] is queue})
+        if not entries:
+            _subscribers.pop(user_id, None)
+
+
+async def listen():
+    """Relay NOTIFYs on CHANNEL to local subscribers, reconnecting on failure"""
+    import psycopg
+    from psycopg.conninfo import make_conninfo
+
+    db = settings.DATABASES['default']
+    conninfo = make_conninfo(
+        dbname=db['NAME'], user=db['USER'], password=db['PASSWORD'],
+        host=db['HOST'], port=db['PORT'],
+    )
+    delay = 1
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as conn:
+                await conn.execute(f'LISTEN {CHANNEL}')
+                delay = 1
+                async for notify in conn.notifies():
+                    dispatch(notify.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Event listener lost its connection; retrying in %ss', delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30)
+
+
+def snapshot(user_id):
+    """Current unread count (broadcasts included), balance and newest notification id for one user"""
+    from . import broadcasts
+    from .models import Notification, UserProfile
+
+    balance, seen = UserProfile.objects.filter(user_id=user_id).values_list(
+        'coin_balance', 'last_seen_broadcast_id'
+    ).first() or (0, 0)
+    unread = broadcasts.unread_count(user_id, seen)
+    last_id = Notification.objects.filter(user_id=user_id).order_by('-id').values_list('id', flat=True).first()
+    return {'unread': unread, 'balance': balance, 'last_notification_id': last_id or 0}
+
+
+def sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n'
+
+
+async def stream(user_id):
+    """Server-sent event lines for one connection: a snapshot, then live events and keep-alives"""
+    from asgiref.sync import sync_to_async
+
+    queue = subscribe(user_id)
+    try:
+        yield f"retry: {settings.EVENTS_RETRY_MS}\n\n"
+        yield sse('snapshot', await sync_to_async(snapshot)(user_id))
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), settings.EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing the idle connection
+                yield ': keep-alive\n\n'
+                continue
+            if message['event'] == 'resync':
+                yield sse('snapshot', await sync_to_async(snapshot)(user_id))
+            else:
+                yield sse(message['event'], message['data'])
+    finally:
+        unsubscribe(user_id, queue)
@@ -0,0 +1,112 @@
+"""
+Deactivation of tasks whose deadline has passed.
+
+``expire_due_tasks()`` flips ``is_active`` off in bounded batches and
+invalidates the cached catalog. ``ExpiryTimer`` runs it inside a long-lived
+process exactly when the next deadline falls due, instead of polling.
+
+Nothing else deactivates tasks, so one such process must always run:
+``run_outbox_worker --expire-tasks`` (the Procfile worker) or
+``expire_tasks --watch``. Without it expired tasks stay listed, although
+submitting to one is still refused (``EcoTask.is_expired``).
+``run_outbox_worker --once --expire-tasks`` and plain ``expire_tasks``
+expire once and exit, for cron.
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from .cache import CATALOG, bump_namespace
+from .models import EcoTask
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def expire_due_tasks(batch_size=BATCH_SIZE, now=None):
+    """Deactivate every active task past its deadline; returns how many were expired"""
+    now = now or timezone.now()
+    total = 0
+    while True:
+        ids = list(
+            EcoTask.objects.filter(is_active=True, deadline__lte=now)
+            .order_by('deadline').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        total += EcoTask.objects.filter(id__in=ids, is_active=True).update(is_active=False)
+    if total:
+        bump_namespace(CATALOG)
+        logger.info("Expired %s tasks", total)
+    return total
+
+
+def next_expiry(now=None):
+    """Deadline of the next active task to expire, or None"""
+    now = now or timezone.now()
+    return (
+        EcoTask.objects.filter(is_active=True, deadline__gt=now)
+        .order_by('deadline').values_list('deadline', flat=True).first()
+    )
+
+
+class ExpiryTimer:
+    """
+    Background timer that fires at the next task deadline.
+
+    Tasks saved in this process reschedule it immediately; changes made by
+    other processes are picked up at the latest after ``max_sleep`` seconds.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, max_sleep=300):
+        self.batch_size = batch_size
+        self.max_sleep = max_sleep
+        self.next_run = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        post_save.connect(self._task_saved, sender=EcoTask, weak=False)
+        self.schedule()
+
+    def stop(self):
+        post_save.disconnect(self._task_saved, sender=EcoTask)
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+            self._timer = None
+
+    def schedule(self):
+        self.schedule_at(next_expiry())
+
+    def schedule_at(self, when):
+        now = timezone.now()
+        delay = self.max_sleep
+        if when is not None:
+            delay = min(max((when - now).total_seconds(), 0), self.max_sleep)
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+            self.next_run = now + timedelta(seconds=delay)
+            self._timer = threading.Timer(delay, self._fire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _fire(self):
+        close_old_connections()
+        try:
+            expire_due_tasks(self.batch_size)
+        except Exception:
+            logger.exception("Task expiry failed")
+        finally:
+            close_old_connections()
+        self.schedule()
+
+    def _task_saved(self, sender, instance, **kwargs):
+        if instance.is_active and instance.deadline and self.next_run and instance.deadline < self.next_run:
+            self.schedule_at(instance.deadline)
@@ -0,0 +1,160 @@
+"""
+Fast JSON serialization for large list responses.
+
+``ValuesSerializer`` produces the same JSON as the ModelSerializer classes in
+eco.serializers (``fields='__all__'``, nested relations), but it never builds
+model instances. Rows come from one ``values_list()`` query, with nested
+relations joined into the same query. The column-to-key mapping is compiled
+once, into a single Python function that turns a row tuple into a dict.
+``stream()`` writes the JSON array in batches, so memory stays flat however
+long the list is.
+
+    TASKS = ValuesSerializer(EcoTask)
+    SUBMISSIONS = ValuesSerializer(TaskSubmission, nested={'task': TASKS})
+    response = StreamingHttpResponse(SUBMISSIONS.stream(queryset), content_type='application/json')
+"""
+import datetime
+import decimal
+import json
+import uuid
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import models
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+
+# Rows encoded per json.dumps call and per chunk written to the response
+BATCH_SIZE = 500
+
+
+def datetime_value(value, tz):
+    # Same format as DRF's DateTimeField
+    value = value.astimezone(tz).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def file_converter():
+    # FileSystemStorage.url() without its per-call urljoin()
+    if isinstance(default_storage, FileSystemStorage):
+        base_url = default_storage.base_url
+        return lambda name: base_url + filepath_to_uri(name).lstrip('/') if name else None
+    return lambda name: default_storage.url(name) if name else None
+
+
+def converter(field):
+    """Function (raw column value, time zone) -> JSON value, or None if the value needs no conversion"""
+    if isinstance(field, models.FileField):
+        convert = file_converter()
+        return lambda value, tz: convert(value)
+    if isinstance(field, models.DateTimeField):
+        return lambda value, tz: None if value is None else datetime_value(value, tz)
+    if isinstance(field, (models.DateField, models.TimeField)):
+        return lambda value, tz: None if value is None else value.isoformat()
+    if isinstance(field, (models.DecimalField, models.UUIDField)):
+        return lambda value, tz: None if value is None else str(value)
+    return None
+
+
+def default(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class ValuesSerializer:
+    def __init__(self, model, fields='__all__', nested=None):
+        self.model = model
+        self.nested = nested or {}
+        if fields == '__all__':
+            fields = [field.name for field in model._meta.concrete_fields]
+        self.fields = list(fields)
+        self.columns, self.to_dict = self.compile()
+
+    @property
+    def pk_name(self):
+        return self.model._meta.pk.name
+
+    def plan(self, prefix='', start=0):
+        """(columns, dict expression source, converters) with columns numbered from ``start``"""
+        columns, items, converters = [], [], {}
+        for name in self.fields:
+            field = self.model._meta.get_field(name)
+            if name in self.nested:
+                nested = self.nested[name]
+                sub_columns, sub_source, sub_converters = nested.plan(f'{prefix}{name}__', start + len(columns))
+                # NULL in the related primary key means there is no related object
+                pk_column = f'{prefix}{name}__{nested.pk_name}'
+                if pk_column not in sub_columns:
+                    sub_columns.append(pk_column)
+                pk_index = start + len(columns) + sub_columns.index(pk_column)
+                columns += sub_columns
+                converters.update(sub_converters)
+                items.append((name, f'({sub_source} if r[{pk_index}] is not None else None)'))
+                continue
+
+            index = start + len(columns)
+            columns.append(f'{prefix}{field.attname}' if field.is_relation else f'{prefix}{name}')
+            convert = converter(field)
+            if convert is None:
+                items.append((name, f'r[{index}]'))
+            else:
+                converters[f'c_{prefix}{name}'] = convert
+                items.append((name, f'c_{prefix}{name}(r[{index}], tz)'))
+        source = '{' + ', '.join(f'{key!r}: {expr}' for key, expr in items) + '}'
+        return columns, source, converters
+
+    def compile(self):
+        columns, source, converters = self.plan()
+        namespace = dict(converters)
+        code = f'def to_dict(r, tz):\n    return {source}\n'
+        exec(compile(code, f'<ValuesSerializer {self.model.__name__}>', 'exec'), namespace)
+        return columns, namespace['to_dict']
+
+    def values(self, queryset):
+        """Row tuples for ``queryset``, nested relations joined in"""
+        return queryset.values_list(*self.columns)
+
+    def serialize(self, queryset):
+        tz = timezone.get_current_timezone()
+        return [self.to_dict(row, tz) for row in self.values(queryset)]
+
+    def stream(self, rows):
+        """
+        The JSON array for a queryset (or already selected ``values()`` rows),
+        as byte chunks of BATCH_SIZE rows
+        """
+        if isinstance(rows, models.QuerySet) and rows._fields is None:
+            rows = self.values(rows)
+        if isinstance(rows, models.QuerySet):
+            rows = rows.iterator(chunk_size=2000)
+
+        dumps = json.JSONEncoder(default=default, ensure_ascii=False, separators=(',', ':')).encode
+        to_dict = self.to_dict
+        tz = timezone.get_current_timezone()
+        yield b'['
+        batch = []
+        first = True
+        for row in rows:
+            batch.append(to_dict(row, tz))
+            if len(batch) == BATCH_SIZE:
+                yield (b'' if first else b',') + dumps(batch)[1:-1].encode()
+                first = False
+                batch = []
+        if batch:
+            yield (b'' if first else b',') + dumps(batch)[1:-1].encode()
+        yield b']'
+
+
+# Counterparts of the list serializers in eco.serializers
+
+from .models import CoinTransaction, EcoTask, MerchItem, Order, TaskSubmission  # noqa: E402
+
+TASKS = ValuesSerializer(EcoTask)
+SUBMISSIONS = ValuesSerializer(TaskSubmission, nested={'task': TASKS})
+MERCH_ITEMS = ValuesSerializer(MerchItem)
+ORDERS = ValuesSerializer(Order, nested={'merch_item': MERCH_ITEMS})
+TRANSACTIONS = ValuesSerializer(CoinTransaction)
@@ -0,0 +1,192 @@
+"""
+Resized image variants generated on demand.
+
+``/images/<preset>/<media path>`` returns the media file scaled to one of
+PRESETS. Variants are rendered with Pillow in a bounded thread pool on first
+request and kept in a size-capped LRU cache on disk (IMAGE_VARIANT_DIR).
+Concurrent requests for the same variant wait for a single render: a future
+per variant inside the process, and a file lock across gunicorn workers.
+
+Uploaded media never changes in place (storage adds a suffix instead of
+overwriting), so a variant is immutable for as long as its source exists.
+"""
+import contextlib
+import fcntl
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from django.conf import settings
+from django.core.cache import cache
+from PIL import Image, ImageOps
+
+# name -> (max width in px, output format)
+PRESETS = {
+    'avatar': (160, 'WEBP'),
+    'thumb': (320, 'WEBP'),
+    'card': (640, 'WEBP'),
+    'detail': (1280, 'WEBP'),
+    'detail-jpeg': (1280, 'JPEG'),
+}
+
+CONTENT_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg', 'PNG': 'image/png'}
+
+# Only public uploads; submission photos are private
+PUBLIC_PREFIXES = ('merchandise/', 'task_examples/', 'profile_photos/')
+
+_executor = ThreadPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS, thread_name_prefix='image-variant')
+_inflight = {}
+_inflight_lock = threading.Lock()
+_cache_bytes = None
+_cache_lock = threading.Lock()
+
+# Refresh an entry's LRU timestamp at most this often (seconds)
+TOUCH_INTERVAL = 3600
+# Seconds a source that failed to render answers 404 without another attempt
+FAILURE_TTL = 300
+
+
+class VariantNotFound(Exception):
+    pass
+
+
+class VariantTimeout(Exception):
+    """The render is still running after IMAGE_VARIANT_TIMEOUT; it finishes in the background"""
+
+
+def _failed_key(key):
+    return f'eco:variant-failed:{key}'
+
+
+class Variant:
+    def __init__(self, preset, source_name):
+        if preset not in PRESETS:
+            raise VariantNotFound(f'Unknown preset {preset!r}')
+        if '..' in source_name.replace('\\', '/').split('/'):
+            raise VariantNotFound(source_name)
+        media_root = os.path.realpath(settings.MEDIA_ROOT)
+        source = os.path.realpath(os.path.join(media_root, source_name))
+        if not source.startswith(media_root + os.sep):
+            raise VariantNotFound(source_name)
+        # The prefix check runs on the resolved path, not on what the client sent
+        source_name = os.path.relpath(source, media_root).replace(os.sep, '/')
+        if not source_name.startswith(PUBLIC_PREFIXES):
+            raise VariantNotFound(source_name)
+        try:
+            stat = os.stat(source)
+        except OSError:
+            raise VariantNotFound(source_name)
+
+        self.width, self.format = PRESETS[preset]
+        self.source = source
+        self.key = hashlib.sha256(
+            f'{source_name}:{stat.st_mtime_ns}:{stat.st_size}:{preset}:{self.width}:{self.format}'.encode()
+        ).hexdigest()
+        self.path = os.path.join(settings.IMAGE_VARIANT_DIR, self.key[:2], f'{self.key}.{self.format.lower()}')
+        self.content_type = CONTENT_TYPES[self.format]
+
+    @property
+    def etag(self):
+        return f'"{self.key}"'
+
+    def render(self):
+        """Write the variant to the cache unless another process already did"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            try:
+                if os.path.exists(self.path):
+                    return
+                with Image.open(self.source) as image:
+                    image = ImageOps.exif_transpose(image)
+                    if image.width > self.width:
+                        height = round(image.height * self.width / image.width)
+                        image = image.resize((self.width, height), Image.LANCZOS)
+                    if self.format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                        image = image.convert('RGB')
+                    image.save(tmp, self.format, quality=82, optimize=True)
+                os.replace(tmp, self.path)
+            finally:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(tmp)  # left over only when the render failed
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(self.path + '.lock')
+        _account(os.path.getsize(self.path))
+
+
+def get_variant(preset, source_name):
+    """Return a Variant whose file exists on disk, rendering it if needed"""
+    variant = Variant(preset, source_name)
+    if cache.get(_failed_key(variant.key)):
+        raise VariantNotFound(source_name)
+    try:
+        stat = os.stat(variant.path)
+    except FileNotFoundError:
+        pass
+    else:
+        if stat.st_mtime < time.time() - TOUCH_INTERVAL:
+            os.utime(variant.path)
+        return variant
+
+    with _inflight_lock:
+        future = _inflight.get(variant.key)
+        if future is None:
+            future = _executor.submit(variant.render)
+            _inflight[variant.key] = future
+            future.add_done_callback(lambda f, key=variant.key: _forget(key))
+    try:
+        future.result(timeout=settings.IMAGE_VARIANT_TIMEOUT)
+    except FutureTimeout:
+        raise VariantTimeout(source_name)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        # Not an image Pillow can read (UnidentifiedImageError is an OSError);
+        # remember that for a while instead of rendering it on every request
+        cache.set(_failed_key(variant.key), 1, FAILURE_TTL)
+        raise VariantNotFound(source_name) from exc
+    return variant
+
+
+def _forget(key):
+    with _inflight_lock:
+        _inflight.pop(key, None)
+
+
+def _cache_entries():
+    for dirpath, _, filenames in os.walk(settings.IMAGE_VARIANT_DIR):
+        for filename in filenames:
+            if filename.endswith(('.lock', '.tmp')):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield path, stat
+
+
+def _account(added):
+    """Track the cache size and evict least recently used variants above the cap"""
+    global _cache_bytes
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(stat.st_size for _, stat in _cache_entries())
+        else:
+            _cache_bytes += added
+        if _cache_bytes <= settings.IMAGE_VARIANT_CACHE_BYTES:
+            return
+        # Rescan: other workers write to the same directory
+        entries = sorted(_cache_entries(), key=lambda entry: entry[1].st_mtime)
+        total = sum(stat.st_size for _, stat in entries)
+        target = settings.IMAGE_VARIANT_CACHE_BYTES * 0.9
+        for path, stat in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+                total -= stat.st_size
+            except FileNotFoundError:
+                pass
+        _cache_bytes = total
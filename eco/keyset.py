@@ -0,0 +1,76 @@
+"""
+Keyset pagination on ``(created_at, id)``, newest first.
+
+Instead of an OFFSET, each page carries a cursor naming the last row shown,
+and the next page starts strictly below it:
+
+    WHERE created_at < %s OR (created_at = %s AND id < %s)
+    ORDER BY created_at DESC, id DESC LIMIT per_page + 1
+
+With an index on ``(user, -created_at, -id)`` every page is one short index
+range scan, however far back the user has paged. The extra row only tells
+whether there is a next page; nothing is ever counted.
+
+Cursors are ``<microseconds since the epoch>.<id>``, safe in a URL as is. A
+missing or malformed cursor means the first page.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Q
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def encode_cursor(created_at, pk):
+    return f'{(created_at - EPOCH) // MICROSECOND}.{pk}'
+
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor, or None"""
+    try:
+        micros, pk = cursor.split('.')
+        return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def before(key):
+    """Lookup for rows after ``key`` in newest-first order"""
+    created_at, pk = key
+    return Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+
+
+def row_key(row):
+    if isinstance(row, dict):
+        return row['created_at'], row['id']
+    return row.created_at, row.pk
+
+
+class KeysetPage:
+    """One page of rows; pass it ``per_page + 1`` rows so it can tell whether more follow"""
+
+    def __init__(self, rows, per_page):
+        rows = list(rows)
+        self.object_list = rows[:per_page]
+        self.has_next = len(rows) > per_page
+
+    @property
+    def next_cursor(self):
+        if not self.has_next:
+            return None
+        return encode_cursor(*row_key(self.object_list[-1]))
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def paginate(queryset, cursor=None, per_page=20):
+    """The page of ``queryset`` after ``cursor``, newest first"""
+    key = decode_cursor(cursor)
+    if key is not None:
+        queryset = queryset.filter(before(key))
+    return KeysetPage(queryset.order_by('-created_at', '-id')[:per_page + 1], per_page)
@@ -0,0 +1,209 @@
+"""
+Coin ledger reads and compaction.
+
+``CoinTransaction`` is append-only. ``compact()`` rolls every row older than
+the compaction horizon into one ``CoinTransactionSummary`` per user and month
+and moves the raw rows to ``ArchivedCoinTransaction``. Readers use
+``history()`` and ``balance_as_of()``, which look at both tables, so callers
+never need to know where a row currently lives.
+"""
+import gzip
+import json
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Case, Count, F, Q, Sum, When
+from django.db.models.functions import TruncMonth
+from django.db.models.fields import DateField
+from django.utils import timezone
+
+from . import keyset
+from .models import ArchivedCoinTransaction, CoinTransaction, CoinTransactionSummary
+
+HISTORY_FIELDS = ('id', 'amount', 'transaction_type', 'description', 'created_at')
+
+# Earned amounts count up, spent amounts count down
+SIGNED_AMOUNT = Case(
+    When(transaction_type='spend', then=-F('amount')),
+    default=F('amount'),
+)
+
+
+def history(user, before=None, limit=None):
+    """
+    A user's transactions, newest first, as dicts of HISTORY_FIELDS.
+    ``before`` is a keyset (created_at, id) to start below; with ``limit``
+    each table is cut to that many rows before the union where the database
+    allows it, so deep pages stay cheap.
+    """
+    live = CoinTransaction.objects.filter(user=user).order_by().values(*HISTORY_FIELDS)
+    archived = ArchivedCoinTransaction.objects.filter(user=user).order_by().values(*HISTORY_FIELDS)
+    if before is not None:
+        live = live.filter(keyset.before(before))
+        archived = archived.filter(keyset.before(before))
+    return newest_first(live, archived, limit)
+
+
+def newest_first(live, archived, limit=None):
+    """
+    UNION ALL of matching live and archived ``values()`` querysets, newest
+    first, with each side cut to ``limit`` rows where the database allows it
+    """
+    if limit is not None and connections[live.db].features.supports_slicing_ordering_in_compound:
+        live = live.order_by('-created_at', '-id')[:limit]
+        archived = archived.order_by('-created_at', '-id')[:limit]
+    return live.union(archived, all=True).order_by('-created_at', '-id')
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def next_month(value):
+    return (value.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def as_datetime(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def balance_as_of(user, when):
+    """
+    Ledger balance at ``when``: the closest monthly checkpoint before it plus
+    the transactions (live or archived) recorded since that checkpoint.
+    """
+    checkpoint = (
+        CoinTransactionSummary.objects
+        .filter(user=user, month__lt=month_start(timezone.localtime(when)))
+        .order_by('-month')
+        .first()
+    )
+    balance = 0
+    rows = Q(user=user, created_at__lte=when)
+    if checkpoint:
+        balance = checkpoint.closing_balance
+        rows &= Q(created_at__gte=as_datetime(next_month(checkpoint.month)))
+
+    for model in (CoinTransaction, ArchivedCoinTransaction):
+        balance += model.objects.filter(rows).aggregate(total=Sum(SIGNED_AMOUNT))['total'] or 0
+    return balance
+
+
+def balances(first_user_id, last_user_id):
+    """
+    Current ledger balance of every user in the id range that has ledger rows.
+
+    Monthly summaries already account for every archived row, so the balance
+    is their net total plus the live transactions: one grouped aggregate per
+    table for the whole range.
+    """
+    totals = defaultdict(int)
+    users = Q(user_id__gte=first_user_id, user_id__lte=last_user_id)
+    summaries = (
+        CoinTransactionSummary.objects.filter(users)
+        .values('user_id').annotate(total=Sum(F('earned') - F('spent'))).order_by()
+    )
+    live = (
+        CoinTransaction.objects.filter(users)
+        .values('user_id').annotate(total=Sum(SIGNED_AMOUNT)).order_by()
+    )
+    for rows in (summaries, live):
+        for row in rows:
+            totals[row['user_id']] += row['total']
+    return totals
+
+
+def compaction_cutoff(now=None, horizon_days=None):
+    """Start of the month containing ``now - horizon``; only whole months are compacted"""
+    now = now or timezone.now()
+    if horizon_days is None:
+        horizon_days = settings.LEDGER_COMPACTION_HORIZON_DAYS
+    return as_datetime(month_start(timezone.localtime(now - timedelta(days=horizon_days))))
+
+
+def compact_user(user_id, cutoff, chunk_size=5000, export=None):
+    """
+    Compact one user's transactions created before ``cutoff``.
+
+    Returns the number of rows moved. Runs in a single transaction, so the
+    summaries, archive rows and deletions land together or not at all.
+    """
+    rows = CoinTransaction.objects.filter(user_id=user_id, created_at__lt=cutoff)
+
+    with transaction.atomic():
+        months = (
+            rows.annotate(month=TruncMonth('created_at', output_field=DateField()))
+            .values('month')
+            .annotate(
+                earned=Sum('amount', filter=Q(transaction_type='earn'), default=0),
+                spent=Sum('amount', filter=Q(transaction_type='spend'), default=0),
+                count=Count('id'),
+            )
+            .order_by('month')
+        )
+        months = list(months)
+        if not months:
+            return 0
+
+        previous = (
+            CoinTransactionSummary.objects
+            .filter(user_id=user_id, month__lt=months[0]['month'])
+            .order_by('-month')
+            .values_list('closing_balance', flat=True)
+            .first()
+        )
+        balance = previous or 0
+        for row in months:
+            summary, _ = CoinTransactionSummary.objects.select_for_update().get_or_create(
+                user_id=user_id, month=row['month'],
+            )
+            balance += row['earned'] - row['spent']
+            summary.earned += row['earned']
+            summary.spent += row['spent']
+            summary.transaction_count += row['count']
+            summary.closing_balance = balance
+            summary.save()
+
+        moved = 0
+        while True:
+            chunk = list(rows.order_by('id').values('id', 'user_id', *HISTORY_FIELDS[1:])[:chunk_size])
+            if not chunk:
+                break
+            ArchivedCoinTransaction.objects.bulk_create(
+                [ArchivedCoinTransaction(**row) for row in chunk], ignore_conflicts=True,
+            )
+            if export is not None:
+                for row in chunk:
+                    export.write(json.dumps(row, default=str) + '\n')
+            CoinTransaction.objects.filter(id__in=[row['id'] for row in chunk]).delete()
+            moved += len(chunk)
+    return moved
+
+
+def compact(cutoff=None, export_path=None, progress=None):
+    """
+    Compact every user with transactions older than ``cutoff``.
+
+    ``export_path`` additionally appends the archived rows to a gzip-compressed
+    JSON-lines file for cold storage. ``progress`` is called with
+    ``(user_id, rows_moved)`` after each user.
+    """
+    cutoff = cutoff or compaction_cutoff()
+    user_ids = (
+        CoinTransaction.objects.filter(created_at__lt=cutoff)
+        .order_by('user_id').values_list('user_id', flat=True).distinct()
+    )
+    export = gzip.open(export_path, 'at', encoding='utf-8') if export_path else None
+    total = 0
+    try:
+        for user_id in user_ids.iterator():
+            moved = compact_user(user_id, cutoff, export=export)
+            total += moved
+            if progress:
+                progress(user_id, moved)
+    finally:
+        if export is not None:
+            export.close()
+    return total
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+
+from eco import cache
+from eco.benchmarks import (
+    BENCH_PASSWORD, BENCH_USERNAME, format_summary, get_bench_user, run_requests, summarize,
+)
+
+DEFAULT_PAGES = ['home', 'tasks', 'store', 'profile']
+
+
+class Command(BaseCommand):
+    help = 'Throughput and queries per request of the hot views with the two-tier cache off and on'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per page')
+        parser.add_argument('--pages', default=','.join(DEFAULT_PAGES),
+                            help='Comma separated URL names (no arguments)')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        get_bench_user()
+        pages = [name.strip() for name in options['pages'].split(',') if name.strip()]
+
+        for label, enabled in [('cache off', False), ('cache on', True)]:
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            cache.local.clear()
+            cache.reset_stats()
+            with override_settings(CACHE_ENABLED=enabled):
+                self.bench(pages, options['requests'])
+            if enabled:
+                stats = cache.stats()
+                self.stdout.write(
+                    f"hit rate {stats['hit_rate']:.1%}  (local {stats['local']}, shared {stats['shared']}, "
+                    f"miss {stats['miss']}, early refresh {stats['early_refresh']}, stale {stats['stale']}; "
+                    f"{stats['local_entries']} local entries, {stats['local_bytes'] / 1024:.0f}KB)"
+                )
+
+    def bench(self, pages, count):
+        client = Client()
+        client.login(username=BENCH_USERNAME, password=BENCH_PASSWORD)
+        all_latencies = []
+        started = time.perf_counter()
+        for name in pages:
+            latencies, queries = run_requests(client, 'get', reverse(name), count)
+            all_latencies += latencies
+            self.stdout.write(f'{format_summary(name, summarize(latencies))}  {len(queries) / count:.1f} q/req')
+        self.stdout.write(format_summary('all pages', summarize(all_latencies, time.perf_counter() - started)))
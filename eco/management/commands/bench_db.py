@@ -0,0 +1,94 @@
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+
+from eco.benchmarks import BENCH_PASSWORD, BENCH_USERNAME, format_summary, summarize
+
+READ_PAGES = ['home', 'tasks', 'store', 'profile']
+
+
+def get_thread_user(i):
+    """One bench user per thread, so writers contend on the database rather than on one row"""
+    user, created = User.objects.get_or_create(username=f'{BENCH_USERNAME}_{i}')
+    if created:
+        user.set_password(BENCH_PASSWORD)
+        user.save()
+    return user
+
+
+class Command(BaseCommand):
+    help = (
+        'Mixed read/write throughput of the main views from concurrent threads. '
+        'Run it once with DJANGO_DB_ENGINE=sqlite and once against PostgreSQL to compare.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of requests that write')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        users = [get_thread_user(i) for i in range(options['threads'])]
+        self.stdout.write(self.style.MIGRATE_HEADING(self.describe_database()))
+
+        reads, writes, errors = [], [], []
+        deadline = time.perf_counter() + options['seconds']
+        barrier = threading.Barrier(len(users))
+
+        def worker(user):
+            client = Client()
+            client.login(username=user.username, password=BENCH_PASSWORD)
+            rng = random.Random(user.id)
+            try:
+                barrier.wait()
+                while time.perf_counter() < deadline:
+                    write = rng.random() < options['write_ratio']
+                    start = time.perf_counter()
+                    try:
+                        if write:
+                            response = client.post(reverse('edit_profile'), {'location': f'Tashkent {rng.randint(1, 99)}'})
+                        else:
+                            response = client.get(reverse(rng.choice(READ_PAGES)))
+                    except Exception as exc:
+                        errors.append(repr(exc))
+                        continue
+                    elapsed = time.perf_counter() - start
+                    if response.status_code not in (200, 302):
+                        errors.append(f'{response.status_code} {response.request["PATH_INFO"]}')
+                        continue
+                    (writes if write else reads).append(elapsed)
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(format_summary('reads', summarize(reads, elapsed)))
+        self.stdout.write(format_summary('writes', summarize(writes, elapsed)))
+        self.stdout.write(format_summary('all', summarize(reads + writes, elapsed)))
+        if errors:
+            self.stdout.write(self.style.ERROR(f'{len(errors)} failed requests, e.g. {errors[0]}'))
+
+    def describe_database(self):
+        if connection.vendor != 'sqlite':
+            return f'{connection.vendor} {connection.settings_dict["NAME"]}'
+        with connection.cursor() as cursor:
+            pragmas = []
+            for pragma in ['journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'busy_timeout']:
+                cursor.execute(f'PRAGMA {pragma}')
+                pragmas.append(f'{pragma}={cursor.fetchone()[0]}')
+        mode = connection.transaction_mode or 'DEFERRED'
+        return f'sqlite {connection.settings_dict["NAME"]} ({", ".join(pragmas)}, BEGIN {mode})'
@@ -0,0 +1,56 @@
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import resolve
+
+from eco import metrics
+from eco.middleware import MetricsMiddleware
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request cost of MetricsMiddleware (recording only, no view work)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200000)
+        parser.add_argument('--budget-us', type=float, default=10.0, help='Fail above this overhead')
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        request = RequestFactory().get('/tasks/')
+        request.resolver_match = resolve('/tasks/')
+        response = HttpResponse()
+
+        def view(request):
+            return response
+
+        # Flushes go to a scratch directory, so running this next to a live deployment leaves its counters alone
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS_ENABLED=True, METRICS_DIR=directory):
+            middleware = MetricsMiddleware(view)
+            try:
+                bare = self.measure(view, request, count)
+                instrumented = self.measure(middleware, request, count)
+            finally:
+                # Or the exit hook would write the benchmark's requests to the real METRICS_DIR
+                metrics.discard()
+        overhead = (instrumented - bare) / count * 1e6
+
+        self.stdout.write(f'bare view          {bare / count * 1e6:>8.2f} us/request')
+        self.stdout.write(f'with metrics       {instrumented / count * 1e6:>8.2f} us/request')
+        self.stdout.write(f'overhead           {overhead:>8.2f} us/request  (flush every {settings.METRICS_FLUSH_SECONDS}s included)')
+        if overhead > options['budget_us']:
+            raise CommandError(f'Metrics overhead {overhead:.2f}us is above the {options["budget_us"]}us budget')
+
+    def measure(self, handler, request, count):
+        """Fastest of three timed runs, in seconds"""
+        timings = []
+        for _ in range(3):
+            start = time.perf_counter()
+            for _ in range(count):
+                handler(request)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
@@ -0,0 +1,72 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+
+from eco.benchmarks import (
+    BENCH_PASSWORD, BENCH_USERNAME, format_summary, get_bench_user, run_requests, summarize,
+)
+
+DEFAULT_PAGES = ['home', 'profile', 'tasks', 'store']
+
+# Django's stock setup: database sessions, messages overflowing into the session
+BASELINE = {
+    'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+    'MESSAGE_STORAGE': 'django.contrib.messages.storage.fallback.FallbackStorage',
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure authenticated page throughput and session-table traffic'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per page')
+        parser.add_argument('--pages', default=','.join(DEFAULT_PAGES),
+                            help='Comma separated URL names (no arguments)')
+        parser.add_argument('--compare', action='store_true',
+                            help='Also run with database sessions and fallback message storage')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        get_bench_user()
+        pages = [name.strip() for name in options['pages'].split(',') if name.strip()]
+
+        runs = []
+        if options['compare']:
+            runs.append(('baseline (db sessions)', BASELINE))
+        runs.append((f'current ({settings.SESSION_ENGINE})', {}))
+
+        for label, overrides in runs:
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            with override_settings(**overrides):
+                self.bench(pages, options['requests'])
+
+    def bench(self, pages, count):
+        client = Client()
+        client.login(username=BENCH_USERNAME, password=BENCH_PASSWORD)
+
+        all_latencies = []
+        started = time.perf_counter()
+        for name in pages:
+            latencies, queries = run_requests(client, 'get', reverse(name), count)
+            all_latencies += latencies
+            self.report(name, latencies, queries, count)
+
+        # Flash message round trip: POST that sets a message, then the redirect target
+        latencies, queries = run_requests(
+            client, 'post', reverse('edit_profile'), count, data={'location': 'Tashkent'},
+        )
+        self.report('edit_profile (POST + message)', latencies, queries, count)
+        all_latencies += latencies
+
+        self.stdout.write(format_summary('all pages', summarize(all_latencies, time.perf_counter() - started)))
+
+    def report(self, label, latencies, queries, count):
+        session_queries = sum(1 for q in queries if 'django_session' in q['sql'])
+        self.stdout.write(
+            f"{format_summary(label, summarize(latencies))}  "
+            f"{len(queries) / count:.1f} q/req  {session_queries / count:.2f} session q/req"
+        )
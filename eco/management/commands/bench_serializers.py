@@ -0,0 +1,104 @@
+import json
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from eco import fastserialize
+from eco.benchmarks import get_bench_user
+from eco.models import CoinTransaction, EcoTask, MerchItem, Order, TaskSubmission
+
+
+class Rollback(Exception):
+    pass
+
+
+def create_rows(user, rows):
+    """Fixture rows for the bench user; created inside a transaction that is rolled back"""
+    now = timezone.now()
+    tasks = EcoTask.objects.bulk_create([
+        EcoTask(title=f'Bench task {i}', description='Plant a tree and take a photo with it. ' * 4,
+                coin_reward=50, deadline=now + timedelta(days=30))
+        for i in range(rows)
+    ])
+    TaskSubmission.objects.bulk_create([
+        TaskSubmission(user=user, task=task, description='Done!', image=f'submissions/bench{task.id}.jpg')
+        for task in tasks
+    ])
+    item = MerchItem.objects.create(name='Bench bottle', description='Reusable bottle', coin_cost=75,
+                                    image='merchandise/bench.jpg')
+    Order.objects.bulk_create([
+        Order(user=user, merch_item=item, shipping_address='Amir Temur street 1, Tashkent') for _ in range(rows)
+    ])
+    CoinTransaction.objects.bulk_create([
+        CoinTransaction(user=user, amount=50, transaction_type='earn', description=f'Completed task: Bench task {i}')
+        for i in range(rows)
+    ])
+
+
+class Command(BaseCommand):
+    help = 'Compare DRF ModelSerializers with eco.fastserialize on large lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case (the fastest is kept)')
+
+    def handle(self, *args, **options):
+        try:
+            from rest_framework.renderers import JSONRenderer
+            from eco import serializers
+        except ImportError:
+            raise CommandError('djangorestframework is required for the comparison')
+
+        rows = options['rows']
+        user = get_bench_user()
+        cases = [
+            ('tasks', serializers.TaskSerializer, fastserialize.TASKS,
+             lambda: EcoTask.objects.filter(title__startswith='Bench task').order_by('-id'), None),
+            ('submissions', serializers.TaskSubmissionSerializer, fastserialize.SUBMISSIONS,
+             lambda: TaskSubmission.objects.filter(user=user).order_by('-id'), 'task'),
+            ('orders', serializers.OrderSerializer, fastserialize.ORDERS,
+             lambda: Order.objects.filter(user=user).order_by('-id'), 'merch_item'),
+            ('transactions', serializers.CoinTransactionSerializer, fastserialize.TRANSACTIONS,
+             lambda: CoinTransaction.objects.filter(user=user).order_by('-id'), None),
+        ]
+
+        try:
+            with transaction.atomic():
+                create_rows(user, rows)
+                self.stdout.write(f'{"list":<14}{"DRF ms":>10}{"fast ms":>10}{"speedup":>9}{"DRF peak":>12}{"fast peak":>12}')
+                for label, drf_class, fast, queryset, related in cases:
+                    def drf():
+                        qs = queryset().select_related(related) if related else queryset()
+                        return JSONRenderer().render(drf_class(qs, many=True).data)
+
+                    def fast_path():
+                        return b''.join(fast.stream(queryset()))
+
+                    drf_output, drf_ms, drf_peak = self.measure(drf, options['repeat'])
+                    fast_output, fast_ms, fast_peak = self.measure(fast_path, options['repeat'])
+                    if json.loads(drf_output) != json.loads(fast_output):
+                        raise CommandError(f'{label}: fast output differs from the DRF serializer')
+                    self.stdout.write(
+                        f'{label:<14}{drf_ms:>10.1f}{fast_ms:>10.1f}{drf_ms / fast_ms:>8.1f}x'
+                        f'{drf_peak / 2**20:>10.1f}MB{fast_peak / 2**20:>10.1f}MB'
+                    )
+                raise Rollback
+        except Rollback:
+            pass
+
+    def measure(self, func, repeat):
+        """(output, fastest time in ms, peak traced memory in bytes)"""
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = func()
+            timings.append(time.perf_counter() - start)
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return output, min(timings) * 1000, peak
@@ -0,0 +1,97 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from eco.benchmarks import summarize
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def fetch(url, timeout=10):
+    """Return (status, seconds) for one GET; status is None if the server is not up yet"""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as exc:
+        status = exc.code
+    except (urllib.error.URLError, ConnectionError):
+        status = None
+    return status, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = 'Measure gunicorn time-to-first-good-response with and without preload/warm-up'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/tasks/', help='Page to request')
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Requests to send once the server answers')
+        parser.add_argument('--cold', type=int, default=None,
+                            help='How many of the first requests count as cold (default: one per worker)')
+        parser.add_argument('--modes', default='preload,no-preload,cold',
+                            help='preload: warm in master then per worker; no-preload: warm in each '
+                                 'worker; cold: no warm-up at all')
+        parser.add_argument('--timeout', type=float, default=60)
+
+    def handle(self, *args, **options):
+        cold = options['cold'] or options['workers']
+        for mode in options['modes'].split(','):
+            mode = mode.strip()
+            if mode not in ('preload', 'no-preload', 'cold'):
+                raise CommandError(f'Unknown mode {mode!r}')
+            self.stdout.write(self.style.MIGRATE_HEADING(mode))
+            self.run_mode(mode, options, cold)
+
+    def run_mode(self, mode, options, cold):
+        port = free_port()
+        url = f"http://127.0.0.1:{port}{options['path']}"
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE),
+            GUNICORN_PRELOAD='1' if mode == 'preload' else '0',
+            GUNICORN_WARMUP='0' if mode == 'cold' else '1',
+        )
+        command = [
+            sys.executable, '-m', 'gunicorn', 'ecoapp.wsgi',
+            '-c', 'python:ecoapp.gunicorn_conf',
+            '-b', f'127.0.0.1:{port}', '-w', str(options['workers']),
+        ]
+
+        started = time.perf_counter()
+        server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                if server.poll() is not None:
+                    raise CommandError(f'gunicorn exited with code {server.returncode}')
+                if time.perf_counter() - started > options['timeout']:
+                    raise CommandError(f'No 200 from {url} within {options["timeout"]}s')
+                status, _ = fetch(url)
+                if status == 200:
+                    break
+                time.sleep(0.05)
+            first_good = time.perf_counter() - started
+
+            latencies = [fetch(url)[1] for _ in range(options['requests'])]
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+        self.stdout.write(f'  time to first good response: {first_good * 1000:8.1f} ms')
+        warm = summarize(latencies[cold:])
+        cold_ms = [value * 1000 for value in latencies[:cold]]
+        self.stdout.write(f'  first {cold} requests:          ' + ', '.join(f'{value:.1f}' for value in cold_ms) + ' ms')
+        self.stdout.write(f"  steady state:                 p50 {warm['p50_ms']:.1f} ms  p95 {warm['p95_ms']:.1f} ms")
@@ -0,0 +1,218 @@
+import json
+import os
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+from django.template import engines
+from django.test import RequestFactory
+from django.test.utils import setup_test_environment
+from django.utils import timezone
+
+from eco.forms import SignUpForm, TaskSubmissionForm, UserProfileForm
+from eco.keyset import KeysetPage
+from eco.models import EcoTask, MerchItem, Order, TaskSubmission, UserProfile
+from eco.warmup import template_names
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'template_baseline.json')
+
+LOREM = (
+    'Plant a tree in your community and take a photo with it. Every tree helps '
+    'reduce CO2 and provides oxygen for our planet! '
+)
+
+
+# Unsaved model instances with ids and related objects filled in, so templates
+# render exactly as in production without touching the database.
+
+def make_user(i=1, staff=False):
+    user = User(id=i, username=f'user{i}', first_name='Eco', last_name=f'User{i}',
+                email=f'user{i}@example.com', is_staff=staff)
+    user.profile = UserProfile(id=i, user=user, location='Tashkent', age=25, bio=LOREM, coin_balance=420)
+    return user
+
+
+def make_task(i):
+    return EcoTask(id=i, title=f'Eco task {i}', description=LOREM * 3, coin_reward=50,
+                   deadline=timezone.now() + timedelta(days=30), created_at=timezone.now(),
+                   submission_count=120, approved_count=80, pending_count=30, rejected_count=10)
+
+
+def make_item(i):
+    return MerchItem(id=i, name=f'Bamboo cutlery set {i}', description=LOREM, image=f'merchandise/item{i}.jpg',
+                     coin_cost=75, stock_quantity=50, created_at=timezone.now())
+
+
+def make_submission(i, user):
+    return TaskSubmission(id=i, user=user, task=make_task(i), description=LOREM, image=f'submissions/{i}.jpg',
+                          status=('pending', 'approved', 'rejected')[i % 3], created_at=timezone.now())
+
+
+def make_order(i, user):
+    return Order(id=i, user=user, merch_item=make_item(i), status=('pending', 'shipped', 'completed')[i % 3],
+                 shipping_address='Amir Temur street 1\nTashkent', created_at=timezone.now())
+
+
+def make_transaction(i):
+    return {'id': i, 'amount': 50, 'transaction_type': ('earn', 'spend')[i % 2],
+            'description': f'Completed task: Eco task {i}', 'created_at': timezone.now()}
+
+
+def make_notification(i):
+    kind = ('personal', 'broadcast')[i % 2]
+    return {'id': i, 'kind': kind, 'message': f'Your submission for Eco task {i} was approved', 'is_read': i > 3,
+            'notification_type': 'announcement' if kind == 'broadcast' else 'submission_approved',
+            'link': f'/tasks/{i}/', 'created_at': timezone.now()}
+
+
+def make_tasks(rows):
+    tasks = [make_task(i) for i in range(1, rows + 1)]
+    for task in tasks:
+        task.submitted = task.id % 3 == 0
+    return tasks
+
+
+def page_of(objects):
+    return Paginator(objects, max(len(objects), 1)).page(1)
+
+
+def keyset_page(make, rows):
+    """A history page of ``rows`` rows with a "Load more" link, like keyset.paginate()"""
+    return KeysetPage([make(i) for i in range(1, rows + 2)], rows)
+
+
+def context_for(name, rows, user):
+    """Context matching what the view passes, with ``rows`` list entries"""
+    n = range(1, rows + 1)
+    contexts = {
+        'eco/admin_dashboard.html': lambda: {
+            'top_users': [make_user(i) for i in range(1, 6)],
+            'top_tasks': [make_task(i) for i in range(1, 6)],
+            'top_items': [make_item(i) for i in range(1, 6)],
+            'total_users': 10000, 'total_tasks': 120, 'total_submissions': 50000,
+            'pending_submissions': 300, 'total_orders': 8000, 'pending_orders': 40,
+        },
+        'eco/edit_profile.html': lambda: {'form': UserProfileForm(instance=user.profile)},
+        'eco/home.html': lambda: {
+            'featured_tasks': [make_task(i) for i in range(1, 4)],
+            'total_tasks': 120, 'total_users': 10000, 'total_submissions': 50000,
+            'completed_tasks': 12, 'rank': 42, 'impact_score': 120,
+        },
+        'eco/login.html': lambda: {},
+        'eco/manage_orders.html': lambda: {'orders': [make_order(i, user) for i in n], 'status_filter': 'pending'},
+        'eco/moderation_dashboard.html': lambda: {
+            'submissions': [make_submission(i, user) for i in n], 'status_filter': 'pending',
+        },
+        'eco/my_submissions.html': lambda: {
+            'submissions': keyset_page(lambda i: make_submission(i, user), rows),
+            'status': None, 'status_choices': TaskSubmission.STATUS_CHOICES,
+        },
+        'eco/my_submissions_rows.html': lambda: {'submissions': keyset_page(lambda i: make_submission(i, user), rows)},
+        'eco/notifications.html': lambda: {'notifications': [make_notification(i) for i in n]},
+        'eco/orders.html': lambda: {'orders': keyset_page(lambda i: make_order(i, user), rows)},
+        'eco/orders_rows.html': lambda: {'orders': keyset_page(lambda i: make_order(i, user), rows)},
+        'eco/profile.html': lambda: {
+            'profile': user.profile,
+            'recent_transactions': [make_transaction(i) for i in range(1, 11)],
+            'recent_submissions': [make_submission(i, user) for i in range(1, 6)],
+            'completed_tasks': 12, 'rank': 42, 'impact_score': 120,
+        },
+        'eco/redeem_item.html': lambda: {'item': make_item(1)},
+        'eco/reject_submission.html': lambda: {'submission': make_submission(1, user)},
+        'eco/signup.html': lambda: {'form': SignUpForm()},
+        'eco/store.html': lambda: {'items': [make_item(i) for i in n], 'user_balance': 420},
+        'eco/submit_task.html': lambda: {'form': TaskSubmissionForm(), 'task': make_task(1)},
+        'eco/task_detail.html': lambda: {'task': make_task(1), 'user_submission': make_submission(1, user)},
+        'eco/tasks.html': lambda: {'tasks': page_of(make_tasks(rows))},
+        'eco/transactions.html': lambda: {'transactions': keyset_page(make_transaction, rows)},
+        'eco/transactions_rows.html': lambda: {'transactions': keyset_page(make_transaction, rows)},
+    }
+    return contexts[name]() if name in contexts else {}
+
+
+# Templates whose output grows with the number of rows; the rest render once
+LIST_TEMPLATES = {
+    'eco/manage_orders.html', 'eco/moderation_dashboard.html', 'eco/my_submissions.html',
+    'eco/my_submissions_rows.html', 'eco/notifications.html', 'eco/orders.html', 'eco/orders_rows.html',
+    'eco/store.html', 'eco/tasks.html', 'eco/transactions.html', 'eco/transactions_rows.html',
+}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark rendering of every eco template and fail on regressions against a stored baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', default='10,100,1000', help='List sizes for list templates')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Timed renders per case (the fastest is kept, to filter out noise)')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file')
+        parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline')
+        parser.add_argument('--threshold', type=float, default=settings.TEMPLATE_BENCH_THRESHOLD,
+                            help='Allowed slowdown in percent before the run fails')
+        parser.add_argument('--template', action='append', help='Only these templates (repeatable)')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        engine = engines['django']
+        sizes = [int(value) for value in options['rows'].split(',')]
+        names = options['template'] or template_names()
+
+        request = RequestFactory().get('/')
+        request.user = make_user(staff=True)
+
+        results = {}
+        for name in names:
+            template = engine.get_template(name)
+            for rows in (sizes if name in LIST_TEMPLATES else [1]):
+                context = context_for(name, rows, request.user)
+                template.render(context, request)  # warm caches, lazy attributes
+
+                timings = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    template.render(context, request)
+                    timings.append(time.perf_counter() - start)
+
+                tracemalloc.start()
+                template.render(context, request)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                key = f'{name}@{rows}'
+                results[key] = {'ms': min(timings) * 1000, 'peak_kib': peak / 1024}
+                self.stdout.write(f"{key:<40} {results[key]['ms']:>9.2f} ms  {results[key]['peak_kib']:>9.1f} KiB peak")
+
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(options['baseline']), exist_ok=True)
+            with open(options['baseline'], 'w') as fh:
+                json.dump(results, fh, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {options['baseline']}"))
+            return
+
+        self.compare(results, options['baseline'], options['threshold'])
+
+    def compare(self, results, path, threshold):
+        if not os.path.exists(path):
+            self.stdout.write(self.style.WARNING(f'No baseline at {path}; run with --save-baseline first'))
+            return
+        with open(path) as fh:
+            baseline = json.load(fh)
+
+        regressions = []
+        for key, result in results.items():
+            if key not in baseline:
+                continue
+            for metric in ('ms', 'peak_kib'):
+                before, after = baseline[key][metric], result[metric]
+                if before and (after - before) / before * 100 > threshold:
+                    regressions.append(f'{key} {metric}: {before:.2f} -> {after:.2f} (+{(after / before - 1) * 100:.0f}%)')
+
+        if regressions:
+            for line in regressions:
+                self.stderr.write(line)
+            raise CommandError(f'{len(regressions)} template rendering regressions above {threshold}%')
+        self.stdout.write(self.style.SUCCESS(f'No regressions above {threshold}%'))
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from eco.models import ResumableUpload
+
+
+class Command(BaseCommand):
+    help = 'Delete resumable uploads that were abandoned or never attached to a form'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=settings.UPLOAD_RESUMABLE_TTL_HOURS,
+                            help='Age after which an upload is considered abandoned')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        stale = ResumableUpload.objects.filter(created_at__lt=cutoff)
+        count = 0
+        for upload in stale.iterator():
+            upload.discard()
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} stale uploads'))
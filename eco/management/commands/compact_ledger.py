@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from eco import ledger
+
+
+class Command(BaseCommand):
+    help = 'Roll old CoinTransaction rows into monthly summaries and move them to the archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horizon-days', type=int, default=settings.LEDGER_COMPACTION_HORIZON_DAYS,
+                            help='Keep transactions newer than this many days (rounded down to a month)')
+        parser.add_argument('--export', metavar='PATH',
+                            help='Also append archived rows to this gzip-compressed JSON-lines file')
+
+    def handle(self, *args, **options):
+        cutoff = ledger.compaction_cutoff(horizon_days=options['horizon_days'])
+        self.stdout.write(f'Compacting transactions created before {cutoff:%Y-%m-%d}')
+
+        def progress(user_id, moved):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  user {user_id}: {moved} rows')
+
+        total = ledger.compact(cutoff, export_path=options['export'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'Archived {total} transactions'))
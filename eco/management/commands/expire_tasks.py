@@ -0,0 +1,31 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from eco import expiry
+
+
+class Command(BaseCommand):
+    help = 'Deactivate tasks whose deadline has passed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=expiry.BATCH_SIZE)
+        parser.add_argument('--watch', action='store_true',
+                            help='Keep running and expire each task as its deadline passes')
+
+    def handle(self, *args, **options):
+        expired = expiry.expire_due_tasks(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Expired {expired} tasks'))
+        if not options['watch']:
+            return
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+
+        timer = expiry.ExpiryTimer(options['batch_size'])
+        timer.start()
+        self.stdout.write(f'Watching deadlines; next check at {timer.next_run:%Y-%m-%d %H:%M:%S}')
+        stop.wait()
+        timer.stop()
@@ -0,0 +1,186 @@
+import http.client
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.middleware.csrf import get_token
+from django.test import Client, RequestFactory
+from django.test.utils import setup_test_environment
+
+from eco.benchmarks import BENCH_PASSWORD, BENCH_USERNAME, format_summary, get_bench_user, summarize
+
+READ_PATHS = ['/', '/tasks/', '/store/', '/profile/', '/transactions/']
+
+# `defaults` is gunicorn without our configuration: one sync worker
+DEFAULT_CONFIGS = ['defaults', 'auto']
+
+
+def parse_config(spec):
+    """'label' or 'label:NAME=value,NAME=value' -> (label, env overrides)"""
+    label, _, assignments = spec.partition(':')
+    env = {}
+    for assignment in filter(None, assignments.split(',')):
+        name, sep, value = assignment.partition('=')
+        if not sep:
+            raise CommandError(f'Bad setting {assignment!r} in --config {spec!r}')
+        env[name.strip()] = value.strip()
+    return label, env
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Start gunicorn with each configuration and compare throughput and tail latency of fast '
+        'reads while slow clients trickle uploads. Configurations are "defaults", "auto" or '
+        '"label:GUNICORN_WORKERS=4,GUNICORN_WORKER_CLASS=sync,...".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--config', action='append', dest='configs',
+                            help=f'Repeatable; default: {" ".join(DEFAULT_CONFIGS)}')
+        parser.add_argument('--seconds', type=float, default=15)
+        parser.add_argument('--concurrency', type=int, default=16, help='Concurrent readers')
+        parser.add_argument('--slow-uploads', type=int, default=4, help='Concurrent slow uploaders')
+        parser.add_argument('--upload-kb', type=int, default=256, help='Size of each upload')
+        parser.add_argument('--upload-kbps', type=int, default=64, help='Upload speed of each slow client')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        self.session, self.csrf = self.login()
+        for label, env in map(parse_config, options['configs'] or DEFAULT_CONFIGS):
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{label} {env or ""}'))
+            port = free_port()
+            server = self.start_server(label, env, port)
+            try:
+                self.run_load(port, options)
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=60)
+
+    def login(self):
+        """Session and CSRF cookies for the bench user, shared with the server through the session store"""
+        get_bench_user()
+        client = Client()
+        if not client.login(username=BENCH_USERNAME, password=BENCH_PASSWORD):
+            raise CommandError('Could not log in the bench user')
+        request = RequestFactory().get('/')
+        token = get_token(request)
+        return client.cookies[settings.SESSION_COOKIE_NAME].value, (request.META['CSRF_COOKIE'], token)
+
+    def start_server(self, label, env, port):
+        command = [sys.executable, '-m', 'gunicorn', 'ecoapp.wsgi', '--bind', f'127.0.0.1:{port}']
+        if label != 'defaults':
+            command += ['-c', 'python:ecoapp.gunicorn_conf']
+        server = subprocess.Popen(command, env={**os.environ, **env}, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.PIPE, text=True)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'gunicorn exited: {server.stderr.read()[-2000:]}')
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                conn.request('GET', '/')
+                conn.getresponse().read()
+                conn.close()
+                threading.Thread(target=server.stderr.read, daemon=True).start()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.kill()
+        raise CommandError('gunicorn did not start within 60s')
+
+    def headers(self):
+        return {
+            'Cookie': f'{settings.SESSION_COOKIE_NAME}={self.session}; {settings.CSRF_COOKIE_NAME}={self.csrf[0]}',
+            'X-CSRFToken': self.csrf[1],
+            'Host': 'localhost',
+        }
+
+    def run_load(self, port, options):
+        deadline = time.monotonic() + options['seconds']
+        reads, uploads, errors = [], [], []
+
+        def reader(seed):
+            rng = random.Random(seed)
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    conn.request('GET', rng.choice(READ_PATHS), headers=self.headers())
+                    response = conn.getresponse()
+                    response.read()
+                except (OSError, http.client.HTTPException) as exc:
+                    errors.append(repr(exc))
+                    conn.close()
+                    continue
+                if response.status != 200:
+                    errors.append(f'GET {response.status}')
+                    continue
+                reads.append(time.perf_counter() - start)
+            conn.close()
+
+        def uploader():
+            size = options['upload_kb'] * 1024
+            piece = b'\0' * 4096
+            pause = len(piece) / (options['upload_kbps'] * 1024)
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+                try:
+                    conn.request('POST', '/uploads/', headers={
+                        **self.headers(), 'Upload-Length': str(size), 'Upload-Field': 'image',
+                    })
+                    response = conn.getresponse()
+                    location = response.getheader('Location')
+                    response.read()
+                    if response.status != 201:
+                        errors.append(f'POST /uploads/ {response.status}')
+                        time.sleep(1)
+                        continue
+                    conn.putrequest('PATCH', location, skip_host=True)
+                    for name, value in {**self.headers(), 'Upload-Offset': '0', 'Content-Length': str(size),
+                                        'Content-Type': 'application/offset+octet-stream'}.items():
+                        conn.putheader(name, value)
+                    conn.endheaders()
+                    for _ in range(size // len(piece)):
+                        conn.send(piece)
+                        time.sleep(pause)
+                    response = conn.getresponse()
+                    response.read()
+                    if response.status != 204:
+                        errors.append(f'PATCH {response.status}')
+                        continue
+                    conn.request('DELETE', location, headers=self.headers())
+                    conn.getresponse().read()
+                    uploads.append(time.perf_counter() - start)
+                except (OSError, http.client.HTTPException) as exc:
+                    errors.append(repr(exc))
+                finally:
+                    conn.close()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(options['concurrency'])]
+        threads += [threading.Thread(target=uploader) for _ in range(options['slow_uploads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(format_summary('reads', summarize(reads, elapsed)))
+        if options['slow_uploads']:
+            self.stdout.write(format_summary('slow uploads', summarize(uploads, elapsed)))
+        if errors:
+            self.stdout.write(self.style.ERROR(f'{len(errors)} errors, e.g. {errors[0]}'))
@@ -0,0 +1,79 @@
+import glob
+import io
+import json
+import os
+import pstats
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'List the slowest requests captured by ProfilingMiddleware, or show one in detail'
+
+    def add_arguments(self, parser):
+        parser.add_argument('capture_id', nargs='?', help='Show pstats and SQL timeline for this capture')
+        parser.add_argument('--url-name', help='Only captures for this URL name')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--sort', default='cumulative', help='pstats sort key for the detail view')
+
+    def handle(self, *args, **options):
+        pattern = os.path.join(settings.PROFILING_DIR, options['url_name'] or '*', '*.json')
+        captures = []
+        for path in glob.glob(pattern):
+            with open(path) as fh:
+                meta = json.load(fh)
+            meta['path_on_disk'] = path
+            captures.append(meta)
+
+        if options['capture_id']:
+            matches = [c for c in captures if c['id'] == options['capture_id']]
+            if not matches:
+                raise CommandError(f"No capture {options['capture_id']!r} under {settings.PROFILING_DIR}")
+            return self.detail(matches[0], options)
+
+        if not captures:
+            self.stdout.write(f'No captures under {settings.PROFILING_DIR}')
+            return
+
+        self.stdout.write(
+            f"{'id':<25} {'url name':<24} {'status':>6} {'total ms':>9} {'sql ms':>8} "
+            f"{'queries':>7} {'tmpl ms':>8}  path"
+        )
+        captures.sort(key=lambda c: c['total_ms'], reverse=True)
+        for c in captures[:options['limit']]:
+            self.stdout.write(
+                f"{c['id']:<25} {c['url_name']:<24} {c['status']:>6} {c['total_ms']:>9.1f} "
+                f"{c['sql_ms']:>8.1f} {c['sql_count']:>7} {c['template_ms']:>8.1f}  {c['path']}"
+            )
+
+        self.stdout.write('')
+        self.stdout.write('Per URL name (mean of captures):')
+        by_name = {}
+        for c in captures:
+            by_name.setdefault(c['url_name'], []).append(c)
+        rows = sorted(by_name.items(), key=lambda item: -sum(c['total_ms'] for c in item[1]) / len(item[1]))
+        for name, group in rows:
+            n = len(group)
+            self.stdout.write(
+                f"  {name:<24} {n:>4} captures  total {sum(c['total_ms'] for c in group) / n:>8.1f} ms  "
+                f"sql {sum(c['sql_ms'] for c in group) / n:>7.1f} ms  "
+                f"templates {sum(c['template_ms'] for c in group) / n:>7.1f} ms"
+            )
+
+    def detail(self, capture, options):
+        self.stdout.write(
+            f"{capture['method']} {capture['path']} -> {capture['status']}  "
+            f"total {capture['total_ms']} ms, sql {capture['sql_ms']} ms in {capture['sql_count']} queries, "
+            f"templates {capture['template_ms']} ms"
+        )
+        self.stdout.write('')
+        self.stdout.write('SQL timeline:')
+        for query in capture['queries']:
+            self.stdout.write(f"  +{query['at_ms']:>9.2f} ms  {query['ms']:>8.2f} ms  {query['sql'][:160]}")
+        self.stdout.write('')
+        prof = capture['path_on_disk'][:-len('.json')] + '.prof'
+        report = io.StringIO()
+        stats = pstats.Stats(prof, stream=report)
+        stats.strip_dirs().sort_stats(options['sort']).print_stats(25)
+        self.stdout.write(report.getvalue())
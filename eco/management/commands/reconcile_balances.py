@@ -0,0 +1,133 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Max, Min
+
+from eco import ledger
+from eco.models import UserProfile
+
+DEFAULT_CHECKPOINT = '/var/tmp/ecoapp_reconcile_balances.json'
+
+# Drifted users listed per shard; the rest are only counted
+REPORT_LIMIT = 100
+
+
+def id_ranges(first, last, size):
+    start = first
+    while start <= last:
+        yield start, min(start + size - 1, last)
+        start += size
+
+
+def init_worker():
+    import django
+    django.setup()
+
+
+def repair_user(user_id):
+    """Set one user's coin_balance to the ledger balance; returns True if it changed"""
+    with transaction.atomic():
+        # add_coins/spend_coins update the profile row before writing the ledger,
+        # so under this lock the ledger sum includes every committed change
+        profile = UserProfile.objects.select_for_update().filter(user_id=user_id).first()
+        balance = ledger.balances(user_id, user_id).get(user_id, 0)
+        if profile is None or profile.coin_balance == balance:
+            return False
+        UserProfile.objects.filter(pk=profile.pk).update(coin_balance=balance)
+    return True
+
+
+def check_shard(first, last, chunk_size, repair):
+    """Compare stored and ledger balances for users first..last, one chunk of users at a time"""
+    result = {'first': first, 'checked': 0, 'drifted': 0, 'repaired': 0, 'drift': []}
+    for low, high in id_ranges(first, last, chunk_size):
+        stored = dict(
+            UserProfile.objects.filter(user_id__gte=low, user_id__lte=high)
+            .values_list('user_id', 'coin_balance')
+        )
+        if not stored:
+            continue
+        expected = ledger.balances(low, high)
+        for user_id, balance in stored.items():
+            result['checked'] += 1
+            if balance == expected.get(user_id, 0):
+                continue
+            result['drifted'] += 1
+            if len(result['drift']) < REPORT_LIMIT:
+                result['drift'].append((user_id, balance, expected.get(user_id, 0)))
+            if repair and repair_user(user_id):
+                result['repaired'] += 1
+    connections.close_all()
+    return result
+
+
+class Command(BaseCommand):
+    help = 'Check every UserProfile.coin_balance against the coin ledger in parallel, and optionally repair drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Worker processes, each checking one shard of user ids at a time')
+        parser.add_argument('--shard-size', type=int, default=50000, help='User ids per shard')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='User ids per grouped ledger aggregate within a shard')
+        parser.add_argument('--repair', action='store_true',
+                            help='Set drifted balances to the ledger balance')
+        parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT,
+                            help='Progress file; an interrupted run resumes from it')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint')
+
+    def handle(self, *args, **options):
+        bounds = UserProfile.objects.aggregate(first=Min('user_id'), last=Max('user_id'))
+        if bounds['first'] is None:
+            self.stdout.write('No users')
+            return
+
+        run = {'first': bounds['first'], 'shard_size': options['shard_size'], 'repair': options['repair']}
+        state = self.load_checkpoint(options['checkpoint'], run, options['restart'])
+        pending = [
+            shard for shard in id_ranges(bounds['first'], bounds['last'], options['shard_size'])
+            if str(shard[0]) not in state['done']
+        ]
+        if state['done']:
+            self.stdout.write(f"Resuming: {len(state['done'])} shards already checked")
+
+        # Forked children must not share the parent's database connection
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker) as pool:
+            futures = [
+                pool.submit(check_shard, first, last, options['chunk_size'], options['repair'])
+                for first, last in pending
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                for user_id, stored, expected in result.pop('drift'):
+                    self.stdout.write(f'User {user_id}: balance {stored}, ledger {expected}')
+                state['done'][str(result.pop('first'))] = result
+                self.save_checkpoint(options['checkpoint'], state)
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"  {len(state['done'])} shards checked")
+
+        totals = {key: sum(shard[key] for shard in state['done'].values()) for key in ('checked', 'drifted', 'repaired')}
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {totals['checked']} users: {totals['drifted']} drifted, {totals['repaired']} repaired"
+        ))
+        if os.path.exists(options['checkpoint']):
+            os.unlink(options['checkpoint'])
+
+    def load_checkpoint(self, path, run, restart):
+        if not restart and os.path.exists(path):
+            with open(path) as fh:
+                state = json.load(fh)
+            if state.get('run') == run:
+                return state
+            self.stdout.write(self.style.WARNING(f'Ignoring checkpoint {path} from a run with different options'))
+        return {'run': run, 'done': {}}
+
+    def save_checkpoint(self, path, state):
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(state, fh)
+        os.replace(tmp, path)
@@ -0,0 +1,61 @@
+import math
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from eco.models import EcoTask, TaskSubmission
+
+STATUSES = [status for status, _ in TaskSubmission.STATUS_CHOICES]
+COUNTER_FIELDS = ['submission_count'] + [f'{status}_count' for status in STATUSES]
+
+
+def expected_counters(counts_by_status):
+    """Counter field values for a ``{status: count}`` mapping"""
+    fields = {f'{status}_count': counts_by_status.get(status, 0) for status in STATUSES}
+    fields['submission_count'] = sum(fields.values())
+    fields['completion_rate'] = fields['approved_count'] / max(fields['submission_count'], 1)
+    return fields
+
+
+def in_sync(current, expected):
+    """Counters equal exactly; the rate, computed in SQL or Python, within rounding"""
+    return (
+        all(current[field] == expected[field] for field in COUNTER_FIELDS)
+        and math.isclose(current['completion_rate'], expected['completion_rate'], rel_tol=1e-9, abs_tol=1e-12)
+    )
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized per-task submission counters and repair any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without fixing it')
+
+    def handle(self, *args, **options):
+        actual = {}
+        rows = TaskSubmission.objects.values('task_id', 'status').annotate(n=Count('id')).order_by()
+        for row in rows:
+            actual.setdefault(row['task_id'], {})[row['status']] = row['n']
+
+        drifted = 0
+        for task in EcoTask.objects.only('id', 'completion_rate', *COUNTER_FIELDS).iterator():
+            expected = expected_counters(actual.get(task.id, {}))
+            current = {field: getattr(task, field) for field in expected}
+            if in_sync(current, expected):
+                continue
+
+            drifted += 1
+            self.stdout.write(f'Task {task.id}: {current} -> {expected}')
+            if not options['dry_run']:
+                with transaction.atomic():
+                    # Recount under the row lock so concurrent adjustments are not lost
+                    EcoTask.objects.select_for_update().filter(pk=task.id).first()
+                    counts = dict(
+                        TaskSubmission.objects.filter(task_id=task.id)
+                        .values_list('status').annotate(n=Count('id')).order_by()
+                    )
+                    EcoTask.objects.filter(pk=task.id).update(**expected_counters(counts))
+
+        verb = 'Found' if options['dry_run'] else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {drifted} tasks with drifted counters'))
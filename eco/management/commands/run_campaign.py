@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from eco import campaigns
+from eco.models import Campaign
+
+
+class Command(BaseCommand):
+    help = 'Credit a campaign\'s coins to every user in its segment (safe to re-run)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('campaign_id', type=int)
+        parser.add_argument('--chunk-size', type=int, default=campaigns.CHUNK_SIZE,
+                            help='Users credited per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the users who would be credited')
+
+    def handle(self, *args, **options):
+        try:
+            campaign = Campaign.objects.get(pk=options['campaign_id'])
+        except Campaign.DoesNotExist:
+            raise CommandError(f"No campaign with id {options['campaign_id']}")
+
+        total = campaigns.pending(campaign).count()
+        self.stdout.write(f'{campaign}: {total} users to credit')
+        if options['dry_run'] or not total:
+            return
+
+        started = time.monotonic()
+
+        def progress(granted):
+            elapsed = time.monotonic() - started
+            rate = granted / elapsed if elapsed else 0
+            self.stdout.write(f'  {granted}/{total} users ({granted * 100 // total}%), {rate:.0f} users/s')
+
+        granted = campaigns.run(campaign, chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Credited {granted} users with {campaign.coin_amount} coins in {time.monotonic() - started:.1f}s'
+        ))
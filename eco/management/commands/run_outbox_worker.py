@@ -0,0 +1,107 @@
+import logging
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from eco import expiry, outbox
+
+logger = logging.getLogger(__name__)
+
+# Longest pause after consecutive failed batches (database down, bad deploy)
+MAX_ERROR_BACKOFF_SECONDS = 60
+
+
+class Command(BaseCommand):
+    help = 'Deliver outbox events (notifications and other side effects) in parallel worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.OUTBOX_WORKERS,
+                            help='Number of worker processes claiming batches in parallel')
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--poll-interval', type=float, default=settings.OUTBOX_POLL_SECONDS,
+                            help='Seconds to sleep when no events are due')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain all due events in this process and exit')
+        parser.add_argument('--expire-tasks', action='store_true',
+                            help='Also deactivate tasks as their deadlines pass (see expire_tasks); '
+                                 'with --once, expire the overdue tasks once')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        if options['once']:
+            if options['expire_tasks']:
+                expired = expiry.expire_due_tasks()
+                self.stdout.write(f'Expired {expired} tasks')
+            total = 0
+            while True:
+                claimed = outbox.process_batch(batch_size)
+                total += claimed
+                if claimed < batch_size:
+                    break
+            purged = outbox.purge()
+            self.stdout.write(self.style.SUCCESS(f'Processed {total} events, purged {purged}'))
+            return
+
+        # Forked children must not share the parent's database connection
+        connections.close_all()
+        stop = multiprocessing.Event()
+        workers = [
+            multiprocessing.Process(
+                target=run_worker,
+                # One worker is enough to purge old events
+                args=(stop, batch_size, options['poll_interval'], i == 0),
+                name=f'outbox-worker-{i}',
+            )
+            for i in range(options['workers'])
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f'Started {len(workers)} outbox workers')
+
+        timer = None
+        if options['expire_tasks']:
+            timer = expiry.ExpiryTimer()
+            timer.start()
+
+        def shutdown(signum, frame):
+            stop.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        for worker in workers:
+            worker.join()
+        if timer:
+            timer.stop()
+        self.stdout.write('Outbox workers stopped')
+
+
+def run_worker(stop, batch_size, poll_interval, purge=False):
+    # Let the parent decide when to stop; finish the current batch first
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    failures = 0
+    purged_at = None
+    while not stop.is_set():
+        close_old_connections()
+        try:
+            claimed = outbox.process_batch(batch_size)
+            if purge and (purged_at is None or time.monotonic() - purged_at >= settings.OUTBOX_PURGE_INTERVAL_SECONDS):
+                outbox.purge()
+                purged_at = time.monotonic()
+        except Exception:
+            # Keep the worker alive; a broken connection is replaced on the next pass
+            failures += 1
+            delay = min(poll_interval * 2 ** failures, MAX_ERROR_BACKOFF_SECONDS)
+            logger.exception('Outbox batch failed; retrying in %ss', delay)
+            connections.close_all()
+            stop.wait(delay)
+            continue
+        failures = 0
+        if claimed < batch_size:
+            stop.wait(poll_interval)
+    connections.close_all()
@@ -0,0 +1,154 @@
+"""
+Access-controlled delivery of uploaded media (/media/<path>).
+
+Django only decides who may see a file. Public uploads (store items, task
+examples, profile photos) are visible to everyone; a submission photo only
+to the member who sent it and to moderators. The bytes are then sent by the
+front server, so a worker spends no longer on a photo than on the check:
+
+* MEDIA_ACCEL=nginx answers with ``X-Accel-Redirect`` to the internal
+  location MEDIA_ACCEL_PREFIX, which nginx maps onto MEDIA_ROOT::
+
+      location /protected-media/ { internal; alias /var/www/ecoapp/media/; }
+
+* MEDIA_ACCEL=sendfile answers with ``X-Sendfile`` (Apache mod_xsendfile,
+  lighttpd) and the absolute path.
+* Otherwise the view returns a ``FileResponse``, which gunicorn sends with
+  sendfile(2), and answers single ``Range`` requests itself.
+
+/media/ must then no longer be served directly by the front server.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date
+
+from .images import PUBLIC_PREFIXES
+from .models import TaskSubmission
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def resolve(name):
+    """
+    (absolute path, normalized name) of a media file, refusing ``..`` and
+    anything outside MEDIA_ROOT. Access checks must use the normalized name.
+    """
+    if '..' in name.replace('\\', '/').split('/'):
+        raise Http404('No such file')
+    media_root = os.path.realpath(settings.MEDIA_ROOT)
+    path = os.path.realpath(os.path.join(media_root, name))
+    if not path.startswith(media_root + os.sep) or not os.path.isfile(path):
+        raise Http404('No such file')
+    return path, os.path.relpath(path, media_root).replace(os.sep, '/')
+
+
+def is_public(name):
+    return name.startswith(PUBLIC_PREFIXES)
+
+
+def can_view(user, name):
+    """Whether ``user`` may see the private media file ``name``"""
+    if not user.is_authenticated:
+        return False
+    if user.is_staff or user.is_superuser:
+        return True
+    if name.startswith('submissions/'):
+        return TaskSubmission.objects.filter(image=name, user=user).exists()
+    return False
+
+
+class FileSlice:
+    """The first ``length`` bytes of a file object from its current position"""
+
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def byte_range(header, size):
+    """(start, end) inclusive for a single-range header, None to send everything, or 'invalid'"""
+    match = RANGE_RE.match(header or '')
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # The last N bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return 'invalid'
+    return start, end
+
+
+def file_response(request, path, stat, content_type):
+    """FileResponse for the whole file or one byte range of it"""
+    span = byte_range(request.headers.get('Range'), stat.st_size)
+    if span == 'invalid':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+
+    f = open(path, 'rb')
+    if span is None:
+        response = FileResponse(f, content_type=content_type)
+    else:
+        start, end = span
+        f.seek(start)
+        if end == stat.st_size - 1:
+            # Open-ended ranges keep the real file, so sendfile still applies
+            response = FileResponse(f, content_type=content_type, status=206)
+        else:
+            response = FileResponse(FileSlice(f, end - start + 1), content_type=content_type, status=206)
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def serve(request, name):
+    """The response for /media/<name>, after checking access"""
+    path, name = resolve(name)
+    public = is_public(name)
+    if not public and not can_view(request.user, name):
+        # Indistinguishable from a missing file
+        raise Http404('No such file')
+
+    stat = os.stat(path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    elif settings.MEDIA_ACCEL == 'nginx':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(name)
+    elif settings.MEDIA_ACCEL == 'sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+    else:
+        response = file_response(request, path, stat, content_type)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    # Uploads never change in place (storage adds a suffix instead of overwriting)
+    response['Cache-Control'] = 'public, max-age=86400' if public else 'private, max-age=3600'
+    if not public:
+        response['Vary'] = 'Cookie'
+    return response
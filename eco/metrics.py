@@ -0,0 +1,294 @@
+"""
+Counters and histograms in Prometheus text format, across processes.
+
+Each process records into plain dicts guarded by a lock, which costs about
+a microsecond per observation. At most every METRICS_FLUSH_SECONDS (checked
+after each request, and at exit) the process writes a snapshot of
+everything it has recorded to METRICS_DIR/<pid>.json. A scrape of /metrics
+adds up the files of every process. When gunicorn reaps a worker its file
+is folded into archive.json (``mark_process_dead``), so counters do not go
+backwards when workers are recycled; a master folds in files left by dead
+processes when it starts (``sweep``).
+
+    REDEMPTIONS.inc()
+    COINS_ISSUED.inc(50)
+    REQUEST_LATENCY.observe(0.012, 'tasks')
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = {}
+_next_flush = 0.0
+# [query count, seconds] of the request this thread is serving, or None
+_local = threading.local()
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+        self.lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def inc(self, amount=1, *labels):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return {json.dumps(labels): value for labels, value in self.series.items()}
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def expose(self, series):
+        for key, value in sorted(series.items()):
+            yield f'{self.name}{format_labels(self.labelnames, json.loads(key))} {value}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self.series = {}
+        self.lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {json.dumps(labels): list(series) for labels, series in self.series.items()}
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def expose(self, series):
+        bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+        for key, values in sorted(series.items()):
+            labels = json.loads(key)
+            cumulative = 0
+            for bound, count in zip(bounds, values):
+                cumulative += count
+                le = format_labels(self.labelnames + ('le',), labels + [bound])
+                yield f'{self.name}_bucket{le} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labelnames, labels)} {values[-1]}'
+            yield f'{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+# Requests, per URL name from eco/urls.py
+REQUESTS = Counter('eco_http_requests_total', 'HTTP requests', ['view', 'method', 'status'])
+REQUEST_LATENCY = Histogram('eco_http_request_duration_seconds', 'Time to produce a response', ['view'])
+DB_QUERIES = Counter('eco_db_queries_total', 'SQL queries run while serving requests', ['view'])
+DB_TIME = Counter('eco_db_query_seconds_total', 'Time spent in SQL while serving requests', ['view'])
+CACHE_REQUESTS = Counter('eco_cache_requests_total', 'Cache lookups', ['cache', 'result'])
+
+# Business events
+SUBMISSIONS_REVIEWED = Counter('eco_submissions_reviewed_total', 'Submissions approved or rejected', ['status'])
+REDEMPTIONS = Counter('eco_redemptions_total', 'Store items redeemed')
+COINS_ISSUED = Counter('eco_coins_issued_total', 'Coins credited to users')
+COINS_SPENT = Counter('eco_coins_spent_total', 'Coins debited from users')
+
+
+def cache_lookup(cache_name, hit):
+    CACHE_REQUESTS.inc(1, cache_name, 'hit' if hit else 'miss')
+
+
+# SQL time of the current request
+
+def sql_timer(execute, sql, params, many, context):
+    """Execute wrapper installed once per connection; records only while a request is measured"""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        state = getattr(_local, 'sql', None)
+        if state is not None:
+            state[0] += 1
+            state[1] += time.perf_counter() - start
+
+
+def install_sql_timer(sender, connection, **kwargs):
+    # connection_created receiver; the wrappers list outlives reconnects
+    if sql_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, sql_timer)
+
+
+def start_request():
+    _local.sql = state = [0, 0.0]
+    return state
+
+
+def end_request():
+    _local.sql = None
+
+
+# Per-process files
+
+def process_file(pid=None):
+    return os.path.join(settings.METRICS_DIR, f'{pid or os.getpid()}.json')
+
+
+def write_json(path, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+@contextmanager
+def locked(exclusive=False):
+    """Lock METRICS_DIR against archive merges (shared for readers)"""
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    with open(os.path.join(settings.METRICS_DIR, '.lock'), 'a') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+
+def flush():
+    """Write this process's metrics to its file"""
+    global _next_flush
+    _next_flush = time.monotonic() + settings.METRICS_FLUSH_SECONDS
+    data = {name: metric.snapshot() for name, metric in REGISTRY.items()}
+    if not any(data.values()):
+        return
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    write_json(process_file(), data)
+
+
+def maybe_flush():
+    if time.monotonic() >= _next_flush:
+        flush()
+
+
+def merge_into(total, data):
+    for name, series in data.items():
+        metric = REGISTRY.get(name)
+        if metric is None:
+            continue
+        merged = total.setdefault(name, {})
+        for key, value in series.items():
+            merged[key] = metric.merge(merged.get(key), value)
+    return total
+
+
+def mark_process_dead(pid):
+    """Fold an exited process's file into the archive (gunicorn's child_exit hook)"""
+    path = process_file(pid)
+    if not os.path.exists(path):
+        return
+    with locked(exclusive=True):
+        archive = os.path.join(settings.METRICS_DIR, 'archive.json')
+        write_json(archive, merge_into(read_json(archive), read_json(path)))
+        os.remove(path)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def sweep():
+    """
+    Fold the files of processes that are gone into the archive (the gunicorn
+    master at startup). Several masters may share METRICS_DIR, so the files of
+    live processes and the archive are left alone.
+    """
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+        name = os.path.basename(path)[:-len('.json')]
+        if name.isdigit() and not pid_alive(int(name)):
+            mark_process_dead(int(name))
+
+
+def discard():
+    """Forget what this process recorded without writing it anywhere"""
+    for metric in REGISTRY.values():
+        with metric.lock:
+            metric.series.clear()
+
+
+def collect():
+    """Every process's metrics added up: {metric name: {labels: value}}"""
+    flush()
+    total = {}
+    with locked():
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+            merge_into(total, read_json(path))
+    return total
+
+
+def exposition(gauges=()):
+    """Prometheus text format for all metrics, plus (name, help, value) gauges computed by the caller"""
+    total = collect()
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines += [f'# HELP {name} {metric.documentation}', f'# TYPE {name} {metric.kind}']
+        lines += metric.expose(total.get(name, {}))
+    for name, documentation, value in gauges:
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} gauge', f'{name} {value}']
+    return '\n'.join(lines) + '\n'
+
+
+@atexit.register
+def at_exit():
+    flush()
+    mark_process_dead(os.getpid())
@@ -0,0 +1,221 @@
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+from . import metrics, uploads
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = '_profile'
+
+# One cProfile at a time per process: from Python 3.12 a second enable() in
+# another thread raises, and the profiler sees every thread anyway
+profile_lock = threading.Lock()
+
+
+class SQLTimeline:
+    """``connection.execute_wrapper`` that records when each query ran and for how long"""
+
+    def __init__(self, started, limit):
+        self.started = started
+        self.limit = limit
+        self.queries = []
+        self.total = 0.0
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.total += duration
+            self.count += 1
+            if len(self.queries) < self.limit:
+                self.queries.append({
+                    'at_ms': round((start - self.started) * 1000, 3),
+                    'ms': round(duration * 1000, 3),
+                    'sql': sql,
+                })
+
+
+def template_time(stats):
+    """Cumulative seconds spent in top-level Django template rendering"""
+    return max(
+        (
+            entry[3]
+            for (filename, _, func), entry in stats.stats.items()
+            if func == 'render' and filename.endswith(os.path.join('template', 'backends', 'django.py'))
+        ),
+        default=0.0,
+    )
+
+
+class ProfilingMiddleware:
+    """
+    Profile selected requests with cProfile and save the stats to disk.
+
+    A request is profiled when a staff user sends ``X-Profile: 1`` or
+    ``?_profile=1``, or when it is the Nth request of this worker with
+    PROFILING_SAMPLE_RATE = N. Each capture writes ``<id>.prof`` (pstats) and
+    ``<id>.json`` (timings and SQL timeline) under PROFILING_DIR/<url name>/;
+    summarize them with ``manage.py profile_report``. Only the newest
+    PROFILING_KEEP_PER_URL captures of each URL name are kept. While one
+    request of the process is being profiled, others run unprofiled.
+
+    Must come after AuthenticationMiddleware. When PROFILING_ENABLED is off
+    the middleware removes itself from the stack at startup.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        self.counter = itertools.count(1)
+
+    def __call__(self, request):
+        if not self.should_profile(request) or not profile_lock.acquire(blocking=False):
+            return self.get_response(request)
+
+        try:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            timeline = SQLTimeline(started, settings.PROFILING_MAX_QUERIES)
+            with connection.execute_wrapper(timeline):
+                profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profiler.disable()
+            elapsed = time.perf_counter() - started
+        finally:
+            profile_lock.release()
+
+        capture_id = self.save(request, response, profiler, timeline, elapsed)
+        response['X-Profile-Id'] = capture_id
+        return response
+
+    def should_profile(self, request):
+        if self.sample_rate and next(self.counter) % self.sample_rate == 0:
+            return True
+        requested = request.META.get(PROFILE_HEADER) == '1' or PROFILE_PARAM in request.GET
+        return requested and request.user.is_staff
+
+    def save(self, request, response, profiler, timeline, elapsed):
+        match = request.resolver_match
+        url_name = (match.url_name if match else None) or 'unresolved'
+        directory = os.path.join(settings.PROFILING_DIR, url_name)
+        os.makedirs(directory, exist_ok=True)
+
+        capture_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        stats = pstats.Stats(profiler)
+        stats.dump_stats(os.path.join(directory, f'{capture_id}.prof'))
+        meta = {
+            'id': capture_id,
+            'url_name': url_name,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'total_ms': round(elapsed * 1000, 3),
+            'sql_ms': round(timeline.total * 1000, 3),
+            'sql_count': timeline.count,
+            'template_ms': round(template_time(stats) * 1000, 3),
+            'timestamp': time.time(),
+            'queries': timeline.queries,
+        }
+        with open(os.path.join(directory, f'{capture_id}.json'), 'w') as fh:
+            json.dump(meta, fh)
+        prune(directory, settings.PROFILING_KEEP_PER_URL)
+        return capture_id
+
+
+def prune(directory, keep):
+    """Delete all but the newest ``keep`` captures in ``directory``"""
+    captures = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.json'):
+            try:
+                captures.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+    captures.sort()
+    for _, path in captures[:max(len(captures) - keep, 0)]:
+        for name in (path, path[:-len('.json')] + '.prof'):
+            try:
+                os.unlink(name)
+            except FileNotFoundError:
+                pass  # pruned by another worker
+
+
+class MetricsMiddleware:
+    """
+    Count requests and record latency and SQL time per URL name (eco.metrics).
+
+    Goes first in MIDDLEWARE so the latency covers the whole stack. SQL is
+    timed by a wrapper installed once on each new connection, rather than per
+    request with ``execute_wrapper()``, which alone would cost ~5us. Removed
+    from the stack at startup when METRICS_ENABLED is off.
+    """
+    METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        connection_created.connect(metrics.install_sql_timer, dispatch_uid='eco.metrics.sql_timer')
+        for conn in connections.all(initialized_only=True):
+            metrics.install_sql_timer(None, conn)
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        sql = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request()
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = (match.url_name if match else None) or 'unresolved'
+        method = request.method if request.method in self.METHODS else 'other'
+        metrics.REQUESTS.inc(1, view, method, str(response.status_code))
+        metrics.REQUEST_LATENCY.observe(elapsed, view)
+        if sql[0]:
+            metrics.DB_QUERIES.inc(sql[0], view)
+            metrics.DB_TIME.inc(sql[1], view)
+        metrics.maybe_flush()
+        return response
+
+
+class UploadLimitMiddleware:
+    """
+    Answer 413 to a multipart body larger than any form may send, before the
+    CSRF check or the view read any of it. Goes before CsrfViewMiddleware.
+    Files over their own field's limit but within this one are cut off by
+    eco.uploads.BoundedUploadHandler instead, so the form can show the error.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.content_type == 'multipart/form-data':
+            try:
+                length = int(request.META.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                length = 0
+            if length > uploads.body_limit():
+                return HttpResponse(uploads.size_error(uploads.largest_limit()), status=413,
+                                    content_type='text/plain; charset=utf-8')
+        return self.get_response(request)
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:14
+
+from django.db import migrations, models
+
+
+def backfill_counters(apps, schema_editor):
+    EcoTask = apps.get_model('eco', 'EcoTask')
+    TaskSubmission = apps.get_model('eco', 'TaskSubmission')
+    counts = {}
+    rows = TaskSubmission.objects.values('task_id', 'status').annotate(n=models.Count('id')).order_by()
+    for row in rows:
+        counts.setdefault(row['task_id'], {})[f"{row['status']}_count"] = row['n']
+    for task_id, fields in counts.items():
+        fields['submission_count'] = sum(fields.values())
+        fields['completion_rate'] = fields.get('approved_count', 0) / fields['submission_count']
+        EcoTask.objects.filter(pk=task_id).update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eco', '0003_ledger_compaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ecotask',
+            name='approved_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ecotask',
+            name='completion_rate',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ecotask',
+            name='pending_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ecotask',
+            name='rejected_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ecotask',
+            name='submission_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='ecotask',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-submission_count', '-id'], name='eco_task_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ecotask',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-completion_rate', '-id'], name='eco_task_completion_idx'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
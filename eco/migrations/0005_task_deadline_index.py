@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eco', '0004_task_submission_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ecotask',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['deadline'], name='eco_task_deadline_idx'),
+        ),
+    ]
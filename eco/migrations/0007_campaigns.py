@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eco', '0006_resumableupload'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Campaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('coin_amount', models.PositiveIntegerField()),
+                ('message', models.CharField(help_text='Notification text sent with the grant', max_length=255)),
+                ('location', models.CharField(blank=True, max_length=100)),
+                ('min_age', models.PositiveIntegerField(blank=True, null=True)),
+                ('max_age', models.PositiveIntegerField(blank=True, null=True)),
+                ('active_within_days', models.PositiveIntegerField(blank=True, help_text='Only users who logged in within this many days', null=True)),
+                ('min_completed_tasks', models.PositiveIntegerField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('draft', 'Draft'), ('running', 'Running'), ('done', 'Done')], default='draft', max_length=20)),
+                ('granted_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CampaignGrant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grants', to='eco.campaign')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='campaign_grants', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('campaign', 'user')},
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eco', '0009_history_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tasksubmission',
+            index=models.Index(fields=['image'], name='eco_sub_image_idx'),
+        ),
+    ]
@@ -1,7 +1,17 @@
-from django.db import models
+import os
+import uuid
+
+from django.conf import settings
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
+
+from . import events, metrics
+from .cache import CATALOG, STORE, bump_namespace
 
 
 class UserProfile(models.Model):
@@ -10,44 +20,55 @@ class UserProfile(models.Model):
     location = models.CharField(max_length=100, blank=True)
     age = models.PositiveIntegerField(blank=True, null=True)
     bio = models.TextField(blank=True)
+    # coin_balance and last_seen_broadcast_id only change through UPDATEs; save
+    # the other fields with update_fields so a stale copy never writes them back
     coin_balance = models.IntegerField(default=0)
+    # Broadcasts up to this id have been read (see eco.broadcasts)
+    last_seen_broadcast_id = models.PositiveBigIntegerField(default=0)
     
     def __str__(self):
         return f"{self.user.username}'s Profile"
     
     def add_coins(self, amount, description=""):
-        self.coin_balance += amount
-        self.save()
-        CoinTransaction.objects.create(
-            user=self.user,
-            amount=amount,
-            transaction_type='earn',
-            description=description
-        )
+        # Increment in the database so concurrent updates are not lost
+        with transaction.atomic():
+            UserProfile.objects.filter(pk=self.pk).update(coin_balance=F('coin_balance') + amount)
+            CoinTransaction.objects.create(
+                user=self.user,
+                amount=amount,
+                transaction_type='earn',
+                description=description
+            )
+            self.refresh_from_db(fields=['coin_balance'])
+            events.publish(self.user_id, 'balance', balance=self.coin_balance)
+            transaction.on_commit(lambda: metrics.COINS_ISSUED.inc(amount))
     
     def spend_coins(self, amount, description=""):
-        if self.coin_balance >= amount:
-            self.coin_balance -= amount
-            self.save()
+        with transaction.atomic():
+            # The balance check and the deduction are one statement
+            spent = UserProfile.objects.filter(pk=self.pk, coin_balance__gte=amount).update(
+                coin_balance=F('coin_balance') - amount
+            )
+            self.refresh_from_db(fields=['coin_balance'])
+            if not spent:
+                return False
             CoinTransaction.objects.create(
                 user=self.user,
                 amount=amount,
                 transaction_type='spend',
                 description=description
             )
-            return True
-        return False
+            events.publish(self.user_id, 'balance', balance=self.coin_balance)
+            transaction.on_commit(lambda: metrics.COINS_SPENT.inc(amount))
+        return True
 
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
-        UserProfile.objects.create(user=instance)
-
-
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
+        # Announcements made before the user joined are not news to them
+        last_broadcast = Broadcast.objects.order_by('-id').values_list('id', flat=True).first()
+        UserProfile.objects.create(user=instance, last_seen_broadcast_id=last_broadcast or 0)
 
 
 class EcoTask(models.Model):
@@ -59,11 +80,73 @@ class EcoTask(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
     
+    # Denormalized submission counters, kept in step by adjust_counters(): by the
+    # TaskSubmission signals below for save() and delete(), and explicitly by
+    # queryset update()s, which send no signals (see eco.moderation.review)
+    submission_count = models.PositiveIntegerField(default=0)
+    pending_count = models.PositiveIntegerField(default=0)
+    approved_count = models.PositiveIntegerField(default=0)
+    rejected_count = models.PositiveIntegerField(default=0)
+    completion_rate = models.FloatField(default=0)  # approved_count / submission_count
+    
     def __str__(self):
         return self.title
     
+    @property
+    def is_expired(self):
+        return self.deadline is not None and self.deadline <= timezone.now()
+    
+    @classmethod
+    def adjust_counters(cls, task_id, old_status=None, new_status=None):
+        """
+        Move one submission between status counters with a single atomic
+        UPDATE. ``old_status`` None is a new submission, ``new_status`` None a
+        deleted one.
+        """
+        if old_status == new_status:
+            return
+        deltas = {'submission_count': 0}
+        if old_status is None:
+            deltas['submission_count'] += 1
+        else:
+            deltas[f'{old_status}_count'] = -1
+        if new_status is None:
+            deltas['submission_count'] -= 1
+        else:
+            deltas[f'{new_status}_count'] = deltas.get(f'{new_status}_count', 0) + 1
+        changes = {field: F(field) + delta for field, delta in deltas.items()}
+        
+        # UPDATE evaluates every expression against the old row, so apply the deltas here too
+        approved = F('approved_count') + deltas.get('approved_count', 0)
+        total = F('submission_count') + deltas.get('submission_count', 0)
+        changes['completion_rate'] = approved * 1.0 / Greatest(total, 1)
+        cls.objects.filter(pk=task_id).update(**changes)
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['-submission_count', '-id'],
+                condition=Q(is_active=True),
+                name='eco_task_popular_idx',
+            ),
+            models.Index(
+                fields=['-completion_rate', '-id'],
+                condition=Q(is_active=True),
+                name='eco_task_completion_idx',
+            ),
+            models.Index(
+                fields=['deadline'],
+                condition=Q(is_active=True),
+                name='eco_task_deadline_idx',
+            ),
+        ]
+
+
+@receiver([post_save, post_delete], sender=EcoTask)
+def task_changed(sender, **kwargs):
+    # Cached task listings and counts
+    transaction.on_commit(lambda: bump_namespace(CATALOG))
 
 
 class TaskSubmission(models.Model):
@@ -81,6 +164,11 @@ class TaskSubmission(models.Model):
     moderator_comment = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     reviewed_at = models.DateTimeField(blank=True, null=True)
+    # Moderator currently holding this submission, until lease_expires_at (see eco.moderation)
+    claimed_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, blank=True, null=True, related_name='claimed_submissions'
+    )
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
     
     def __str__(self):
         return f"{self.user.username} - {self.task.title} ({self.status})"
@@ -88,6 +176,48 @@ class TaskSubmission(models.Model):
     class Meta:
         ordering = ['-created_at']
         unique_together = ['user', 'task']
+        indexes = [
+            models.Index(
+                fields=['created_at', 'id'],
+                condition=Q(status='pending'),
+                name='eco_sub_pending_idx',
+            ),
+            models.Index(fields=['user', '-created_at', '-id'], name='eco_sub_user_created_idx'),
+            # Access checks on /media/submissions/...
+            models.Index(fields=['image'], name='eco_sub_image_idx'),
+        ]
+
+
+@receiver(pre_save, sender=TaskSubmission)
+def submission_saving(sender, instance, raw, update_fields, **kwargs):
+    # The stored task and status, which may be newer than the ones this copy was loaded with
+    instance._counted_as = None
+    if raw or instance._state.adding or (update_fields is not None and not {'status', 'task'} & set(update_fields)):
+        return
+    instance._counted_as = TaskSubmission.objects.filter(pk=instance.pk).values_list('task_id', 'status').first()
+
+
+@receiver(post_save, sender=TaskSubmission)
+def submission_saved(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    if created:
+        EcoTask.adjust_counters(instance.task_id, new_status=instance.status)
+        return
+    counted_as = instance.__dict__.pop('_counted_as', None)
+    if counted_as is None:
+        return
+    task_id, status = counted_as
+    if task_id == instance.task_id:
+        EcoTask.adjust_counters(task_id, status, instance.status)
+    else:
+        EcoTask.adjust_counters(task_id, old_status=status)
+        EcoTask.adjust_counters(instance.task_id, new_status=instance.status)
+
+
+@receiver(post_delete, sender=TaskSubmission)
+def submission_deleted(sender, instance, **kwargs):
+    EcoTask.adjust_counters(instance.task_id, old_status=instance.status)
 
 
 class CoinTransaction(models.Model):
@@ -107,6 +237,46 @@ class CoinTransaction(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='eco_cointx_user_created_idx'),
+        ]
+
+
+class ArchivedCoinTransaction(models.Model):
+    """CoinTransaction row moved out of the hot table by ledger compaction (keeps its id)"""
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_transactions')
+    amount = models.IntegerField()
+    transaction_type = models.CharField(max_length=10, choices=CoinTransaction.TRANSACTION_TYPES)
+    description = models.CharField(max_length=200)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.transaction_type} {self.amount} coins (archived)"
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='eco_archtx_user_created_idx'),
+        ]
+
+
+class CoinTransactionSummary(models.Model):
+    """Per-user monthly roll-up of compacted transactions, doubling as a balance checkpoint"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transaction_summaries')
+    month = models.DateField()  # first day of the month
+    earned = models.IntegerField(default=0)
+    spent = models.IntegerField(default=0)
+    transaction_count = models.IntegerField(default=0)
+    closing_balance = models.IntegerField(default=0)  # ledger balance at the end of the month
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.month:%Y-%m} ({self.closing_balance} coins)"
+    
+    class Meta:
+        ordering = ['-month']
+        unique_together = ['user', 'month']
 
 
 class MerchItem(models.Model):
@@ -125,6 +295,12 @@ class MerchItem(models.Model):
         ordering = ['coin_cost']
 
 
+@receiver([post_save, post_delete], sender=MerchItem)
+def merch_item_changed(sender, **kwargs):
+    # Cached store listings
+    transaction.on_commit(lambda: bump_namespace(STORE))
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -145,6 +321,9 @@ class Order(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='eco_order_user_created_idx'),
+        ]
 
 
 class Notification(models.Model):
@@ -159,4 +338,126 @@ class Notification(models.Model):
         return f"{self.user.username} - {self.message}"
     
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='eco_notif_user_created_idx'),
+            models.Index(fields=['user'], condition=Q(is_read=False), name='eco_notif_unread_idx'),
+        ]
+
+
+class Broadcast(models.Model):
+    """Notification for every user, stored once; each profile keeps a read watermark"""
+    message = models.CharField(max_length=255)
+    notification_type = models.CharField(max_length=50, default='announcement')
+    link = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    def __str__(self):
+        return self.message
+    
+    class Meta:
+        ordering = ['-id']
+
+
+class OutboxEvent(models.Model):
+    """Side effect recorded in the same transaction as the state change that caused it"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    
+    def __str__(self):
+        return f"{self.event_type} #{self.id} ({self.status})"
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(
+                fields=['available_at', 'id'],
+                condition=Q(status='pending'),
+                name='eco_outbox_pending_idx',
+            ),
+        ]
+
+
+class ResumableUpload(models.Model):
+    """File pushed in pieces to /uploads/<id>/, then attached to a form by id (see eco.uploads)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='resumable_uploads')
+    field_name = models.CharField(max_length=50)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    total_size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+    
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.total_size})"
+    
+    @property
+    def path(self):
+        return os.path.join(settings.UPLOAD_RESUMABLE_DIR, f'{self.id}.part')
+    
+    def discard(self):
+        """Delete the record and its partial file"""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.delete()
+
+
+class Campaign(models.Model):
+    """Bulk coin grant to a segment of users (see eco.campaigns)"""
+    STATUS_CHOICES = [
+        ('draft', 'Draft'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+    ]
+    
+    name = models.CharField(max_length=200)
+    coin_amount = models.PositiveIntegerField()
+    message = models.CharField(max_length=255, help_text="Notification text sent with the grant")
+    # Segment filters; empty means every user
+    location = models.CharField(max_length=100, blank=True)
+    min_age = models.PositiveIntegerField(blank=True, null=True)
+    max_age = models.PositiveIntegerField(blank=True, null=True)
+    active_within_days = models.PositiveIntegerField(
+        blank=True, null=True, help_text="Only users who logged in within this many days"
+    )
+    min_completed_tasks = models.PositiveIntegerField(blank=True, null=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
+    granted_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+    
+    def __str__(self):
+        return f"{self.name} ({self.coin_amount} coins)"
+    
+    class Meta:
+        ordering = ['-created_at']
+
+
+class CampaignGrant(models.Model):
+    """One user credited by a campaign; the unique pair makes re-runs idempotent"""
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='grants')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='campaign_grants')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.campaign.name} -> {self.user.username}"
+    
+    class Meta:
+        unique_together = ['campaign', 'user']
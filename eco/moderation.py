@@ -0,0 +1,113 @@
+"""
+Work distribution between concurrent moderators.
+
+Opening the pending queue claims the next batch of unclaimed submissions for
+the moderator with ``SELECT ... FOR UPDATE SKIP LOCKED``. A lease
+(``claimed_by`` and ``lease_expires_at``) keeps the batch away from other
+moderators until it expires, so each moderator sees a different batch. A
+batch left alone returns to the queue when its lease runs out.
+
+``review()`` changes a submission's status with a compare-and-set UPDATE on
+the status the moderator saw. Only one of several concurrent approvals of
+the same submission matches, so coins are paid out at most once.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metrics, outbox
+from .models import EcoTask, TaskSubmission
+
+
+def available(now):
+    """Lookup for pending submissions nobody holds a live lease on"""
+    return Q(status='pending') & (Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now))
+
+
+def claim_batch(moderator, size=None):
+    """
+    Renew the moderator's current leases and top them up to ``size`` with
+    the oldest available submissions. Returns the held submissions.
+    """
+    size = size or settings.MODERATION_BATCH_SIZE
+    now = timezone.now()
+    expires = now + timedelta(seconds=settings.MODERATION_LEASE_SECONDS)
+    held = TaskSubmission.objects.filter(status='pending', claimed_by=moderator, lease_expires_at__gt=now)
+
+    with transaction.atomic():
+        held.update(lease_expires_at=expires)
+        wanted = size - held.count()
+        if wanted > 0:
+            ids = list(
+                TaskSubmission.objects.select_for_update(skip_locked=True)
+                .filter(available(now))
+                .order_by('created_at', 'id')
+                .values_list('id', flat=True)[:wanted]
+            )
+            # The lease condition is checked again, for databases without row locks
+            TaskSubmission.objects.filter(available(now), id__in=ids).update(
+                claimed_by=moderator, lease_expires_at=expires,
+            )
+
+    return (
+        TaskSubmission.objects.filter(status='pending', claimed_by=moderator, lease_expires_at__gt=now)
+        .select_related('user', 'task')
+        .order_by('created_at', 'id')
+    )
+
+
+def release(moderator):
+    """Return the moderator's unreviewed submissions to the queue"""
+    return TaskSubmission.objects.filter(status='pending', claimed_by=moderator).update(
+        claimed_by=None, lease_expires_at=None,
+    )
+
+
+def review(submission, moderator, new_status, comment=None):
+    """
+    Move ``submission`` from the status it was read with to ``new_status``.
+    Pays out on approval. Returns False, and changes nothing, if the status
+    changed in the meantime or another moderator holds a live lease on it.
+    """
+    now = timezone.now()
+    old_status = submission.status
+    if old_status == new_status:
+        return False
+    changes = {'status': new_status, 'reviewed_at': now, 'claimed_by': None, 'lease_expires_at': None}
+    if comment is not None:
+        changes['moderator_comment'] = comment
+
+    with transaction.atomic():
+        updated = (
+            TaskSubmission.objects
+            .filter(pk=submission.pk, status=old_status)
+            .filter(Q(claimed_by=moderator) | Q(claimed_by__isnull=True) | Q(lease_expires_at__lte=now))
+            .update(**changes)
+        )
+        if not updated:
+            return False
+        for field, value in changes.items():
+            setattr(submission, field, value)
+        EcoTask.adjust_counters(submission.task_id, old_status, new_status)
+        transaction.on_commit(lambda: metrics.SUBMISSIONS_REVIEWED.inc(1, new_status))
+
+        task = submission.task
+        if new_status == 'approved':
+            submission.user.profile.add_coins(task.coin_reward, f"Completed task: {task.title}")
+            outbox.notify(
+                submission.user,
+                f'Your submission for "{task.title}" has been approved! You earned {task.coin_reward} coins.',
+                'task_approved',
+                link=f'/tasks/{task.id}/'
+            )
+        elif new_status == 'rejected':
+            outbox.notify(
+                submission.user,
+                f'Your submission for "{task.title}" was rejected.',
+                'task_rejected',
+                link=f'/tasks/{task.id}/'
+            )
+    return True
@@ -0,0 +1,133 @@
+"""
+Transactional outbox for side effects (notifications, and later email/push).
+
+Views call ``enqueue()`` inside the same ``transaction.atomic()`` block as the
+state change that caused the side effect, so the event exists if and only if
+the change committed. ``manage.py run_outbox_worker`` claims due events in
+batches with ``SELECT ... FOR UPDATE SKIP LOCKED`` and runs their handlers,
+retrying failures with exponential backoff. Done events are deleted by
+``purge()`` once they are OUTBOX_RETENTION_DAYS old.
+"""
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import broadcasts, events
+from .models import OutboxEvent, Notification
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def handler(event_type):
+    """Register a function as the handler for ``event_type``"""
+    def register(func):
+        HANDLERS[event_type] = func
+        return func
+    return register
+
+
+def enqueue(event_type, **payload):
+    """Record a side effect; call inside the transaction of the state change"""
+    if event_type not in HANDLERS:
+        raise ValueError(f"No outbox handler registered for {event_type!r}")
+    return OutboxEvent.objects.create(event_type=event_type, payload=payload)
+
+
+def notify(user, message, notification_type, link=''):
+    """Shortcut for the most common side effect: a user notification"""
+    return enqueue(
+        'notification',
+        user_id=user.pk,
+        message=message,
+        notification_type=notification_type,
+        link=link,
+    )
+
+
+def backoff(attempts):
+    """Delay before retry number ``attempts`` (exponential with jitter)"""
+    base = settings.OUTBOX_RETRY_BASE_SECONDS
+    delay = min(base * (2 ** (attempts - 1)), settings.OUTBOX_RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def process_batch(batch_size=None):
+    """
+    Claim and run up to ``batch_size`` due events. Returns the number claimed.
+
+    Claimed rows stay locked until the batch commits, so concurrent workers
+    skip them instead of blocking. Each handler runs in its own savepoint:
+    database side effects commit together with the event being marked done,
+    and a failing handler rolls back only its own writes.
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    now = timezone.now()
+
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', available_at__lte=now)
+            .order_by('available_at', 'id')[:batch_size]
+        )
+        for event in events:
+            event.attempts += 1
+            try:
+                func = HANDLERS[event.event_type]
+                with transaction.atomic():
+                    func(**event.payload)
+            except Exception as exc:
+                logger.exception("Outbox event %s failed (attempt %s)", event.id, event.attempts)
+                event.last_error = f"{type(exc).__name__}: {exc}"
+                if event.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                    event.status = 'failed'
+                else:
+                    event.available_at = timezone.now() + backoff(event.attempts)
+            else:
+                event.status = 'done'
+                event.processed_at = timezone.now()
+                event.last_error = ''
+            event.save(update_fields=['status', 'attempts', 'available_at', 'last_error', 'processed_at'])
+
+    return len(events)
+
+
+def purge(days=None, chunk_size=1000):
+    """
+    Delete events that finished more than ``days`` (OUTBOX_RETENTION_DAYS)
+    ago, in chunks so no single DELETE holds locks for long. Failed events are
+    kept for inspection. Returns the number deleted.
+    """
+    if days is None:
+        days = settings.OUTBOX_RETENTION_DAYS
+    done = OutboxEvent.objects.filter(status='done', processed_at__lt=timezone.now() - timedelta(days=days))
+    total = 0
+    while True:
+        ids = list(done.order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return total
+        total += OutboxEvent.objects.filter(id__in=ids).delete()[0]
+
+
+@handler('notification')
+def deliver_notification(user_id, message, notification_type, link=''):
+    notification = Notification.objects.create(
+        user_id=user_id,
+        message=message,
+        notification_type=notification_type,
+        link=link,
+    )
+    events.publish(
+        user_id, 'notification',
+        id=notification.id,
+        message=message,
+        notification_type=notification_type,
+        link=link,
+        created_at=notification.created_at,
+        unread=broadcasts.unread_count(user_id),
+    )
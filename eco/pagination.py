@@ -0,0 +1,155 @@
+"""
+Paginator that does not run ``COUNT(*)`` on every page view.
+
+``CachedCountPaginator`` caches the total per query (the SQL and its
+parameters are the key, so every filter combination gets its own entry) for
+PAGINATION_COUNT_TIMEOUT seconds, optionally inside a cache namespace so that
+bumping the namespace drops the counts with everything else.
+
+Counting stops at PAGINATION_EXACT_COUNT_LIMIT rows. Past that the total is
+the planner's row estimate on PostgreSQL, or unknown elsewhere, and
+``count_exact`` is False: pages are then fetched with one extra row to tell
+whether a next page exists, ``num_pages`` is None, and templates show plain
+previous/next links instead of "Page X of Y".
+"""
+import hashlib
+import json
+from math import ceil
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from . import metrics
+from .cache import versioned_key
+
+
+def planner_estimate(queryset):
+    """Row estimate from PostgreSQL's EXPLAIN, or None on other databases"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CachedCountPage(Page):
+    # Whether another page follows, when the paginator does not know the total
+    more = None
+
+    def has_next(self):
+        if self.more is None:
+            return super().has_next()
+        return self.more
+
+    def end_index(self):
+        if self.more is None:
+            return super().end_index()
+        return self.start_index() + len(self) - 1
+
+
+class CachedCountPaginator(Paginator):
+    def __init__(self, object_list, per_page, *args, namespace=None, timeout=None, **kwargs):
+        super().__init__(object_list, per_page, *args, **kwargs)
+        self.namespace = namespace
+        self.timeout = settings.PAGINATION_COUNT_TIMEOUT if timeout is None else timeout
+        self._count_exact = True
+
+    def cache_key(self):
+        sql, params = self.object_list.query.sql_with_params()
+        digest = hashlib.sha1(f'{sql}|{params!r}'.encode()).hexdigest()
+        if self.namespace:
+            return versioned_key(self.namespace, f'count:{digest}')
+        return f'eco:count:{digest}'
+
+    def compute_count(self):
+        """(count, exact) for the object list, counting at most PAGINATION_EXACT_COUNT_LIMIT + 1 rows"""
+        limit = settings.PAGINATION_EXACT_COUNT_LIMIT
+        counted = self.object_list[:limit + 1].count()
+        if counted <= limit:
+            return counted, True
+        return planner_estimate(self.object_list), False
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return super().count
+        key = self.cache_key()
+        cached = cache.get(key)
+        metrics.cache_lookup('pagination_count', cached is not None)
+        if cached is None:
+            cached = self.compute_count()
+            cache.set(key, cached, self.timeout)
+        count, self._count_exact = cached
+        return count
+
+    @property
+    def count_exact(self):
+        self.count
+        return self._count_exact
+
+    @cached_property
+    def num_pages(self):
+        if not self.count_exact:
+            return None
+        if self.count == 0 and not self.allow_empty_first_page:
+            return 0
+        hits = max(1, self.count - self.orphans)
+        return ceil(hits / self.per_page)
+
+    def validate_number(self, number):
+        if self.count_exact:
+            return super().validate_number(number)
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages['invalid_page'])
+        if number < 1:
+            raise EmptyPage(self.error_messages['min_page'])
+        return number
+
+    def page(self, number):
+        if self.count_exact:
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(self.error_messages['no_results'])
+        page = self._get_page(rows[:self.per_page], number, self)
+        page.more = len(rows) > self.per_page
+        return page
+
+    def get_page(self, number):
+        if self.count_exact:
+            return super().get_page(number)
+        try:
+            return self.page(number)
+        except (PageNotAnInteger, EmptyPage):
+            return self.page(1)
+
+    def _get_page(self, *args, **kwargs):
+        return CachedCountPage(*args, **kwargs)
+
+
+class EstimatedCountPaginator(CachedCountPaginator):
+    """
+    For admin changelists, whose page links need a total: past the counting
+    limit the planner estimate (or the limit itself) stands in for the exact
+    count, and paging works as usual.
+    """
+
+    def compute_count(self):
+        count, exact = super().compute_count()
+        if not exact:
+            count = max(count or 0, settings.PAGINATION_EXACT_COUNT_LIMIT)
+        return count, True
@@ -0,0 +1,54 @@
+"""
+Session engines that avoid needless session writes.
+
+Django saves the session whenever ``request.session.modified`` is set, even
+if the data ends up identical to what was loaded (e.g. a key set to the
+value it already had). These engines remember a digest of the data they
+loaded and turn such saves into no-ops.
+
+Select one with ``SESSION_ENGINE``:
+
+* ``eco.sessions.cached_db`` - cache first, database as durable fallback (default)
+* ``eco.sessions.cache`` - cache only, no ``django_session`` access at all
+* ``django.contrib.sessions.backends.signed_cookies`` - no server-side storage
+"""
+import hashlib
+
+
+class SkipUnchangedMixin:
+    """Skip ``save()`` when the session data equals what was loaded"""
+
+    _loaded_digest = None
+
+    def _digest(self, data):
+        return hashlib.blake2b(self.serializer().dumps(data), digest_size=16).digest()
+
+    def _is_unchanged(self, must_create):
+        return (
+            not must_create
+            and self.session_key is not None
+            and self._loaded_digest is not None
+            and self._digest(self._get_session(no_load=True)) == self._loaded_digest
+        )
+
+    def load(self):
+        data = super().load()
+        self._loaded_digest = self._digest(data)
+        return data
+
+    async def aload(self):
+        data = await super().aload()
+        self._loaded_digest = self._digest(data)
+        return data
+
+    def save(self, must_create=False):
+        if self._is_unchanged(must_create):
+            return
+        super().save(must_create=must_create)
+        self._loaded_digest = self._digest(self._get_session(no_load=True))
+
+    async def asave(self, must_create=False):
+        if self._is_unchanged(must_create):
+            return
+        await super().asave(must_create=must_create)
+        self._loaded_digest = self._digest(self._get_session(no_load=True))
@@ -0,0 +1,80 @@
+"""
+Which tasks a user has already submitted, without a query per page.
+
+The ids live in the shared cache as the raw bytes of a sorted
+``array('I')``: 4 bytes per submission, so a user with 5,000 submissions
+costs 20KB, and a membership test is a binary search. The set is loaded
+once per request (kept on the user object) and rebuilt from the database
+whenever a submission is created (by the submit view, the admin or
+anything else that saves one) or deleted. bulk_create() sends no signals:
+call ``refresh()`` after it.
+"""
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import metrics
+from .models import TaskSubmission
+
+
+class SubmittedTasks:
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __contains__(self, task_id):
+        i = bisect_left(self.ids, task_id)
+        return i < len(self.ids) and self.ids[i] == task_id
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+
+def _key(user_id):
+    return f'eco:submitted:{user_id}'
+
+
+def _load(user_id):
+    ids = array('I', TaskSubmission.objects.filter(user_id=user_id).order_by('task_id').values_list('task_id', flat=True))
+    cache.set(_key(user_id), ids.tobytes(), settings.SUBMITTED_TASKS_TIMEOUT)
+    return ids
+
+
+def for_user(user):
+    """The user's submitted task ids; empty for anonymous users"""
+    if not user.is_authenticated:
+        return SubmittedTasks(array('I'))
+    submitted = getattr(user, '_submitted_tasks', None)
+    if submitted is None:
+        raw = cache.get(_key(user.pk))
+        metrics.cache_lookup('submitted_tasks', raw is not None)
+        if raw is None:
+            ids = _load(user.pk)
+        else:
+            ids = array('I')
+            ids.frombytes(raw)
+        submitted = user._submitted_tasks = SubmittedTasks(ids)
+    return submitted
+
+
+def refresh(user_id):
+    """Rebuild the cached set once the current transaction commits"""
+    transaction.on_commit(lambda: _load(user_id))
+
+
+@receiver(post_save, sender=TaskSubmission)
+def submission_created(sender, instance, created, **kwargs):
+    if created:
+        refresh(instance.user_id)
+
+
+@receiver(post_delete, sender=TaskSubmission)
+def submission_deleted(sender, instance, **kwargs):
+    refresh(instance.user_id)
@@ -1,4 +1,5 @@
 from django import template
+from django.urls import reverse
 
 register = template.Library()
 
@@ -8,4 +9,11 @@ def multiply(value, arg):
     try:
         return int(value) * int(arg)
     except (ValueError, TypeError):
-        return ''
\ No newline at end of file
+        return ''
+
+@register.filter
+def variant(image, preset):
+    """URL of a resized variant of an ImageField file, e.g. {{ item.image|variant:'card' }}"""
+    if not image:
+        return ''
+    return reverse('image_variant', args=[preset, image.name])
@@ -1,3 +1,1247 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
+from datetime import timedelta
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile, UploadedFile
+from django.core.management import call_command
+from django.core.paginator import EmptyPage
+from django.db import connection
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import (
+    broadcasts, cache as eco_cache, campaigns, events, expiry, fastserialize, images, ledger, metrics, middleware,
+    moderation, outbox, serializers, submitted, uploads,
+)
+from .admin import BroadcastAdmin
+from .cache import CATALOG
+from .forms import UserProfileForm
+from .management.commands import run_outbox_worker
+from .middleware import ProfilingMiddleware
+from .pagination import CachedCountPaginator, EstimatedCountPaginator
+from .sessions import cache as cache_sessions, cached_db as cached_db_sessions
+from .models import (
+    Broadcast, Campaign, CampaignGrant, CoinTransaction, EcoTask, MerchItem, Notification, Order, OutboxEvent,
+    ResumableUpload, TaskSubmission, UserProfile,
+)
+
+
+class AdminChangelistQueryBudgetTests(TestCase):
+    """Changelists of the big tables run a fixed number of queries, however many rows there are"""
+    BUDGET = 12
+    MODELS = [CoinTransaction, Notification, Order, TaskSubmission]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.item = MerchItem.objects.create(name='Bottle', description='Reusable', coin_cost=10,
+                                             image='merchandise/bottle.jpg')
+        self.created = 0
+
+    def add_rows(self, count):
+        for i in range(self.created, self.created + count):
+            user = User.objects.create_user(f'user{i}')
+            task = EcoTask.objects.create(title=f'Task {i}', description='Plant a tree', coin_reward=5,
+                                          deadline=timezone.now() + timedelta(days=7))
+            TaskSubmission.objects.create(user=user, task=task, description='Done', image='submissions/a.jpg')
+            CoinTransaction.objects.create(user=user, amount=5, transaction_type='earn', description='Task')
+            Notification.objects.create(user=user, message='Hello', notification_type='info')
+            Order.objects.create(user=user, merch_item=self.item)
+        self.created += count
+
+    def changelist_queries(self, model, query=''):
+        cache.clear()
+        url = reverse(f'admin:eco_{model._meta.model_name}_changelist') + query
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in queries]
+
+    def test_queries_do_not_grow_with_rows(self):
+        self.add_rows(2)
+        few = {model: len(self.changelist_queries(model)) for model in self.MODELS}
+        self.add_rows(25)
+        for model in self.MODELS:
+            with self.subTest(model=model.__name__):
+                queries = self.changelist_queries(model)
+                self.assertLessEqual(len(queries), self.BUDGET)
+                self.assertEqual(len(queries), few[model])
+
+    def test_counts_are_bounded(self):
+        self.add_rows(3)
+        for model in self.MODELS:
+            with self.subTest(model=model.__name__):
+                counts = [sql for sql in self.changelist_queries(model) if 'COUNT(' in sql.upper()]
+                self.assertTrue(counts)
+                for sql in counts:
+                    self.assertIn('LIMIT', sql.upper())
+
+    def test_username_search(self):
+        self.add_rows(3)
+        for model in self.MODELS:
+            with self.subTest(model=model.__name__):
+                queries = self.changelist_queries(model, '?q=user1')
+                self.assertLessEqual(len(queries), self.BUDGET)
+                # an exact match on the unique username index, never a LIKE scan
+                self.assertFalse([sql for sql in queries if ' LIKE ' in sql.upper()])
+
+
+class ModerationConcurrencyTests(TransactionTestCase):
+    """Moderators working in parallel threads, each with its own database connection"""
+    THREADS = 8
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Threads cannot share an in-memory SQLite database; run with a file or PostgreSQL')
+        cache.clear()
+        self.moderators = [User.objects.create_user(f'moderator{i}', is_staff=True) for i in range(self.THREADS)]
+        self.task = EcoTask.objects.create(title='Plant a tree', description='Plant it', coin_reward=50,
+                                           deadline=timezone.now() + timedelta(days=7))
+
+    def submit(self, count):
+        submissions = []
+        for i in range(count):
+            user = User.objects.create_user(f'member{i}')
+            submissions.append(TaskSubmission.objects.create(user=user, task=self.task, description='Done',
+                                                             image='submissions/a.jpg'))
+        EcoTask.objects.filter(pk=self.task.pk).update(submission_count=count, pending_count=count)
+        return submissions
+
+    def run_threads(self, func):
+        """Call func(moderator) in one thread per moderator, all starting together"""
+        barrier = threading.Barrier(self.THREADS)
+        results = [None] * self.THREADS
+        errors = []
+
+        def worker(i):
+            try:
+                barrier.wait()
+                results[i] = func(self.moderators[i])
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def test_concurrent_approvals_pay_out_once(self):
+        submission = self.submit(1)[0]
+
+        def approve(moderator):
+            return moderation.review(TaskSubmission.objects.get(pk=submission.pk), moderator, 'approved')
+
+        results = self.run_threads(approve)
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(UserProfile.objects.get(user=submission.user).coin_balance, 50)
+        self.assertEqual(CoinTransaction.objects.filter(user=submission.user).count(), 1)
+        task = EcoTask.objects.get(pk=self.task.pk)
+        self.assertEqual((task.pending_count, task.approved_count), (0, 1))
+
+    def test_moderators_claim_disjoint_batches(self):
+        submissions = self.submit(self.THREADS * 3)
+
+        results = self.run_threads(lambda moderator: [s.pk for s in moderation.claim_batch(moderator, size=3)])
+
+        claimed = [pk for batch in results for pk in batch]
+        self.assertEqual([len(batch) for batch in results], [3] * self.THREADS)
+        self.assertEqual(sorted(claimed), sorted(s.pk for s in submissions))
+
+    def test_leased_submission_is_not_reviewed_by_others(self):
+        submission = self.submit(1)[0]
+        owner, other = self.moderators[:2]
+        moderation.claim_batch(owner)
+
+        self.assertFalse(moderation.review(TaskSubmission.objects.get(pk=submission.pk), other, 'approved'))
+        self.assertTrue(moderation.review(TaskSubmission.objects.get(pk=submission.pk), owner, 'approved'))
+
+
+class TemporaryMediaTestCase(TestCase):
+    """MEDIA_ROOT is an empty temporary directory for each test"""
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = self.settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def write_media(self, name, data=b'data'):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+class MediaAccessTests(TemporaryMediaTestCase):
+    """Submission photos reach only their owner and moderators, however the path is spelled"""
+    PRIVATE = 'submissions/secret.jpg'
+    TRAVERSALS = [
+        '/media/merchandise/../submissions/secret.jpg',
+        '/media/merchandise/%2e%2e/submissions/secret.jpg',
+        '/media/merchandise/%2E%2E/submissions/secret.jpg',
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.write_media(self.PRIVATE)
+        self.write_media('merchandise/bottle.jpg')
+        self.owner = User.objects.create_user('owner')
+        task = EcoTask.objects.create(title='Plant a tree', description='Plant it', coin_reward=5,
+                                      deadline=timezone.now() + timedelta(days=7))
+        TaskSubmission.objects.create(user=self.owner, task=task, description='Done', image=self.PRIVATE)
+
+    def test_public_file(self):
+        response = self.client.get('/media/merchandise/bottle.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_private_file_needs_owner(self):
+        self.assertEqual(self.client.get('/media/' + self.PRIVATE).status_code, 404)
+        self.client.force_login(self.owner)
+        response = self.client.get('/media/' + self.PRIVATE)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_dot_dot_segments_are_refused(self):
+        for url in self.TRAVERSALS:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+        # Also for the owner: the canonical URL is the only one
+        self.client.force_login(self.owner)
+        for url in self.TRAVERSALS:
+            with self.subTest(url=url, user='owner'):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ImageVariantAccessTests(TemporaryMediaTestCase):
+    """Only public uploads get resized variants"""
+
+    def setUp(self):
+        super().setUp()
+        self.image_dir = image_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, image_dir)
+        override = self.settings(IMAGE_VARIANT_DIR=image_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), 'green').save(buffer, 'JPEG')
+        self.write_media('submissions/secret.jpg', buffer.getvalue())
+        self.write_media('merchandise/bottle.jpg', buffer.getvalue())
+
+    def test_public_image(self):
+        response = self.client.get('/images/thumb/merchandise/bottle.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+
+    def test_corrupt_source(self):
+        self.write_media('merchandise/broken.jpg', b'not an image at all')
+        with mock.patch.object(images.Variant, 'render', autospec=True, side_effect=images.Variant.render) as render:
+            for _ in range(2):
+                self.assertEqual(self.client.get('/images/thumb/merchandise/broken.jpg').status_code, 404)
+        # The failure is remembered: one render attempt, no temporary file left behind
+        self.assertEqual(render.call_count, 1)
+        leftovers = [name for _, _, names in os.walk(self.image_dir) for name in names]
+        self.assertEqual(leftovers, [])
+
+    def test_slow_render(self):
+        def slow(variant):
+            time.sleep(0.3)
+
+        with self.settings(IMAGE_VARIANT_TIMEOUT=0.01), mock.patch.object(images.Variant, 'render', slow):
+            response = self.client.get('/images/card/merchandise/bottle.jpg')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+    def test_private_image_is_refused(self):
+        for url in ['/images/thumb/submissions/secret.jpg',
+                    '/images/thumb/merchandise/../submissions/secret.jpg',
+                    '/images/thumb/merchandise/%2e%2e/submissions/secret.jpg']:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class CampaignConcurrencyTests(TransactionTestCase):
+    """Runs of one campaign in parallel threads credit everyone once and leave it done"""
+    THREADS = 4
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Threads cannot share an in-memory SQLite database; run with a file or PostgreSQL')
+        for i in range(30):
+            User.objects.create_user(f'member{i}')
+        self.campaign = Campaign.objects.create(name='Spring', coin_amount=20, message='Happy spring!')
+
+    def test_concurrent_runs(self):
+        barrier = threading.Barrier(self.THREADS)
+        results, errors = [], []
+
+        def worker():
+            try:
+                barrier.wait()
+                results.append(campaigns.run(Campaign.objects.get(pk=self.campaign.pk), chunk_size=4))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sum(results), 30)
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.status, self.campaign.granted_count), ('done', 30))
+        self.assertEqual(set(UserProfile.objects.values_list('coin_balance', flat=True)), {20})
+
+
+class SubmittedTasksCacheTests(TemporaryMediaTestCase):
+    """The cached submitted-task ids follow submissions made anywhere, and a stale set cannot cause a 500"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('member')
+        self.task = EcoTask.objects.create(title='Plant a tree', description='Plant it', coin_reward=5,
+                                           deadline=timezone.now() + timedelta(days=7))
+        self.client.force_login(self.user)
+
+    def photo(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), 'green').save(buffer, 'JPEG')
+        return SimpleUploadedFile('tree.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_submission_created_outside_the_view(self):
+        self.client.get(reverse('tasks'))  # caches the empty set
+        with self.captureOnCommitCallbacks(execute=True):
+            TaskSubmission.objects.create(user=self.user, task=self.task, description='Done',
+                                          image='submissions/a.jpg')
+
+        response = self.client.get(reverse('task_detail', args=[self.task.id]))
+        self.assertIsNotNone(response.context['user_submission'])
+
+    def test_stale_set_gives_already_submitted(self):
+        self.client.get(reverse('tasks'))
+        TaskSubmission.objects.create(user=self.user, task=self.task, description='Done',
+                                      image='submissions/a.jpg')  # on_commit never runs: the set stays stale
+        self.assertNotIn(self.task.id, submitted.for_user(User.objects.get(pk=self.user.pk)))
+
+        response = self.client.post(reverse('submit_task', args=[self.task.id]),
+                                    {'description': 'Again', 'image': self.photo()})
+        self.assertRedirects(response, reverse('task_detail', args=[self.task.id]), fetch_redirect_response=False)
+        self.assertEqual(TaskSubmission.objects.filter(user=self.user).count(), 1)
+
+
+@override_settings(UPLOAD_MAX_BYTES=100 * 1024, UPLOAD_FIELD_LIMITS={'image': 100 * 1024, 'photo': 50 * 1024},
+                   DATA_UPLOAD_MAX_MEMORY_SIZE=50 * 1024)
+class UploadTests(TemporaryMediaTestCase):
+    """Size limits on submissions, with the CSRF check on, and resumable uploads"""
+
+    def setUp(self):
+        super().setUp()
+        resumable_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, resumable_dir)
+        override = self.settings(UPLOAD_RESUMABLE_DIR=resumable_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client = Client(enforce_csrf_checks=True)
+        self.user = User.objects.create_user('member')
+        self.client.force_login(self.user)
+        self.task = EcoTask.objects.create(title='Plant a tree', description='Plant it', coin_reward=5,
+                                           deadline=timezone.now() + timedelta(days=7))
+        self.url = reverse('submit_task', args=[self.task.id])
+        self.client.get(self.url)
+        self.token = self.client.cookies[settings.CSRF_COOKIE_NAME].value
+
+    def photo(self, padding=0):
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), 'green').save(buffer, 'JPEG')
+        return buffer.getvalue() + b'\0' * padding
+
+    def submit(self, **data):
+        return self.client.post(self.url, {'csrfmiddlewaretoken': self.token, 'description': 'Done', **data})
+
+    def test_small_upload(self):
+        response = self.submit(image=SimpleUploadedFile('tree.jpg', self.photo(), content_type='image/jpeg'))
+        self.assertRedirects(response, reverse('my_submissions'), fetch_redirect_response=False)
+        self.assertTrue(TaskSubmission.objects.filter(user=self.user, task=self.task).exists())
+
+    def test_file_over_field_limit_is_a_form_error(self):
+        image = SimpleUploadedFile('tree.jpg', self.photo(120 * 1024), content_type='image/jpeg')
+        response = self.submit(image=image)
+        # Not the CSRF failure page: the token arrived before the file was cut off
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('too large', response.context['form'].errors['image'][0])
+        self.assertFalse(TaskSubmission.objects.exists())
+
+    def test_body_over_any_limit_is_refused_unread(self):
+        image = SimpleUploadedFile('tree.jpg', self.photo(400 * 1024), content_type='image/jpeg')
+        response = self.submit(image=image)
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(TaskSubmission.objects.exists())
+
+    def test_resumable_upload(self):
+        data = self.photo()
+        response = self.client.post(reverse('create_upload'), HTTP_UPLOAD_LENGTH=str(len(data)),
+                                    HTTP_UPLOAD_FIELD='image', HTTP_UPLOAD_NAME='tree.jpg',
+                                    HTTP_X_CSRFTOKEN=self.token)
+        self.assertEqual(response.status_code, 201)
+        upload_id = response.json()['id']
+        response = self.client.patch(response['Location'], data, content_type='application/offset+octet-stream',
+                                     HTTP_UPLOAD_OFFSET='0', HTTP_X_CSRFTOKEN=self.token)
+        self.assertEqual(response.status_code, 204)
+
+        response = self.submit(image_upload_id=upload_id)
+        self.assertRedirects(response, reverse('my_submissions'), fetch_redirect_response=False)
+        self.assertFalse(ResumableUpload.objects.filter(id=upload_id).exists())
+
+    def start_upload(self, data):
+        response = self.client.post(reverse('create_upload'), HTTP_UPLOAD_LENGTH=str(len(data)),
+                                    HTTP_UPLOAD_FIELD='image', HTTP_UPLOAD_NAME='tree.jpg',
+                                    HTTP_X_CSRFTOKEN=self.token)
+        return ResumableUpload.objects.get(id=response.json()['id']), response['Location']
+
+    def test_head_reports_bytes_on_disk(self):
+        upload, url = self.start_upload(self.photo())
+        # A PATCH cut off by the client leaves its bytes on disk but the row unchanged
+        with open(upload.path, 'ab') as fh:
+            fh.write(self.photo()[:100])
+        response = self.client.head(url)
+        self.assertEqual((response.status_code, response['Upload-Offset']), (200, '100'))
+
+    def test_resumable_file_is_closed_when_the_form_is_invalid(self):
+        data = self.photo()
+        upload, url = self.start_upload(data)
+        self.client.patch(url, data, content_type='application/offset+octet-stream',
+                          HTTP_UPLOAD_OFFSET='0', HTTP_X_CSRFTOKEN=self.token)
+        opened = []
+
+        def uploaded_file(*args, **kwargs):
+            opened.append(UploadedFile(*args, **kwargs))
+            return opened[-1]
+
+        with mock.patch.object(uploads, 'UploadedFile', uploaded_file):
+            response = self.submit(image_upload_id=str(upload.id), description='')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([f.closed for f in opened], [True])
+        self.assertTrue(ResumableUpload.objects.filter(id=upload.id).exists())
+
+    def test_bad_upload_id_is_a_form_error(self):
+        for upload_id in ['not-a-uuid', str(uuid.uuid4())]:
+            with self.subTest(upload_id=upload_id):
+                response = self.submit(image_upload_id=upload_id)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('expired', response.context['form'].errors['image'][0])
+
+
+class ProfileWriteTests(TestCase):
+    """Saving a profile or a user never overwrites a balance credited in the meantime"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('member')
+        self.client.force_login(self.user)
+
+    def credit(self, amount=50):
+        UserProfile.objects.get(user=self.user).add_coins(amount, 'Task approved')
+
+    def test_credit_while_editing_profile(self):
+        original = UserProfileForm.is_valid
+
+        def is_valid(form):
+            # Runs after the view loaded request.user.profile
+            self.credit()
+            return original(form)
+
+        with mock.patch.object(UserProfileForm, 'is_valid', is_valid):
+            response = self.client.post(reverse('edit_profile'), {'location': 'Tashkent', 'bio': 'Trees'})
+
+        self.assertRedirects(response, reverse('profile'), fetch_redirect_response=False)
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual((profile.location, profile.coin_balance), ('Tashkent', 50))
+
+    def test_credit_before_user_save(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.profile  # loaded before the credit, like request.user at login
+        self.credit()
+        user.last_login = timezone.now()
+        user.save()
+        self.assertEqual(UserProfile.objects.get(user=self.user).coin_balance, 50)
+
+
+class TwoTierCacheTests(TestCase):
+    """eco.cache on the file cache, the default shared backend"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        override = self.settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                'LOCATION': directory, 'TIMEOUT': 1}},
+            CACHE_ENABLED=True, CACHE_VERSION_TTL=0,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        eco_cache.local.clear()
+        eco_cache._versions.clear()
+
+    def counting(self, value, calls, pause=0):
+        def compute():
+            calls.append(1)
+            time.sleep(pause)
+            return value
+        return compute
+
+    def test_bump_invalidates(self):
+        calls = []
+        self.assertEqual(eco_cache.get_or_set('k', self.counting(1, calls), 60, namespace=CATALOG), 1)
+        self.assertEqual(eco_cache.get_or_set('k', self.counting(1, calls), 60, namespace=CATALOG), 1)
+        eco_cache.bump_namespace(CATALOG)
+        self.assertEqual(eco_cache.get_or_set('k', self.counting(2, calls), 60, namespace=CATALOG), 2)
+        self.assertEqual(len(calls), 2)
+
+    def test_version_outlives_the_default_timeout(self):
+        version = eco_cache.bump_namespace(CATALOG)
+        time.sleep(1.2)  # past the backend's default TIMEOUT
+        self.assertEqual(eco_cache.namespace_version(CATALOG), version)
+
+    def test_single_flight_within_a_process(self):
+        calls = []
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                eco_cache.get_or_set('slow', self.counting(7, calls, pause=0.2), 60)))
+            for _ in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((results, len(calls)), ([7] * 6, 1))
+
+    def test_waits_for_another_process(self):
+        key = eco_cache.full_key('shared')
+        shared = caches['default']
+        shared.add(f'{key}:lock', 1, 30)  # held by "another process"
+        timer = threading.Timer(0.1, lambda: shared.set(key, ('theirs', 0.1, time.time() + 60), 120))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        calls = []
+        self.assertEqual(eco_cache.get_or_set('shared', self.counting('mine', calls), 60), 'theirs')
+        self.assertEqual(calls, [])
+
+    def test_early_refresh_near_expiry(self):
+        key = eco_cache.full_key('x')
+        shared = caches['default']
+        calls = []
+        # Far from expiry with a cheap recompute: served as is
+        shared.set(key, ('old', 0.001, time.time() + 3600), 7200)
+        self.assertEqual(eco_cache.get_or_set('x', self.counting('new', calls), 60), 'old')
+        eco_cache.local.clear()
+        # At expiry with an expensive recompute: refreshed ahead of time
+        shared.set(key, ('old', 10.0, time.time()), 7200)
+        self.assertEqual(eco_cache.get_or_set('x', self.counting('new', calls), 60), 'new')
+        self.assertEqual(len(calls), 1)
+
+    def test_stale_value_while_another_refreshes(self):
+        key = eco_cache.full_key('y')
+        shared = caches['default']
+        shared.set(key, ('stale', 10.0, time.time() - 1), 7200)
+        shared.add(f'{key}:lock', 1, 30)
+        calls = []
+        self.assertEqual(eco_cache.get_or_set('y', self.counting('new', calls), 60), 'stale')
+        self.assertEqual(calls, [])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SessionEngineTests(TestCase):
+    """eco.sessions: unchanged sessions are not written; cached_db survives a lost cache entry"""
+
+    def setUp(self):
+        cache.clear()
+
+    def new_session(self, engine):
+        store = engine.SessionStore()
+        store['cart'] = [1, 2]
+        store.save(must_create=True)
+        return store.session_key
+
+    def test_unchanged_session_is_not_saved(self):
+        for engine in (cached_db_sessions, cache_sessions):
+            with self.subTest(engine=engine.__name__):
+                key = self.new_session(engine)
+                store = engine.SessionStore(key)
+                store['cart'] = [1, 2]  # marks it modified, same data
+                with CaptureQueriesContext(connection) as queries, \
+                        mock.patch.object(caches['default'], 'set', wraps=caches['default'].set) as cache_set:
+                    store.save()
+                self.assertEqual((len(queries), cache_set.call_count), (0, 0))
+
+    def test_changed_session_is_saved(self):
+        key = self.new_session(cached_db_sessions)
+        store = cached_db_sessions.SessionStore(key)
+        store['cart'] = [1, 2, 3]
+        store.save()
+        cache.clear()
+        self.assertEqual(cached_db_sessions.SessionStore(key)['cart'], [1, 2, 3])
+
+    def test_cached_db_falls_back_to_the_database(self):
+        key = self.new_session(cached_db_sessions)
+        cache.clear()  # evicted
+        store = cached_db_sessions.SessionStore(key)
+        self.assertEqual(store['cart'], [1, 2])
+        # and the cache is filled again from the database
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(cached_db_sessions.SessionStore(key)['cart'], [1, 2])
+        self.assertEqual(len(queries), 0)
+
+
+class LedgerCompactionTests(TestCase):
+    """Compacting the ledger changes neither the history nor any balance"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('member')
+        now = timezone.now()
+        for days, amount, kind in [(400, 100, 'earn'), (380, 30, 'spend'), (340, 50, 'earn'),
+                                   (200, 20, 'spend'), (1, 5, 'earn')]:
+            row = CoinTransaction.objects.create(user=self.user, amount=amount, transaction_type=kind,
+                                                 description=f'{kind} {amount}')
+            CoinTransaction.objects.filter(pk=row.pk).update(created_at=now - timedelta(days=days))
+        self.moments = [now - timedelta(days=days) for days in (390, 350, 300, 100, 0)]
+
+    def snapshot(self):
+        return (
+            [row['id'] for row in ledger.history(self.user)],
+            [row['id'] for row in ledger.history(self.user, limit=2)[:2]],
+            [ledger.balance_as_of(self.user, when) for when in self.moments],
+            ledger.balances(self.user.id, self.user.id)[self.user.id],
+        )
+
+    def test_compaction_keeps_history_and_balances(self):
+        before = self.snapshot()
+        self.assertEqual(before[2:], ([100, 70, 120, 100, 105], 105))
+
+        moved = ledger.compact(ledger.compaction_cutoff(horizon_days=90))
+
+        self.assertEqual(moved, 4)
+        self.assertEqual(CoinTransaction.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(self.snapshot(), before)
+        # a second run has nothing left to move
+        self.assertEqual(ledger.compact(ledger.compaction_cutoff(horizon_days=90)), 0)
+        self.assertEqual(self.snapshot(), before)
+
+
+class FastSerializerTests(TestCase):
+    """fastserialize gives the same JSON as the DRF serializers in eco.serializers"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('member')
+        self.with_photo = EcoTask.objects.create(title='Plant a tree', description='Any tree', coin_reward=20,
+                                                 example_photo='task_examples/tree photo.jpg',
+                                                 deadline=timezone.now() + timedelta(days=3))
+        self.without_photo = EcoTask.objects.create(title='Pick up litter', description='Park')
+        moderator = User.objects.create_user('moderator')
+        TaskSubmission.objects.create(user=self.user, task=self.with_photo, description='Oak',
+                                      image='submissions/oak.jpg', claimed_by=moderator,
+                                      lease_expires_at=timezone.now())
+        TaskSubmission.objects.create(user=self.user, task=self.without_photo, description='Bags',
+                                      image='submissions/bags.jpg')
+        item = MerchItem.objects.create(name='Bottle', description='Reusable', coin_cost=10,
+                                        image='merchandise/bottle.jpg')
+        Order.objects.create(user=self.user, merch_item=item, shipping_address='Tashkent')
+
+    def assertSameJSON(self, fast, drf, queryset):
+        expected = json.loads(json.dumps(drf(queryset, many=True).data))
+        self.assertEqual(json.loads(b''.join(fast.stream(queryset))), expected)
+        self.assertEqual(fast.serialize(queryset), expected)
+
+    def test_matches_drf(self):
+        cases = [
+            (fastserialize.TASKS, serializers.TaskSerializer, EcoTask.objects.order_by('id')),
+            (fastserialize.SUBMISSIONS, serializers.TaskSubmissionSerializer, TaskSubmission.objects.order_by('id')),
+            (fastserialize.ORDERS, serializers.OrderSerializer, Order.objects.order_by('id')),
+        ]
+        for fast, drf, queryset in cases:
+            with self.subTest(model=queryset.model.__name__):
+                self.assertSameJSON(fast, drf, queryset)
+
+    def test_transactions_merge_live_and_archived(self):
+        profile = self.user.profile
+        for amount in (5, 10, 15):
+            profile.add_coins(amount, f'earned {amount}')
+        CoinTransaction.objects.filter(amount=5).update(created_at=timezone.now() - timedelta(days=400))
+        ledger.compact(ledger.compaction_cutoff(horizon_days=90))
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('api_transactions'), {'limit': 2})
+        self.assertEqual([row['amount'] for row in json.loads(response.getvalue())], [15, 10])
+        response = self.client.get(reverse('api_transactions'))
+        self.assertEqual([row['amount'] for row in json.loads(response.getvalue())], [15, 10, 5])
+
+
+@override_settings(OUTBOX_MAX_ATTEMPTS=2, OUTBOX_RETRY_BASE_SECONDS=5, OUTBOX_RETRY_MAX_SECONDS=60)
+class OutboxTests(TestCase):
+    """Claiming, retries with backoff, retention and a worker that outlives errors"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('member')
+        self.calls = []
+        outbox.HANDLERS['test'] = self.handle
+        self.addCleanup(outbox.HANDLERS.pop, 'test')
+
+    def handle(self, fail=False):
+        self.calls.append(fail)
+        Notification.objects.create(user=self.user, message='side effect', notification_type='announcement')
+        if fail:
+            raise RuntimeError('boom')
+
+    def test_claims_due_events_only(self):
+        due = outbox.enqueue('test')
+        later = outbox.enqueue('test')
+        OutboxEvent.objects.filter(pk=later.pk).update(available_at=timezone.now() + timedelta(minutes=5))
+
+        self.assertEqual(outbox.process_batch(10), 1)
+        due.refresh_from_db()
+        self.assertEqual((due.status, due.attempts), ('done', 1))
+        self.assertEqual(OutboxEvent.objects.get(pk=later.pk).status, 'pending')
+        self.assertEqual(outbox.process_batch(10), 0)
+
+    def test_failure_is_retried_then_given_up(self):
+        event = outbox.enqueue('test', fail=True)
+        started = timezone.now()
+        with self.assertLogs('eco.outbox', 'ERROR'):
+            self.assertEqual(outbox.process_batch(10), 1)
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts, event.last_error), ('pending', 1, 'RuntimeError: boom'))
+        self.assertGreaterEqual(event.available_at, started + timedelta(seconds=4))
+        # the failed handler's writes were rolled back
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(outbox.process_batch(10), 0)  # not due yet
+
+        OutboxEvent.objects.filter(pk=event.pk).update(available_at=timezone.now())
+        with self.assertLogs('eco.outbox', 'ERROR'):
+            outbox.process_batch(10)
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('failed', 2))
+        self.assertEqual(self.calls, [True, True])
+
+    def test_backoff_grows_and_is_capped(self):
+        for attempts, seconds in [(1, 5), (2, 10), (3, 20), (20, 60)]:
+            with self.subTest(attempts=attempts):
+                delay = outbox.backoff(attempts).total_seconds()
+                self.assertTrue(seconds * 0.8 <= delay <= seconds * 1.2, delay)
+
+    @override_settings(OUTBOX_RETENTION_DAYS=7)
+    def test_purge_deletes_old_done_events_only(self):
+        old_done, new_done, old_failed, pending = (outbox.enqueue('test') for _ in range(4))
+        long_ago = timezone.now() - timedelta(days=8)
+        OutboxEvent.objects.filter(pk=old_done.pk).update(status='done', processed_at=long_ago)
+        OutboxEvent.objects.filter(pk=new_done.pk).update(status='done', processed_at=timezone.now())
+        OutboxEvent.objects.filter(pk=old_failed.pk).update(status='failed', processed_at=long_ago)
+
+        self.assertEqual(outbox.purge(chunk_size=1), 1)
+        self.assertQuerySetEqual(OutboxEvent.objects.values_list('pk', flat=True),
+                                 [new_done.pk, old_failed.pk, pending.pk])
+
+    def test_worker_survives_a_failed_batch(self):
+        stop = threading.Event()
+        results = iter([RuntimeError('database went away'), 0])
+
+        def process_batch(batch_size):
+            result = next(results)
+            if isinstance(result, Exception):
+                raise result
+            stop.set()
+            return result
+
+        with mock.patch.object(outbox, 'process_batch', process_batch), \
+                mock.patch.object(run_outbox_worker, 'signal'), \
+                mock.patch.object(run_outbox_worker, 'close_old_connections'), \
+                mock.patch.object(run_outbox_worker, 'connections'), \
+                mock.patch.object(run_outbox_worker.logger, 'exception') as log:
+            run_outbox_worker.run_worker(stop, 10, poll_interval=0.001)
+
+        self.assertTrue(stop.is_set())
+        log.assert_called_once()
+
+
+class TaskCounterTests(TestCase):
+    """Per-task submission counters follow every save and delete, and reconcile_task_counters repairs drift"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('member')
+        self.moderator = User.objects.create_user('moderator', is_staff=True)
+        self.task = EcoTask.objects.create(title='Plant a tree', description='Any tree')
+        self.other = EcoTask.objects.create(title='Pick up litter', description='Park')
+
+    def submit(self, user=None, task=None):
+        return TaskSubmission.objects.create(user=user or self.user, task=task or self.task,
+                                             description='Done', image='submissions/done.jpg')
+
+    def counters(self, task=None):
+        task = EcoTask.objects.get(pk=(task or self.task).pk)
+        return (task.submission_count, task.pending_count, task.approved_count, task.rejected_count,
+                task.completion_rate)
+
+    def test_create_review_and_admin_edit(self):
+        submission = self.submit()
+        self.submit(user=self.moderator)
+        self.assertEqual(self.counters(), (2, 2, 0, 0, 0))
+
+        stale = TaskSubmission.objects.get(pk=submission.pk)
+        self.assertTrue(moderation.review(submission, self.moderator, 'approved'))
+        self.assertEqual(self.counters(), (2, 1, 1, 0, 0.5))
+
+        # an admin edit of a copy loaded before the review
+        stale.status = 'rejected'
+        stale.save()
+        self.assertEqual(self.counters(), (2, 1, 0, 1, 0))
+
+        stale.moderator_comment = 'Blurry'
+        stale.save(update_fields=['moderator_comment'])
+        self.assertEqual(self.counters(), (2, 1, 0, 1, 0))
+
+    def test_moving_to_another_task(self):
+        submission = self.submit()
+        submission.task = self.other
+        submission.status = 'approved'
+        submission.save()
+        self.assertEqual(self.counters(), (0, 0, 0, 0, 0))
+        self.assertEqual(self.counters(self.other), (1, 0, 1, 0, 1))
+
+    def test_deletes(self):
+        self.submit().delete()
+        self.assertEqual(self.counters(), (0, 0, 0, 0, 0))
+
+        self.submit()
+        approved = self.submit(user=self.moderator)
+        TaskSubmission.objects.filter(pk=approved.pk).update(status='approved')
+        EcoTask.adjust_counters(self.task.pk, 'pending', 'approved')
+        self.user.delete()  # cascades to the submission
+        self.assertEqual(self.counters(), (1, 0, 1, 0, 1))
+        TaskSubmission.objects.all().delete()
+        self.assertEqual(self.counters(), (0, 0, 0, 0, 0))
+
+    def test_reconcile_repairs_drift(self):
+        self.submit()
+        approved = self.submit(user=self.moderator)
+        moderation.review(approved, self.moderator, 'approved')
+        EcoTask.objects.filter(pk=self.task.pk).update(submission_count=7, pending_count=0, completion_rate=0.9)
+        drifted = self.counters()
+
+        out = io.StringIO()
+        call_command('reconcile_task_counters', '--dry-run', stdout=out)
+        self.assertIn('Found 1 tasks', out.getvalue())
+        self.assertEqual(self.counters(), drifted)
+
+        call_command('reconcile_task_counters', stdout=out)
+        self.assertEqual(self.counters(), (2, 1, 1, 0, 0.5))
+        self.assertEqual(self.counters(self.other), (0, 0, 0, 0, 0))
+
+
+class ProfilingMiddlewareTests(TestCase):
+    """Sampled captures are pruned per URL name, and only one request per process is profiled at a time"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        override = self.settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1, PROFILING_DIR=self.directory,
+                                 PROFILING_KEEP_PER_URL=2)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.middleware = ProfilingMiddleware(lambda request: HttpResponse('ok'))
+
+    def get(self):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        return self.middleware(request)
+
+    def test_captures_are_capped_per_url_name(self):
+        for _ in range(4):
+            self.get()
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, 'unresolved'))), 4)  # .json and .prof
+
+    def test_prune_deletes_the_oldest(self):
+        for age, capture_id in enumerate(['c', 'a', 'b']):
+            for ext in ('json', 'prof'):
+                path = os.path.join(self.directory, f'{capture_id}.{ext}')
+                open(path, 'w').close()
+                os.utime(path, (1000 - age, 1000 - age))
+        middleware.prune(self.directory, 1)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['c.json', 'c.prof'])
+
+    def test_one_profile_at_a_time(self):
+        with middleware.profile_lock:
+            response = self.get()
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertIn('X-Profile-Id', self.get())
+
+
+class TaskExpiryTests(TestCase):
+    """Overdue tasks are deactivated in batches, with one catalog invalidation"""
+
+    def setUp(self):
+        now = timezone.now()
+        self.overdue = [
+            EcoTask.objects.create(title=f'Overdue {i}', description='Late', deadline=now - timedelta(hours=i + 1))
+            for i in range(5)
+        ]
+        self.upcoming = EcoTask.objects.create(title='Upcoming', description='Soon',
+                                               deadline=now + timedelta(hours=1))
+        self.open_ended = EcoTask.objects.create(title='Open ended', description='Any time')
+
+    def active(self):
+        return set(EcoTask.objects.filter(is_active=True).values_list('id', flat=True))
+
+    def test_expires_in_batches_and_bumps_the_catalog_once(self):
+        with mock.patch.object(expiry, 'bump_namespace') as bump, \
+                CaptureQueriesContext(connection) as queries:
+            self.assertEqual(expiry.expire_due_tasks(batch_size=2), 5)
+        bump.assert_called_once_with(CATALOG)
+        self.assertEqual(self.active(), {self.upcoming.id, self.open_ended.id})
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 3)
+
+        with mock.patch.object(expiry, 'bump_namespace') as bump:
+            self.assertEqual(expiry.expire_due_tasks(batch_size=2), 0)
+        bump.assert_not_called()
+        self.assertEqual(expiry.next_expiry(), self.upcoming.deadline)
+
+    def test_worker_once_expires_tasks(self):
+        out = io.StringIO()
+        call_command('run_outbox_worker', '--once', stdout=out)
+        self.assertEqual(len(self.active()), 7)
+        call_command('run_outbox_worker', '--once', '--expire-tasks', stdout=out)
+        self.assertIn('Expired 5 tasks', out.getvalue())
+        self.assertEqual(self.active(), {self.upcoming.id, self.open_ended.id})
+
+
+@override_settings(EVENTS_BACKEND='local', EVENTS_QUEUE_SIZE=3)
+class EventTests(TestCase):
+    """Publishing after commit, fan-out to streams, and the polling fallback"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('member')
+
+    def test_publish_waits_for_commit(self):
+        with mock.patch.object(events, 'dispatch') as dispatch, self.captureOnCommitCallbacks(execute=True):
+            events.publish(self.user.id, 'balance', balance=5)
+            dispatch.assert_not_called()
+        dispatch.assert_called_once()
+        self.assertEqual(json.loads(dispatch.call_args.args[0]),
+                         {'user_id': self.user.id, 'event': 'balance', 'data': {'balance': 5}})
+
+    async def test_dispatch_to_subscribers(self):
+        mine, other = events.subscribe(1), events.subscribe(2)
+        try:
+            events.dispatch(json.dumps({'user_id': 1, 'event': 'balance', 'data': {}}))
+            events.dispatch(json.dumps({'user_id': None, 'event': 'broadcast', 'data': {}}))
+            await asyncio.sleep(0)
+            self.assertEqual([(await mine.get())['event'], (await mine.get())['event']], ['balance', 'broadcast'])
+            self.assertEqual((await other.get())['event'], 'broadcast')
+            self.assertTrue(mine.empty() and other.empty())
+
+            # a stalled stream gets a resync instead of an unbounded backlog
+            for _ in range(4):
+                events.dispatch(json.dumps({'user_id': 1, 'event': 'balance', 'data': {}}))
+            await asyncio.sleep(0)
+            self.assertEqual([(await mine.get())['event'] for _ in range(mine.qsize())], ['resync'])
+        finally:
+            events.unsubscribe(1, mine)
+            events.unsubscribe(2, other)
+        self.assertNotIn(1, events._subscribers)
+
+    async def test_stream(self):
+        notification = await Notification.objects.acreate(user=self.user, message='Hi',
+                                                           notification_type='announcement')
+        stream = events.stream(self.user.id)
+        self.assertTrue((await anext(stream)).startswith('retry:'))
+        snapshot = await anext(stream)
+        self.assertIn('event: snapshot', snapshot)
+        self.assertIn(f'"last_notification_id": {notification.id}', snapshot)
+
+        events.dispatch(json.dumps({'user_id': self.user.id, 'event': 'balance', 'data': {'balance': 7}}))
+        self.assertEqual(await anext(stream), 'event: balance\ndata: {"balance": 7}\n\n')
+        await stream.aclose()
+        self.assertNotIn(self.user.id, events._subscribers)
+
+    def test_poll(self):
+        self.client.force_login(self.user)
+        first = Notification.objects.create(user=self.user, message='One', notification_type='announcement')
+        second = Notification.objects.create(user=self.user, message='Two', notification_type='announcement')
+        self.user.profile.add_coins(5, 'Task approved')
+
+        data = self.client.get(reverse('event_poll')).json()
+        self.assertEqual((data['unread'], data['balance'], data['last_notification_id'], data['notifications']),
+                         (2, 5, second.id, []))
+        data = self.client.get(reverse('event_poll'), {'after': first.id}).json()
+        self.assertEqual([row['id'] for row in data['notifications']], [second.id])
+
+    def test_stream_under_wsgi(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('event_stream')).status_code, 204)
+
+
+@override_settings(PAGINATION_EXACT_COUNT_LIMIT=4)
+class CachedCountPaginatorTests(TestCase):
+    """Counts are cached per query and stop at the exact-count limit"""
+
+    def setUp(self):
+        cache.clear()
+        for i in range(5):
+            EcoTask.objects.create(title=f'Task {i}', description='Plant a tree')
+
+    def counts(self, paginator):
+        with CaptureQueriesContext(connection) as queries:
+            count = paginator.count
+        return count, sum('COUNT(' in q['sql'].upper() for q in queries)
+
+    def test_count_is_cached_per_query(self):
+        tasks = EcoTask.objects.order_by('id')
+        active = EcoTask.objects.filter(is_active=True).order_by('id')
+        self.assertEqual(self.counts(CachedCountPaginator(tasks.filter(title='Task 1'), 2)), (1, 1))
+        self.assertEqual(self.counts(CachedCountPaginator(tasks.filter(title='Task 1'), 2)), (1, 0))
+        self.assertEqual(self.counts(CachedCountPaginator(tasks.filter(title='Task 2'), 2)), (1, 1))
+
+        self.assertEqual(self.counts(CachedCountPaginator(active, 2, namespace=CATALOG)), (None, 1))
+        self.assertEqual(self.counts(CachedCountPaginator(active, 2, namespace=CATALOG)), (None, 0))
+        eco_cache.bump_namespace(CATALOG)
+        self.assertEqual(self.counts(CachedCountPaginator(active, 2, namespace=CATALOG)), (None, 1))
+
+    def test_exact_up_to_the_limit(self):
+        EcoTask.objects.filter(title='Task 0').delete()
+        paginator = CachedCountPaginator(EcoTask.objects.order_by('id'), 2)
+        self.assertEqual((paginator.count, paginator.count_exact, paginator.num_pages), (4, True, 2))
+
+    def test_past_the_limit(self):
+        paginator = CachedCountPaginator(EcoTask.objects.order_by('id'), 2)
+        self.assertEqual((paginator.count, paginator.count_exact, paginator.num_pages), (None, False, None))
+        first, last = paginator.page(1), paginator.page(3)
+        self.assertEqual((first.has_next(), first.end_index()), (True, 2))
+        self.assertEqual((last.has_next(), last.end_index(), len(last)), (False, 5, 1))
+        with self.assertRaises(EmptyPage):
+            paginator.page(4)
+        self.assertEqual(paginator.get_page('x').number, 1)
+
+    def test_admin_paginator_uses_the_limit_as_total(self):
+        paginator = EstimatedCountPaginator(EcoTask.objects.order_by('id'), 2)
+        self.assertEqual((paginator.count, paginator.count_exact, paginator.num_pages), (4, True, 2))
+
+
+class CampaignTests(TestCase):
+    """Segment filters, idempotent re-runs and balances that match the ledger"""
+
+    def setUp(self):
+        self.task = EcoTask.objects.create(title='Plant a tree', description='Any tree')
+        self.users = {}
+        for name, location, age, days_since_login in [('tashkent_young', 'Tashkent', 20, 1),
+                                                      ('tashkent_old', 'tashkent', 60, 1),
+                                                      ('tashkent_idle', 'Tashkent', 25, 90),
+                                                      ('samarkand', 'Samarkand', 30, 1)]:
+            user = User.objects.create_user(name, last_login=timezone.now() - timedelta(days=days_since_login))
+            UserProfile.objects.filter(user=user).update(location=location, age=age)
+            self.users[name] = user
+
+    def campaign(self, **filters):
+        return Campaign.objects.create(name='Spring', coin_amount=20, message='Happy spring!', **filters)
+
+    def segment(self, **filters):
+        return sorted(campaigns.segment(self.campaign(**filters)).values_list('user__username', flat=True))
+
+    def test_segment_filters(self):
+        self.assertEqual(self.segment(location='TASHKENT'), ['tashkent_idle', 'tashkent_old', 'tashkent_young'])
+        self.assertEqual(self.segment(min_age=25, max_age=30), ['samarkand', 'tashkent_idle'])
+        self.assertEqual(self.segment(location='Tashkent', active_within_days=30), ['tashkent_old', 'tashkent_young'])
+        TaskSubmission.objects.create(user=self.users['samarkand'], task=self.task, description='Done',
+                                      image='submissions/a.jpg', status='approved')
+        self.assertEqual(self.segment(min_completed_tasks=1), ['samarkand'])
+
+    def test_run_is_idempotent_and_matches_the_ledger(self):
+        self.users['tashkent_young'].profile.add_coins(5, 'Task approved')
+        campaign = self.campaign(location='Tashkent')
+
+        with mock.patch.object(events, 'dispatch') as dispatch, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(campaigns.run(campaign, chunk_size=2), 3)
+        published = [json.loads(call.args[0]) for call in dispatch.call_args_list]
+        self.assertEqual(sorted((m['user_id'], m['event'], m['data']['balance']) for m in published),
+                         sorted([(self.users['tashkent_young'].id, 'balance', 25),
+                                 (self.users['tashkent_old'].id, 'balance', 20),
+                                 (self.users['tashkent_idle'].id, 'balance', 20)]))
+        self.assertEqual((campaign.status, campaign.granted_count), ('done', 3))
+        self.assertIsNotNone(campaign.started_at)
+
+        # a later member is credited by the next run, nobody twice
+        UserProfile.objects.filter(user=self.users['samarkand']).update(location='Tashkent')
+        self.assertEqual(campaigns.run(campaign), 1)
+        self.assertEqual(campaigns.run(campaign), 0)
+        self.assertEqual((campaign.status, campaign.granted_count), ('done', 4))
+
+        ledger_balances = ledger.balances(0, max(user.id for user in self.users.values()))
+        for user in self.users.values():
+            with self.subTest(user=user.username):
+                balance = UserProfile.objects.get(user=user).coin_balance
+                self.assertEqual(balance, ledger_balances[user.id])
+                self.assertEqual(Notification.objects.filter(user=user, notification_type='campaign').count(), 1)
+        self.assertEqual(CampaignGrant.objects.filter(campaign=campaign).count(), 4)
+
+
+class MetricsTests(TestCase):
+    """Histogram buckets, adding up process files, folding dead processes and the text format"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        override = self.settings(METRICS_DIR=directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        metrics.discard()
+        self.addCleanup(metrics.discard)
+        self.counter = metrics.Counter('test_events_total', 'Test events', ['kind'])
+        self.histogram = metrics.Histogram('test_seconds', 'Test latency', ['view'], buckets=(0.5, 2.0))
+        for name in ('test_events_total', 'test_seconds'):
+            self.addCleanup(metrics.REGISTRY.pop, name)
+
+    def other_process(self, pid, events=0, observations=()):
+        histogram = [0, 0, 0, 0.0]
+        for value in observations:
+            histogram[sum(value > bound for bound in self.histogram.buckets)] += 1
+            histogram[-1] += value
+        metrics.write_json(metrics.process_file(pid), {
+            'test_events_total': {'["a"]': events},
+            'test_seconds': {'["tasks"]': histogram},
+        })
+
+    def test_histogram_buckets(self):
+        for value in (0.25, 0.5, 1.0, 4.0):
+            self.histogram.observe(value, 'tasks')
+        # upper bounds are inclusive, like Prometheus' le
+        self.assertEqual(self.histogram.series[('tasks',)], [2, 1, 1, 5.75])
+
+    def test_processes_add_up(self):
+        self.counter.inc(2, 'a')
+        self.histogram.observe(0.25, 'tasks')
+        self.other_process(999999, events=3, observations=[1.0])
+        total = metrics.collect()
+        self.assertEqual(total['test_events_total'], {'["a"]': 5})
+        self.assertEqual(total['test_seconds'], {'["tasks"]': [1, 1, 0, 1.25]})
+
+    def test_dead_processes_are_archived(self):
+        self.other_process(999998, events=3)
+        self.other_process(999999, events=4)
+        with mock.patch.object(metrics, 'pid_alive', lambda pid: pid != 999998):
+            metrics.sweep()
+        files = sorted(os.listdir(settings.METRICS_DIR))
+        self.assertIn('archive.json', files)
+        self.assertNotIn('999998.json', files)
+        self.assertIn('999999.json', files)
+
+        metrics.mark_process_dead(999999)
+        metrics.mark_process_dead(999999)  # already folded: nothing to do
+        self.assertNotIn('999999.json', os.listdir(settings.METRICS_DIR))
+        self.assertEqual(metrics.collect()['test_events_total'], {'["a"]': 7})
+
+    def test_exposition_format(self):
+        self.counter.inc(1, 'say "hi"\n')
+        for value in (0.25, 1.0, 4.0):
+            self.histogram.observe(value, 'tasks')
+        text = metrics.exposition([('test_users', 'Users', 12)])
+        self.assertIn('# HELP test_events_total Test events\n# TYPE test_events_total counter\n'
+                      'test_events_total{kind="say \\"hi\\"\\n"} 1\n', text)
+        self.assertIn('# TYPE test_seconds histogram\n'
+                      'test_seconds_bucket{view="tasks",le="0.5"} 1\n'
+                      'test_seconds_bucket{view="tasks",le="2.0"} 2\n'
+                      'test_seconds_bucket{view="tasks",le="+Inf"} 3\n'
+                      'test_seconds_sum{view="tasks"} 5.25\n'
+                      'test_seconds_count{view="tasks"} 3\n', text)
+        self.assertTrue(text.endswith('# HELP test_users Users\n# TYPE test_users gauge\ntest_users 12\n'))
+
+
+@override_settings(BROADCAST_MAX_AGE_DAYS=30)
+class BroadcastTests(TestCase):
+    """Broadcasts merged into the inbox, counted by watermark, and announced from the admin"""
+
+    def setUp(self):
+        self.old = Broadcast.objects.create(message='Welcome')
+        self.user = User.objects.create_user('member')
+        now = timezone.now()
+        self.rows = []
+        for minutes, kind in [(50, 'personal'), (40, 'broadcast'), (30, 'personal'), (20, 'broadcast'),
+                              (10, 'personal')]:
+            if kind == 'personal':
+                row = Notification.objects.create(user=self.user, message=f'{kind} {minutes}',
+                                                  notification_type='task_approved')
+                Notification.objects.filter(pk=row.pk).update(created_at=now - timedelta(minutes=minutes))
+            else:
+                row = Broadcast.objects.create(message=f'{kind} {minutes}')
+                Broadcast.objects.filter(pk=row.pk).update(created_at=now - timedelta(minutes=minutes))
+            self.rows.append((kind, row.id))
+
+    def test_new_users_start_with_everything_read(self):
+        self.assertEqual(broadcasts.watermark(self.user.id), self.old.id)
+
+    def test_inbox_merges_newest_first(self):
+        inbox = broadcasts.inbox(self.user, 4)
+        self.assertEqual([(row['kind'], row['id']) for row in inbox], self.rows[:0:-1])
+        self.assertEqual([row['is_read'] for row in inbox], [False] * 4)
+
+        broadcasts.mark_seen(self.user.id, self.rows[1][1])
+        inbox = broadcasts.inbox(self.user, 10)
+        self.assertEqual([row['is_read'] for row in inbox if row['kind'] == 'broadcast'], [False, True, True])
+
+    def test_unread_count_and_watermark(self):
+        self.assertEqual(broadcasts.unread_count(self.user.id), 5)
+        broadcasts.mark_seen(self.user.id, self.rows[3][1])
+        self.assertEqual(broadcasts.unread_count(self.user.id), 3)
+        broadcasts.mark_seen(self.user.id, self.rows[1][1])  # an older one: the watermark stays
+        self.assertEqual(broadcasts.watermark(self.user.id), self.rows[3][1])
+        Notification.objects.filter(user=self.user).update(is_read=True)
+        self.assertEqual(broadcasts.unread_count(self.user.id), 0)
+
+        # broadcasts past BROADCAST_MAX_AGE_DAYS drop out
+        newer = Broadcast.objects.create(message='Old news')
+        Broadcast.objects.filter(pk=newer.pk).update(created_at=timezone.now() - timedelta(days=31))
+        self.assertEqual(broadcasts.unread_count(self.user.id), 0)
+        self.assertNotIn(newer.id, [row['id'] for row in broadcasts.inbox(self.user, 10)])
+        broadcasts.mark_seen(self.user.id)
+        self.assertEqual(broadcasts.watermark(self.user.id), newer.id)
+
+    def test_admin_add_announces_once(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+        with mock.patch.object(events, 'publish_all', wraps=events.publish_all) as publish_all:
+            response = self.client.post(reverse('admin:eco_broadcast_add'),
+                                        {'message': 'New task is up', 'notification_type': 'announcement',
+                                         'link': '/tasks/'})
+        self.assertRedirects(response, reverse('admin:eco_broadcast_changelist'), fetch_redirect_response=False)
+        broadcast = Broadcast.objects.get(message='New task is up')
+        publish_all.assert_called_once()
+
+        obj = Broadcast(message='Another', link='/store/')
+        BroadcastAdmin(Broadcast, admin.site).save_model(None, obj, None, change=False)
+        saved = Broadcast.objects.get(pk=obj.pk)
+        self.assertEqual((obj.created_at, obj._state.adding), (saved.created_at, False))
+        self.assertGreater(obj.pk, broadcast.pk)
@@ -0,0 +1,240 @@
+"""
+Size-bounded, streaming file uploads.
+
+``BoundedUploadHandler`` is the only entry in FILE_UPLOAD_HANDLERS: every
+upload is written to a temporary file in UPLOAD_CHUNK_SIZE pieces, so a
+worker never holds more than one chunk of a file in memory. Byte limits per
+form field (UPLOAD_FIELD_LIMITS) and the pixel limit (UPLOAD_MAX_PIXELS) are
+enforced while the data arrives; an oversized upload is aborted without
+reading the rest of the request, and the reason is left in
+``request.upload_errors`` for the view to show next to the field. The
+fields sent before the file (the CSRF token among them) are kept. A body
+larger than any form could send is refused with a 413 before it is read
+(eco.middleware.UploadLimitMiddleware).
+
+Mobile clients on flaky connections can instead push the file in pieces to
+the resumable upload endpoints (see ``ResumableUpload``) and submit the form
+with ``<field>_upload_id``.
+"""
+import fcntl
+import io
+import os
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.utils import timezone
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+# Bytes of a file buffered to read its dimensions from the image header
+HEADER_BYTES = 512 * 1024
+
+
+def field_limit(field_name):
+    return settings.UPLOAD_FIELD_LIMITS.get(field_name, settings.UPLOAD_MAX_BYTES)
+
+
+def image_dimensions(data):
+    """(width, height) from the start of an image file, or None if not enough of it has arrived"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+def too_many_pixels(size):
+    return size is not None and size[0] * size[1] > settings.UPLOAD_MAX_PIXELS
+
+
+def pixel_error(size):
+    return f'Image is {size[0]}x{size[1]} pixels; the limit is {settings.UPLOAD_MAX_PIXELS // 1_000_000} megapixels.'
+
+
+def size_error(limit):
+    return f'File is too large; the limit is {filesizeformat(limit)}.'
+
+
+def record_error(request, field_name, message):
+    if request is not None:
+        if not hasattr(request, 'upload_errors'):
+            request.upload_errors = {}
+        request.upload_errors[field_name] = message
+
+
+def apply_upload_errors(request, form):
+    """Show errors recorded during an aborted upload on the form; returns True if there were any"""
+    errors = getattr(request, 'upload_errors', {})
+    form.errors  # validate first, add_error() needs cleaned_data
+    for field_name, message in errors.items():
+        form.errors.pop(field_name, None)  # 'This field is required.' for the aborted file
+        form.add_error(field_name if field_name in form.fields else None, message)
+    return bool(errors)
+
+
+def largest_limit():
+    return max([settings.UPLOAD_MAX_BYTES, *settings.UPLOAD_FIELD_LIMITS.values()])
+
+
+def body_limit():
+    """Largest multipart body any form can legitimately send (see UploadLimitMiddleware)"""
+    return largest_limit() + (settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 0)
+
+
+class BoundedUploadHandler(TemporaryFileUploadHandler):
+    chunk_size = settings.UPLOAD_CHUNK_SIZE
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.limit = field_limit(field_name)
+        self.received = 0
+        self.header = b''
+        self.dimensions = None
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.limit:
+            self.abort(size_error(self.limit))
+
+        if self.dimensions is None and len(self.header) < HEADER_BYTES:
+            self.header += raw_data
+            self.dimensions = image_dimensions(self.header)
+            if too_many_pixels(self.dimensions):
+                self.abort(pixel_error(self.dimensions))
+            if self.dimensions is not None or len(self.header) >= HEADER_BYTES:
+                self.header = b''
+
+        self.file.write(raw_data)
+
+    def abort(self, message):
+        record_error(self.request, self.field_name, message)
+        self.upload_interrupted()
+        raise StopUpload(connection_reset=True)
+
+
+def check_file(path, field_name):
+    """Validate a fully received file against the limits; returns an error message or None"""
+    limit = field_limit(field_name)
+    if os.path.getsize(path) > limit:
+        return size_error(limit)
+    with open(path, 'rb') as fh:
+        dimensions = image_dimensions(fh.read(HEADER_BYTES))
+    if too_many_pixels(dimensions):
+        return pixel_error(dimensions)
+    return None
+
+
+@contextmanager
+def resumable_files(request, field_names):
+    """
+    ``request.FILES`` plus any completed resumable uploads named by
+    ``<field>_upload_id`` in the POST data. Yields (files, uploads) so the
+    caller can delete the consumed uploads after saving; the files opened
+    here are closed on leaving the block, whether the form was valid or not.
+
+        with uploads.resumable_files(request, ['image']) as (files, pending):
+            ...
+    """
+    files = request.FILES.copy()
+    uploads = []
+    try:
+        attach_resumable(request, field_names, files, uploads)
+        yield files, uploads
+    finally:
+        for upload in uploads:
+            files[upload.field_name].close()
+
+
+def attach_resumable(request, field_names, files, uploads):
+    """Add the completed resumable uploads named in the POST data to ``files`` and ``uploads``"""
+    from .models import ResumableUpload
+
+    for field_name in field_names:
+        upload_id = request.POST.get(f'{field_name}_upload_id')
+        if field_name in files or not upload_id:
+            continue
+        try:
+            upload_id = uuid.UUID(upload_id)
+        except ValueError:
+            upload = None
+        else:
+            upload = ResumableUpload.objects.filter(
+                id=upload_id, user=request.user, field_name=field_name, completed_at__isnull=False,
+            ).first()
+        if upload is None:
+            record_error(request, field_name, 'The uploaded file has expired; please upload it again.')
+            continue
+        files[field_name] = UploadedFile(
+            open(upload.path, 'rb'), name=upload.filename,
+            content_type=upload.content_type, size=upload.total_size,
+        )
+        uploads.append(upload)
+
+
+def consume(files, uploads):
+    """Close and delete resumable uploads once the form that used them was saved"""
+    for upload in uploads:
+        files[upload.field_name].close()
+        upload.discard()
+
+
+def received_bytes(upload):
+    """Bytes of an upload on disk; ``received`` in the row lags when a PATCH was cut off"""
+    if upload.completed_at is not None:
+        return upload.received
+    try:
+        return os.path.getsize(upload.path)
+    except FileNotFoundError:
+        return 0
+
+
+def append_chunk(upload, offset, stream):
+    """
+    Append the request body to a resumable upload at ``offset``. Whatever
+    arrives before the client disconnects is kept, so the next PATCH resumes
+    from there. Returns (status, error message or None).
+    """
+    if upload.completed_at is not None:
+        return 409, 'Upload is already complete'
+
+    with open(upload.path, 'ab') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        received = fh.seek(0, os.SEEK_END)
+        if offset != received:
+            upload.received = received
+            return 409, f'Offset mismatch; resume from {received}'
+
+        error = None
+        header = b''
+        dimensions = None
+        while True:
+            chunk = stream.read(settings.UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if received + len(chunk) > upload.total_size:
+                error = 'More data than Upload-Length'
+                break
+            if offset == 0 and dimensions is None and received < HEADER_BYTES:
+                header += chunk
+                dimensions = image_dimensions(header)
+                if too_many_pixels(dimensions):
+                    error = pixel_error(dimensions)
+                    break
+            fh.write(chunk)
+            received += len(chunk)
+        fh.flush()
+
+    upload.received = received
+    if error is None and received == upload.total_size:
+        error = check_file(upload.path, upload.field_name)
+        if error is None:
+            upload.completed_at = timezone.now()
+    if error is not None:
+        upload.discard()
+        return 413, error
+    upload.save(update_fields=['received', 'completed_at'])
+    return 204, None
+
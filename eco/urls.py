@@ -34,8 +34,30 @@ urlpatterns = [
     # Transactions
     path('transactions/', views.transactions, name='transactions'),  # NEW
     
+    # Resumable uploads
+    path('uploads/', views.create_upload, name='create_upload'),
+    path('uploads/<uuid:upload_id>/', views.upload_detail, name='upload_detail'),
+    
+    # Resized media images
+    path('images/<slug:preset>/<path:path>', views.image_variant, name='image_variant'),
+    path('media/<path:name>', views.media_file, name='media'),
+    
+    # JSON list API
+    path('api/tasks/', views.api_tasks, name='api_tasks'),
+    path('api/my-submissions/', views.api_my_submissions, name='api_my_submissions'),
+    path('api/my-orders/', views.api_my_orders, name='api_my_orders'),
+    path('api/transactions/', views.api_transactions, name='api_transactions'),
+    
     # Notifications
+    path('notifications/', views.notifications_view, name='notifications'),
+    path('notifications/read-all/', views.mark_all_notifications_read, name='mark_all_notifications_read'),
+    path('notifications/broadcast/<int:broadcast_id>/read/', views.mark_broadcast_read, name='mark_broadcast_read'),
     path('notifications/<int:notification_id>/read/', views.mark_notification_read, name='mark_notification_read'),
+    path('events/stream/', views.event_stream, name='event_stream'),
+    path('events/poll/', views.event_poll, name='event_poll'),
+    
+    # Prometheus scrape target
+    path('metrics', views.metrics_view, name='metrics'),
     
     # Admin
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
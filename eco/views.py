@@ -1,54 +1,76 @@
+import os
+
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET, require_http_methods
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.db.models import Count, Q
-from django.utils import timezone
-from django.core.paginator import Paginator
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
 from .models import (
     UserProfile, EcoTask, TaskSubmission, 
-    CoinTransaction, MerchItem, Order, Notification
+    CoinTransaction, ArchivedCoinTransaction, MerchItem, Order, Notification, Broadcast, OutboxEvent, ResumableUpload
 )
+from .cache import CATALOG, LEADERBOARD, STORE
+from .pagination import CachedCountPaginator
 from .forms import SignUpForm, UserProfileForm, TaskSubmissionForm, OrderForm
+from . import broadcasts, cache, events, fastserialize, images, keyset, ledger, media, metrics, moderation, outbox, submitted, uploads
 
 
 def is_moderator(user):
     return user.is_staff or user.is_superuser
 
 
+def home_stats():
+    """(active tasks, users, approved submissions) for the home page"""
+    return (
+        EcoTask.objects.filter(is_active=True).count(),
+        UserProfile.objects.count(),
+        TaskSubmission.objects.filter(status='approved').count(),
+    )
+
+
+def user_rank(completed_tasks):
+    """
+    1 + the number of users with more approved submissions. Depends only on
+    the count, so users with the same count share one entry. Nothing bumps
+    LEADERBOARD on approval (it would empty the cache at every review):
+    ranks may be up to 300 seconds stale.
+    """
+    from django.contrib.auth.models import User
+    
+    def compute():
+        return 1 + User.objects.annotate(
+            submission_count=Count('submissions', filter=Q(submissions__status='approved'))
+        ).filter(submission_count__gt=completed_tasks).count()
+    
+    return cache.get_or_set(f'rank:{completed_tasks}', compute, 300, namespace=LEADERBOARD, name='rank')
+
+
 def home(request):
     """Home page with stats and featured tasks"""
-    total_tasks = EcoTask.objects.filter(is_active=True).count()
-    total_users = UserProfile.objects.count()
-    total_submissions = TaskSubmission.objects.filter(status='approved').count()
-    featured_tasks = EcoTask.objects.filter(is_active=True).order_by('-coin_reward')[:3]
-    
-    # Get unread notifications for logged in users
-    unread_notifications = []
+    total_tasks, total_users, total_submissions = cache.get_or_set(
+        'home_stats', home_stats, 60, namespace=CATALOG, name='home_stats',
+    )
+    featured_tasks = cache.get_or_set(
+        'featured_tasks', lambda: list(EcoTask.objects.filter(is_active=True).order_by('-coin_reward')[:3]),
+        300, namespace=CATALOG, name='featured_tasks',
+    )
+    
+    # The unread badge in base.html is filled in by the live event stream
     if request.user.is_authenticated:
-        unread_notifications = Notification.objects.filter(
-            user=request.user, 
-            is_read=False
-        )[:5]
-        
         # Additional stats for logged in users
         completed_tasks = TaskSubmission.objects.filter(
             user=request.user,
             status='approved'
         ).count()
         
-        # Calculate rank
-        from django.contrib.auth.models import User
-        all_users = User.objects.annotate(
-            submission_count=Count('submissions', filter=Q(submissions__status='approved'))  # FIXED: tasksubmission -> submissions
-        ).order_by('-submission_count')
-        
-        rank = 1
-        for i, u in enumerate(all_users, 1):
-            if u.id == request.user.id:
-                rank = i
-                break
-        
+        rank = user_rank(completed_tasks)
         impact_score = completed_tasks * 10
     else:
         completed_tasks = 0
@@ -60,7 +82,6 @@ def home(request):
         'total_users': total_users,
         'total_submissions': total_submissions,
         'featured_tasks': featured_tasks,
-        'unread_notifications': unread_notifications,
         'completed_tasks': completed_tasks,
         'rank': rank,
         'impact_score': impact_score,
@@ -120,7 +141,7 @@ def logout_view(request):
 def profile_view(request):
     """User profile page"""
     profile = request.user.profile
-    recent_transactions = CoinTransaction.objects.filter(user=request.user)[:10]
+    recent_transactions = ledger.history(request.user, limit=10)[:10]
     recent_submissions = TaskSubmission.objects.filter(user=request.user)[:5]
     
     # Calculate stats
@@ -129,18 +150,7 @@ def profile_view(request):
         status='approved'
     ).count()
     
-    # Calculate rank
-    from django.contrib.auth.models import User
-    all_users = User.objects.annotate(
-        submission_count=Count('submissions', filter=Q(submissions__status='approved'))  # FIXED: tasksubmission -> submissions
-    ).order_by('-submission_count')
-    
-    rank = 1
-    for i, u in enumerate(all_users, 1):
-        if u.id == request.user.id:
-            rank = i
-            break
-    
+    rank = user_rank(completed_tasks)
     impact_score = completed_tasks * 10
     
     context = {
@@ -159,18 +169,21 @@ def edit_profile_view(request):
     profile = request.user.profile
     
     if request.method == 'POST':
-        form = UserProfileForm(request.POST, request.FILES, instance=profile)
-        if form.is_valid():
-            form.save()
-            
-            # Also update User model fields
-            request.user.first_name = request.POST.get('first_name', '')
-            request.user.last_name = request.POST.get('last_name', '')
-            request.user.email = request.POST.get('email', '')
-            request.user.save()
-            
-            messages.success(request, 'Your profile has been updated!')
-            return redirect('profile')
+        with uploads.resumable_files(request, ['photo']) as (files, pending):
+            form = UserProfileForm(request.POST, files, instance=profile)
+            if not uploads.apply_upload_errors(request, form) and form.is_valid():
+                # Only the form's fields: a credit since the profile was loaded must not be undone
+                form.save(commit=False).save(update_fields=UserProfileForm.Meta.fields)
+                uploads.consume(files, pending)
+                
+                # Also update User model fields
+                request.user.first_name = request.POST.get('first_name', '')
+                request.user.last_name = request.POST.get('last_name', '')
+                request.user.email = request.POST.get('email', '')
+                request.user.save(update_fields=['first_name', 'last_name', 'email'])
+                
+                messages.success(request, 'Your profile has been updated!')
+                return redirect('profile')
     else:
         form = UserProfileForm(instance=profile)
     
@@ -181,13 +194,6 @@ def tasks_view(request):
     """List all eco tasks with filtering and pagination"""
     tasks_list = EcoTask.objects.filter(is_active=True)
     
-    # Check which tasks user has already submitted
-    submitted_task_ids = []
-    if request.user.is_authenticated:
-        submitted_task_ids = TaskSubmission.objects.filter(
-            user=request.user
-        ).values_list('task_id', flat=True)
-    
     # Search
     search = request.GET.get('search')
     if search:
@@ -208,17 +214,25 @@ def tasks_view(request):
         tasks_list = tasks_list.order_by('deadline')
     elif sort == 'title':
         tasks_list = tasks_list.order_by('title')
+    elif sort == 'popular':
+        tasks_list = tasks_list.order_by('-submission_count', '-id')
+    elif sort == 'completion':
+        tasks_list = tasks_list.order_by('-completion_rate', '-id')
     else:
         tasks_list = tasks_list.order_by('-created_at')
     
     # Pagination
-    paginator = Paginator(tasks_list, 9)  # 9 tasks per page
+    paginator = CachedCountPaginator(tasks_list, 9, namespace=CATALOG)  # 9 tasks per page
     page = request.GET.get('page')
     tasks = paginator.get_page(page)
     
+    # Mark the tasks the user has already submitted
+    submitted_tasks = submitted.for_user(request.user)
+    for task in tasks:
+        task.submitted = task.id in submitted_tasks
+    
     context = {
         'tasks': tasks,
-        'submitted_task_ids': submitted_task_ids,
     }
     return render(request, 'eco/tasks.html', context)
 
@@ -229,7 +243,7 @@ def task_detail_view(request, task_id):
     
     # Check if user has already submitted this task
     user_submission = None
-    if request.user.is_authenticated:
+    if task.id in submitted.for_user(request.user):
         user_submission = TaskSubmission.objects.filter(
             user=request.user,
             task=task
@@ -247,25 +261,34 @@ def submit_task_view(request, task_id):
     """Submit a task completion"""
     task = get_object_or_404(EcoTask, id=task_id, is_active=True)
     
-    # Check if user has already submitted this task
-    existing_submission = TaskSubmission.objects.filter(
-        user=request.user,
-        task=task
-    ).first()
+    # The expiry sweeper may not have caught up with the deadline yet
+    if task.is_expired:
+        messages.warning(request, 'This task has expired.')
+        return redirect('tasks')
     
-    if existing_submission:
+    # Check if user has already submitted this task
+    if task.id in submitted.for_user(request.user):
         messages.warning(request, 'You have already submitted this task.')
         return redirect('task_detail', task_id=task_id)
     
     if request.method == 'POST':
-        form = TaskSubmissionForm(request.POST, request.FILES)
-        if form.is_valid():
-            submission = form.save(commit=False)
-            submission.user = request.user
-            submission.task = task
-            submission.save()
-            messages.success(request, 'Your submission has been sent for review!')
-            return redirect('my_submissions')
+        with uploads.resumable_files(request, ['image']) as (files, pending):
+            form = TaskSubmissionForm(request.POST, files)
+            if not uploads.apply_upload_errors(request, form) and form.is_valid():
+                submission = form.save(commit=False)
+                submission.user = request.user
+                submission.task = task
+                try:
+                    with transaction.atomic():
+                        submission.save()
+                except IntegrityError:
+                    # The cached set was stale; the unique (user, task) constraint is the real guard
+                    submitted.refresh(request.user.id)
+                    messages.warning(request, 'You have already submitted this task.')
+                    return redirect('task_detail', task_id=task_id)
+                uploads.consume(files, pending)
+                messages.success(request, 'Your submission has been sent for review!')
+                return redirect('my_submissions')
     else:
         form = TaskSubmissionForm()
     
@@ -276,11 +299,22 @@ def submit_task_view(request, task_id):
     return render(request, 'eco/submit_task.html', context)
 
 
+# Rows per page (and per "Load more") on the personal history pages
+HISTORY_PAGE_SIZE = 20
+
+
+def render_history(request, template, rows_template, context):
+    """The full history page, or only the next rows for "Load more" (?fragment=1)"""
+    if request.GET.get('fragment'):
+        return render(request, rows_template, context)
+    return render(request, template, context)
+
+
 # NEW VIEW: My Submissions
 @login_required
 def my_submissions(request):
     """View user's task submissions"""
-    submissions = TaskSubmission.objects.filter(user=request.user).order_by('-created_at')
+    submissions = TaskSubmission.objects.filter(user=request.user).select_related('task')
     
     # Filter by status
     status = request.GET.get('status')
@@ -288,9 +322,11 @@ def my_submissions(request):
         submissions = submissions.filter(status=status)
     
     context = {
-        'submissions': submissions,
+        'submissions': keyset.paginate(submissions, request.GET.get('after'), HISTORY_PAGE_SIZE),
+        'status': status,
+        'status_choices': TaskSubmission.STATUS_CHOICES,
     }
-    return render(request, 'eco/my_submissions.html', context)
+    return render_history(request, 'eco/my_submissions.html', 'eco/my_submissions_rows.html', context)
 
 
 @login_required
@@ -299,9 +335,16 @@ def moderation_dashboard(request):
     """Moderation dashboard for staff"""
     status_filter = request.GET.get('status', 'pending')
     
-    submissions = TaskSubmission.objects.all().order_by('-created_at')
-    if status_filter != 'all':
-        submissions = submissions.filter(status=status_filter)
+    if status_filter == 'pending':
+        # Each moderator works on their own leased batch
+        if request.method == 'POST' and 'release' in request.POST:
+            moderation.release(request.user)
+            return redirect('moderation_dashboard')
+        submissions = moderation.claim_batch(request.user)
+    else:
+        submissions = TaskSubmission.objects.select_related('user', 'task').order_by('-created_at')
+        if status_filter != 'all':
+            submissions = submissions.filter(status=status_filter)
     
     context = {
         'submissions': submissions,
@@ -314,28 +357,13 @@ def moderation_dashboard(request):
 @user_passes_test(is_moderator)
 def approve_submission(request, submission_id):
     """Approve a task submission"""
-    submission = get_object_or_404(TaskSubmission, id=submission_id)
+    submission = get_object_or_404(TaskSubmission.objects.select_related('user', 'task'), id=submission_id)
     
     if submission.status == 'pending':
-        submission.status = 'approved'
-        submission.reviewed_at = timezone.now()
-        submission.save()
-        
-        # Add coins to user
-        submission.user.profile.add_coins(
-            submission.task.coin_reward,
-            f"Completed task: {submission.task.title}"
-        )
-        
-        # Create notification
-        Notification.objects.create(
-            user=submission.user,
-            message=f'Your submission for "{submission.task.title}" has been approved! You earned {submission.task.coin_reward} coins.',
-            notification_type='task_approved',
-            link=f'/tasks/{submission.task.id}/'
-        )
-        
-        messages.success(request, f'Submission approved! {submission.user.username} earned {submission.task.coin_reward} coins.')
+        if moderation.review(submission, request.user, 'approved'):
+            messages.success(request, f'Submission approved! {submission.user.username} earned {submission.task.coin_reward} coins.')
+        else:
+            messages.warning(request, 'This submission was already reviewed or is claimed by another moderator.')
     
     return redirect('moderation_dashboard')
 
@@ -344,24 +372,14 @@ def approve_submission(request, submission_id):
 @user_passes_test(is_moderator)
 def reject_submission(request, submission_id):
     """Reject a task submission"""
-    submission = get_object_or_404(TaskSubmission, id=submission_id)
+    submission = get_object_or_404(TaskSubmission.objects.select_related('user', 'task'), id=submission_id)
     
     if request.method == 'POST':
         comment = request.POST.get('comment', '')
-        submission.status = 'rejected'
-        submission.moderator_comment = comment
-        submission.reviewed_at = timezone.now()
-        submission.save()
-        
-        # Create notification
-        Notification.objects.create(
-            user=submission.user,
-            message=f'Your submission for "{submission.task.title}" was rejected.',
-            notification_type='task_rejected',
-            link=f'/tasks/{submission.task.id}/'
-        )
-        
-        messages.success(request, 'Submission rejected.')
+        if moderation.review(submission, request.user, 'rejected', comment=comment):
+            messages.success(request, 'Submission rejected.')
+        else:
+            messages.warning(request, 'This submission was already reviewed or is claimed by another moderator.')
         return redirect('moderation_dashboard')
     
     context = {'submission': submission}
@@ -370,7 +388,10 @@ def reject_submission(request, submission_id):
 
 def store_view(request):
     """Merchandise store"""
-    items = MerchItem.objects.filter(available=True).order_by('name')  # FIXED: removed is_popular
+    items = cache.get_or_set(
+        'items', lambda: list(MerchItem.objects.filter(available=True).order_by('name')),
+        300, namespace=STORE, name='store_items',
+    )
     
     user_balance = 0
     if request.user.is_authenticated:
@@ -394,33 +415,34 @@ def redeem_item(request, item_id):
             # Get shipping address
             shipping_address = request.POST.get('shipping_address', '')
             
-            # Create order
-            order = Order.objects.create(
-                user=request.user,
-                merch_item=item,
-                shipping_address=shipping_address
-            )
-            
-            # Deduct coins
-            profile.spend_coins(
-                item.coin_cost,
-                f"Redeemed: {item.name}"
-            )
-            
-            # Update stock
-            if hasattr(item, 'stock_quantity') and item.stock_quantity:
-                item.stock_quantity -= 1
-                if item.stock_quantity <= 0:
-                    item.available = False
-                item.save()
-            
-            # Create notification
-            Notification.objects.create(
-                user=request.user,
-                message=f'You successfully redeemed {item.name} for {item.coin_cost} coins!',
-                notification_type='order_placed',
-                link='/orders/'
-            )
+            with transaction.atomic():
+                # Deduct coins; fails if a concurrent redemption already spent them
+                if not profile.spend_coins(item.coin_cost, f"Redeemed: {item.name}"):
+                    messages.error(request, 'Insufficient coins!')
+                    return redirect('store')
+                
+                # Create order
+                order = Order.objects.create(
+                    user=request.user,
+                    merch_item=item,
+                    shipping_address=shipping_address
+                )
+                transaction.on_commit(metrics.REDEMPTIONS.inc)
+                
+                # Update stock
+                if hasattr(item, 'stock_quantity') and item.stock_quantity:
+                    item.stock_quantity -= 1
+                    if item.stock_quantity <= 0:
+                        item.available = False
+                    item.save()
+                
+                # Notify the user once the order has committed
+                outbox.notify(
+                    request.user,
+                    f'You successfully redeemed {item.name} for {item.coin_cost} coins!',
+                    'order_placed',
+                    link='/orders/'
+                )
             
             messages.success(request, f'Successfully redeemed {item.name}!')
             return redirect('my_orders')
@@ -438,12 +460,12 @@ def redeem_item(request, item_id):
 @login_required
 def my_orders(request):
     """User's orders"""
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    orders = Order.objects.filter(user=request.user).select_related('merch_item')
     
     context = {
-        'orders': orders,
+        'orders': keyset.paginate(orders, request.GET.get('after'), HISTORY_PAGE_SIZE),
     }
-    return render(request, 'eco/my_orders.html', context)
+    return render_history(request, 'eco/orders.html', 'eco/orders_rows.html', context)
 
 
 @login_required
@@ -456,17 +478,27 @@ def orders_view(request):
 @login_required
 def transactions(request):
     """View user's coin transaction history"""
-    transactions_list = CoinTransaction.objects.filter(user=request.user).order_by('-created_at')
-    
-    # Pagination
-    paginator = Paginator(transactions_list, 20)  # 20 transactions per page
-    page = request.GET.get('page')
-    transactions_page = paginator.get_page(page)
+    # Live and archived rows together, so compaction is invisible here
+    after = keyset.decode_cursor(request.GET.get('after'))
+    rows = ledger.history(request.user, before=after, limit=HISTORY_PAGE_SIZE + 1)[:HISTORY_PAGE_SIZE + 1]
     
     context = {
-        'transactions': transactions_page,
+        'transactions': keyset.KeysetPage(rows, HISTORY_PAGE_SIZE),
+    }
+    return render_history(request, 'eco/transactions.html', 'eco/transactions_rows.html', context)
+
+
+# Newest notifications and announcements shown on the notifications page
+INBOX_SIZE = 30
+
+
+@login_required
+def notifications_view(request):
+    """Personal notifications and announcements, newest first"""
+    context = {
+        'notifications': broadcasts.inbox(request.user, INBOX_SIZE),
     }
-    return render(request, 'eco/transactions.html', context)
+    return render(request, 'eco/notifications.html', context)
 
 
 @login_required
@@ -475,12 +507,35 @@ def mark_notification_read(request, notification_id):
     notification = get_object_or_404(Notification, id=notification_id, user=request.user)
     notification.is_read = True
     notification.save()
+    events.publish(request.user.id, 'unread', unread=broadcasts.unread_count(request.user.id))
     
     if notification.link:
         return redirect(notification.link)
     return redirect('home')
 
 
+@login_required
+def mark_broadcast_read(request, broadcast_id):
+    """Mark an announcement, and every older one, as read"""
+    broadcast = get_object_or_404(Broadcast, id=broadcast_id)
+    broadcasts.mark_seen(request.user.id, broadcast.id)
+    events.publish(request.user.id, 'unread', unread=broadcasts.unread_count(request.user.id))
+    
+    if broadcast.link:
+        return redirect(broadcast.link)
+    return redirect('notifications')
+
+
+@login_required
+@require_http_methods(['POST'])
+def mark_all_notifications_read(request):
+    """Mark every notification and announcement as read"""
+    Notification.objects.filter(user=request.user, is_read=False).update(is_read=True)
+    broadcasts.mark_seen(request.user.id)
+    events.publish(request.user.id, 'unread', unread=0)
+    return redirect('notifications')
+
+
 @login_required
 @user_passes_test(is_moderator)
 def admin_dashboard(request):
@@ -492,10 +547,10 @@ def admin_dashboard(request):
         submission_count=Count('submissions', filter=Q(submissions__status='approved'))  # FIXED
     ).order_by('-submission_count')[:5]
     
-    # Most completed tasks
+    # Most completed tasks (denormalized counter, no join)
     top_tasks = EcoTask.objects.annotate(
-        completion_count=Count('submissions', filter=Q(submissions__status='approved'))  # FIXED
-    ).order_by('-completion_count')[:5]
+        completion_count=F('approved_count')
+    ).order_by('-approved_count')[:5]
     
     # Most redeemed items
     top_items = MerchItem.objects.annotate(
@@ -549,17 +604,203 @@ def update_order_status(request, order_id):
     if request.method == 'POST':
         new_status = request.POST.get('status')
         if new_status in dict(Order.STATUS_CHOICES):
-            order.status = new_status
-            order.save()
-            
-            # Create notification
-            Notification.objects.create(
-                user=order.user,
-                message=f'Your order for {order.merch_item.name} is now {new_status}.',
-                notification_type='order_update',
-                link='/orders/'
-            )
+            with transaction.atomic():
+                order.status = new_status
+                order.save()
+                
+                # Notify the user once the status change has committed
+                outbox.notify(
+                    order.user,
+                    f'Your order for {order.merch_item.name} is now {new_status}.',
+                    'order_update',
+                    link='/orders/'
+                )
             
             messages.success(request, f'Order status updated to {new_status}.')
     
-    return redirect('manage_orders')
\ No newline at end of file
+    return redirect('manage_orders')
+
+
+@require_GET
+def image_variant(request, preset, path):
+    """Resized copy of a public media image, rendered once and cached on disk"""
+    try:
+        variant = images.get_variant(preset, path)
+    except images.VariantNotFound:
+        raise Http404('No such image')
+    except images.VariantTimeout:
+        response = HttpResponse('Image is still being prepared', status=503, content_type='text/plain')
+        response['Retry-After'] = '2'
+        return response
+    
+    if request.META.get('HTTP_IF_NONE_MATCH') == variant.etag:
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(open(variant.path, 'rb'), content_type=variant.content_type)
+    response['ETag'] = variant.etag
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+@require_GET
+def media_file(request, name):
+    """Uploaded file, for the owner and moderators unless it is public; the front server sends the bytes"""
+    return media.serve(request, name)
+
+
+@login_required
+@require_http_methods(['POST'])
+def create_upload(request):
+    """Start a resumable upload; the client then PATCHes the bytes to the returned URL"""
+    field_name = request.headers.get('Upload-Field', '')
+    try:
+        total_size = int(request.headers['Upload-Length'])
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Upload-Length header is required'}, status=400)
+    
+    if field_name not in settings.UPLOAD_FIELD_LIMITS:
+        return JsonResponse({'error': f'Unknown upload field {field_name!r}'}, status=400)
+    limit = uploads.field_limit(field_name)
+    if total_size <= 0 or total_size > limit:
+        return JsonResponse({'error': uploads.size_error(limit)}, status=413)
+    
+    upload = ResumableUpload.objects.create(
+        user=request.user,
+        field_name=field_name,
+        filename=os.path.basename(request.headers.get('Upload-Name', 'upload'))[:255] or 'upload',
+        content_type=request.headers.get('Upload-Type', '')[:100],
+        total_size=total_size,
+    )
+    os.makedirs(settings.UPLOAD_RESUMABLE_DIR, exist_ok=True)
+    open(upload.path, 'wb').close()
+    
+    response = JsonResponse({'id': str(upload.id), 'offset': 0}, status=201)
+    response['Location'] = reverse('upload_detail', args=[upload.id])
+    return response
+
+
+@login_required
+@require_http_methods(['HEAD', 'GET', 'PATCH', 'DELETE'])
+def upload_detail(request, upload_id):
+    """Report how much of a resumable upload arrived (HEAD/GET), append to it (PATCH) or cancel it"""
+    upload = get_object_or_404(ResumableUpload, id=upload_id, user=request.user)
+    
+    if request.method == 'DELETE':
+        upload.discard()
+        return HttpResponse(status=204)
+    if request.method == 'PATCH':
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'Upload-Offset header is required'}, status=400)
+        status, error = uploads.append_chunk(upload, offset, request)
+        if error:
+            response = JsonResponse({'error': error}, status=status)
+        else:
+            response = HttpResponse(status=204)
+    else:
+        response = HttpResponse(status=200)
+        upload.received = uploads.received_bytes(upload)
+    
+    response['Upload-Offset'] = str(upload.received)
+    response['Upload-Length'] = str(upload.total_size)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+async def event_stream(request):
+    """Server-sent events with new notifications, unread count and coin balance"""
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI a stream would pin a worker; 204 tells EventSource not to reconnect
+        return HttpResponse(status=204)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+    
+    response = StreamingHttpResponse(events.stream(user.pk), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+def event_poll(request):
+    """Polling fallback for event_stream: current counts plus notifications newer than ?after="""
+    data = events.snapshot(request.user.id)
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        after = 0
+    data['notifications'] = list(
+        Notification.objects.filter(user=request.user, id__gt=after)
+        .order_by('-id')
+        .values('id', 'message', 'notification_type', 'link', 'created_at')[:10]
+    ) if after else []
+    response = JsonResponse(data)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+# JSON list API (eco.fastserialize): rows are streamed straight from values() queries
+
+def api_limit(request):
+    try:
+        limit = int(request.GET.get('limit', settings.API_DEFAULT_LIMIT))
+    except ValueError:
+        limit = settings.API_DEFAULT_LIMIT
+    return max(1, min(limit, settings.API_MAX_LIMIT))
+
+
+def json_stream(serializer, rows):
+    return StreamingHttpResponse(serializer.stream(rows), content_type='application/json')
+
+
+@require_GET
+def api_tasks(request):
+    """Active tasks, newest first"""
+    tasks_list = EcoTask.objects.filter(is_active=True).order_by('-created_at')
+    return json_stream(fastserialize.TASKS, tasks_list[:api_limit(request)])
+
+
+@login_required
+@require_GET
+def api_my_submissions(request):
+    """User's submissions with their task"""
+    submissions = TaskSubmission.objects.filter(user=request.user).order_by('-created_at')
+    return json_stream(fastserialize.SUBMISSIONS, submissions[:api_limit(request)])
+
+
+@login_required
+@require_GET
+def api_my_orders(request):
+    """User's orders with their merchandise item"""
+    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    return json_stream(fastserialize.ORDERS, orders[:api_limit(request)])
+
+
+@login_required
+@require_GET
+def api_transactions(request):
+    """User's coin transactions, live and archived, newest first"""
+    serializer = fastserialize.TRANSACTIONS
+    live = serializer.values(CoinTransaction.objects.filter(user=request.user).order_by())
+    archived = serializer.values(ArchivedCoinTransaction.objects.filter(user=request.user).order_by())
+    limit = api_limit(request)
+    return json_stream(serializer, ledger.newest_first(live, archived, limit)[:limit])
+
+
+@require_GET
+def metrics_view(request):
+    """Counters and histograms of every process, in Prometheus text format"""
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not (token and constant_time_compare(authorization, f'Bearer {token}')) and not request.user.is_staff:
+        return HttpResponse(status=403)
+    
+    gauges = [
+        ('eco_outbox_pending', 'Outbox events waiting for delivery',
+         OutboxEvent.objects.filter(status='pending').count()),
+        ('eco_submissions_pending', 'Submissions waiting for moderation',
+         TaskSubmission.objects.filter(status='pending').count()),
+    ]
+    return HttpResponse(metrics.exposition(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
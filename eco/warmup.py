@@ -0,0 +1,94 @@
+"""
+Process and worker warm-up, called from the gunicorn hooks in
+``ecoapp/gunicorn_conf.py``.
+
+``warm_process()`` does the work that can be shared between workers: it
+compiles every template into the cached loader and populates the URL
+resolver. With ``preload_app`` it runs once in the gunicorn master before
+forking, so workers inherit the results copy-on-write.
+``warm_worker()`` does what must be done per process after the fork: opening
+and health-checking the database connection and priming caches.
+"""
+import logging
+import os
+import time
+
+from django.apps import apps
+from django.db import connection, connections
+from django.template import engines
+from django.urls import get_resolver, reverse, NoReverseMatch
+
+from .cache import CATALOG, namespace_version
+
+logger = logging.getLogger(__name__)
+
+
+def template_names(app_label='eco'):
+    """Names of every template shipped under ``<app>/templates/<app_label>/``"""
+    root = os.path.join(apps.get_app_config(app_label).path, 'templates')
+    names = []
+    for dirpath, _, filenames in os.walk(os.path.join(root, app_label)):
+        for filename in filenames:
+            if filename.endswith('.html'):
+                names.append(os.path.relpath(os.path.join(dirpath, filename), root))
+    return sorted(names)
+
+
+def precompile_templates():
+    """Load every eco template (and what it extends/includes) into the cached loader"""
+    engine = engines['django']
+    names = template_names()
+    for name in names:
+        engine.get_template(name)
+    return len(names)
+
+
+def warm_url_resolver():
+    """Populate the resolver and reverse every URL pattern that takes no arguments"""
+    resolver = get_resolver()
+    resolver.resolve('/')
+    reversed_count = 0
+    for name in resolver.reverse_dict.keys():
+        if isinstance(name, str):
+            try:
+                reverse(name)
+                reversed_count += 1
+            except NoReverseMatch:
+                pass
+    return reversed_count
+
+
+def check_database():
+    """Open this process's connection and make sure it answers"""
+    connection.ensure_connection()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+
+
+def prime_caches():
+    namespace_version(CATALOG)
+
+
+def warm_process():
+    started = time.perf_counter()
+    templates = precompile_templates()
+    urls = warm_url_resolver()
+    logger.info(
+        "Warm-up: compiled %s templates, reversed %s URLs in %.0f ms",
+        templates, urls, (time.perf_counter() - started) * 1000,
+    )
+
+
+def warm_worker():
+    started = time.perf_counter()
+    # Never reuse a connection inherited from the master across a fork
+    connections.close_all()
+    try:
+        check_database()
+        prime_caches()
+    except Exception:
+        # Serve anyway; CONN_HEALTH_CHECKS reconnects on the first request
+        logger.exception("Worker warm-up failed (pid %s)", os.getpid())
+        return
+    logger.info("Worker %s warm in %.0f ms", os.getpid(), (time.perf_counter() - started) * 1000)
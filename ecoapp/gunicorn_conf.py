@@ -0,0 +1,142 @@
+"""
+Gunicorn configuration for ecoapp.
+
+    gunicorn ecoapp.wsgi -c python:ecoapp.gunicorn_conf
+
+Workers and threads are sized from the CPUs this process may use and the
+memory it may take (the cgroup limit in a container, MemAvailable
+otherwise), at GUNICORN_WORKER_MEMORY_MB per worker. Every value can be
+pinned with the GUNICORN_* variables below.
+
+GUNICORN_ROLE picks a profile:
+
+* ``web`` (default): fast reads. gthread workers, 2 threads each, 30s timeout.
+* ``uploads``: submissions, profile photos and resumable uploads, where slow
+  clients trickle request bodies. Many threads per worker so a slow client
+  holds a thread rather than a whole process, and a long timeout. Run it as
+  its own process (``uploads`` in the Procfile) and route the upload paths to
+  it at the proxy::
+
+      location ~ ^/(tasks/\\d+/submit|profile/edit|uploads)/ { proxy_pass http://127.0.0.1:8002; }
+
+  It keeps the gthread worker class on purpose. The upload views are
+  synchronous (Django's multipart parser, eco.uploads, psycopg), so an
+  async class would not help: uvicorn's worker would run them one at a
+  time on the thread-sensitive sync_to_async executor, and gevent is not
+  a dependency and would need psycopg to be made cooperative. What the
+  role changes is the ratio: with 8 threads per worker, a slow body ties
+  up one cheap thread. Set ``GUNICORN_WORKER_CLASS`` to try another class.
+
+Workers restart after GUNICORN_MAX_REQUESTS requests (with jitter, so they
+do not all restart together) to contain memory growth.
+
+With GUNICORN_PRELOAD=1 (the default) the application is imported once in
+the master and templates/URLs are compiled there before workers fork; each
+worker then opens and checks its own database connection before taking
+traffic. See eco.warmup. GUNICORN_WARMUP=0 skips the warm-up entirely.
+
+`manage.py loadtest` compares configurations on throughput and tail latency.
+"""
+import os
+
+# The hooks below read Django settings, also when the app is not preloaded
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecoapp.settings')
+
+ROLES = {
+    # Worker class, threads per worker and request timeout (seconds)
+    'web': {'worker_class': 'gthread', 'threads': 2, 'timeout': 30},
+    'uploads': {'worker_class': 'gthread', 'threads': 8, 'timeout': 300},
+}
+
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def memory_bytes():
+    """Memory available to this process: the cgroup limit if there is one, else MemAvailable"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 2**60:
+            return int(value)
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def env_int(name, default):
+    return int(os.environ.get(name) or default)
+
+
+def auto_workers(role):
+    """(2 x CPUs + 1) for web, CPUs + 1 for uploads, capped by memory"""
+    cpus = cpu_count()
+    workers = cpus + 1 if role == 'uploads' else 2 * cpus + 1
+    memory = memory_bytes()
+    if memory:
+        per_worker = env_int('GUNICORN_WORKER_MEMORY_MB', 150) * 2**20
+        workers = min(workers, memory // per_worker)
+    return max(1, workers)
+
+
+role = os.environ.get('GUNICORN_ROLE', 'web')
+profile = ROLES[role]
+
+workers = env_int('GUNICORN_WORKERS', auto_workers(role))
+threads = env_int('GUNICORN_THREADS', profile['threads'])
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS') or (profile['worker_class'] if threads > 1 else 'sync')
+timeout = env_int('GUNICORN_TIMEOUT', profile['timeout'])
+graceful_timeout = env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+# Behind a proxy that reuses connections; longer than its idle timeout is wasted
+keepalive = env_int('GUNICORN_KEEPALIVE', 5)
+
+max_requests = env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = env_int('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10)
+
+# Worker heartbeats on tmpfs, so a slow disk cannot make healthy workers look dead
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+warmup_enabled = os.environ.get('GUNICORN_WARMUP', '1') == '1'
+
+
+def when_ready(server):
+    server.log.info(
+        'role=%s workers=%s worker_class=%s threads=%s timeout=%s max_requests=%s',
+        role, workers, worker_class, threads, timeout, max_requests,
+    )
+    from eco import metrics
+    # Files left by workers of a previous run; the other role's master may share METRICS_DIR
+    metrics.sweep()
+    # Runs in the master after the app was preloaded, before any worker forks
+    if preload_app and warmup_enabled:
+        from eco import warmup
+        warmup.warm_process()
+
+
+def child_exit(server, worker):
+    # Keep the counters of recycled (or killed) workers
+    from eco import metrics
+    metrics.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    if not warmup_enabled:
+        return
+    from eco import warmup
+    if not preload_app:
+        warmup.warm_process()
+    warmup.warm_worker()
@@ -41,12 +41,15 @@ INSTALLED_APPS = [
 ALLOWED_HOSTS = ['ecoapp-j155.onrender.com', 'localhost', '127.0.0.1']
 
 MIDDLEWARE = [
+    'eco.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'eco.middleware.UploadLimitMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'eco.middleware.ProfilingMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -56,13 +59,18 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Compiled templates are kept per process; eco.warmup fills this at startup
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -73,16 +81,48 @@ WSGI_APPLICATION = 'ecoapp.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': os.environ.get('POSTGRES_DB', 'ecoapp_db'),
-        'USER': os.environ.get('POSTGRES_USER', 'ecoapp_user'),
-        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', '0270'),
-        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
-        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+# DJANGO_DB_ENGINE=sqlite runs a single box without a database server: WAL
+# lets readers proceed while one writer commits, and write transactions start
+# with BEGIN IMMEDIATE so they queue on the busy timeout instead of failing
+# with "database is locked" when a read lock cannot be upgraded.
+DB_ENGINE = os.environ.get('DJANGO_DB_ENGINE', 'postgresql')
+
+if DB_ENGINE == 'sqlite':
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', '20'))  # seconds
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', str(BASE_DIR / 'db.sqlite3')),
+            'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': SQLITE_BUSY_TIMEOUT,
+                'init_command': ' '.join([
+                    'PRAGMA journal_mode=WAL;',
+                    'PRAGMA synchronous=NORMAL;',
+                    f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_MB', '256')) * 2**20};",
+                    f"PRAGMA cache_size=-{int(os.environ.get('SQLITE_CACHE_MB', '64')) * 1024};",
+                    'PRAGMA temp_store=MEMORY;',
+                    f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT * 1000};',
+                ]),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'ecoapp_db'),
+            'USER': os.environ.get('POSTGRES_USER', 'ecoapp_user'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', '0270'),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Keep the connection each worker opens at startup instead of reconnecting per request
+            'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+        }
     }
-}
 
 
 # Password validation
@@ -127,4 +167,185 @@ MEDIA_URL = '/media/'
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Cache
+# Shared by all gunicorn workers on the box; point REDIS_URL at Redis when
+# running on more than one host. CACHE_BACKEND=db keeps it in a table
+# instead (run `manage.py createcachetable` once). The file cache lists its
+# whole directory on every write and drops a random third of it when full,
+# so it is kept small; sessions fall back to the database and namespace
+# versions (eco.cache) survive eviction safely, but prefer Redis under load.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+elif os.environ.get('CACHE_BACKEND') == 'db':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'eco_cache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR', '/var/tmp/ecoapp_cache'),
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', '3000'))},
+        }
+    }
+
+
+# Two-tier cache (eco.cache.get_or_set): a per-process LRU in front of the
+# shared cache above. Workers notice a namespace bump within CACHE_VERSION_TTL
+# seconds; CACHE_ENABLED=0 computes everything on every request.
+
+CACHE_ENABLED = os.environ.get('CACHE_ENABLED', '1') == '1'
+CACHE_SHARED_ALIAS = 'default'
+CACHE_LOCAL_MAX_BYTES = int(os.environ.get('CACHE_LOCAL_MAX_MB', '32')) * 2**20
+CACHE_LOCAL_MAX_ENTRIES = 10000
+CACHE_LOCAL_TIMEOUT = int(os.environ.get('CACHE_LOCAL_TIMEOUT', '30'))
+CACHE_VERSION_TTL = float(os.environ.get('CACHE_VERSION_TTL', '1'))
+CACHE_LOCK_TIMEOUT = 30  # seconds a recompute may hold the single-flight lock
+CACHE_LOCK_WAIT = 5  # seconds other processes wait for it before computing too
+
+
+# Sessions and messages
+# Sessions live in the cache first (eco.sessions skips saves that would not
+# change anything); set DJANGO_SESSION_ENGINE to eco.sessions.cache or
+# django.contrib.sessions.backends.signed_cookies to avoid django_session
+# entirely. Flash messages travel in a cookie and never touch the session.
+
+SESSION_ENGINE = os.environ.get('DJANGO_SESSION_ENGINE', 'eco.sessions.cached_db')
+SESSION_SAVE_EVERY_REQUEST = False
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+# Outbox worker (eco.outbox, `manage.py run_outbox_worker`)
+
+OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', '2'))
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '50'))
+OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', '1'))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_RETRY_BASE_SECONDS = 5
+OUTBOX_RETRY_MAX_SECONDS = 60 * 60
+# Done events are deleted after this many days; failed ones are kept
+OUTBOX_RETENTION_DAYS = int(os.environ.get('OUTBOX_RETENTION_DAYS', '7'))
+OUTBOX_PURGE_INTERVAL_SECONDS = 60 * 60
+
+
+# Ledger compaction (eco.ledger, `manage.py compact_ledger`)
+
+LEDGER_COMPACTION_HORIZON_DAYS = int(os.environ.get('LEDGER_COMPACTION_HORIZON_DAYS', '365'))
+
+
+# Request profiling (eco.middleware.ProfilingMiddleware, `manage.py profile_report`)
+# Staff can profile a single request with `X-Profile: 1` or `?_profile=1`;
+# PROFILING_SAMPLE_RATE = N also profiles every Nth request per worker.
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '') == '1'
+PROFILING_SAMPLE_RATE = int(os.environ.get('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_DIR = os.environ.get('PROFILING_DIR', '/var/tmp/ecoapp_profiles')
+PROFILING_MAX_QUERIES = 500
+# Older captures of a URL name are deleted as new ones are saved
+PROFILING_KEEP_PER_URL = int(os.environ.get('PROFILING_KEEP_PER_URL', '50'))
+
+
+# Template rendering benchmark (`manage.py bench_templates`): allowed slowdown in percent
+
+TEMPLATE_BENCH_THRESHOLD = float(os.environ.get('TEMPLATE_BENCH_THRESHOLD', '20'))
+
+
+# Resized image variants (eco.images, /images/<preset>/<path>)
+
+IMAGE_VARIANT_DIR = os.environ.get('IMAGE_VARIANT_DIR', '/var/tmp/ecoapp_variants')
+IMAGE_VARIANT_CACHE_BYTES = int(os.environ.get('IMAGE_VARIANT_CACHE_MB', '1024')) * 1024 * 1024
+IMAGE_VARIANT_WORKERS = int(os.environ.get('IMAGE_VARIANT_WORKERS', '2'))
+IMAGE_VARIANT_TIMEOUT = 30
+
+
+# Uploads (eco.uploads): streamed to temporary files in chunks, never kept in
+# memory, and aborted as soon as a per-field byte limit or the pixel limit is
+# exceeded. Resumable uploads (/uploads/) are assembled in UPLOAD_RESUMABLE_DIR;
+# `manage.py cleanup_uploads` removes abandoned ones.
+
+FILE_UPLOAD_HANDLERS = ['eco.uploads.BoundedUploadHandler']
+FILE_UPLOAD_TEMP_DIR = os.environ.get('FILE_UPLOAD_TEMP_DIR') or None
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_MB', '10')) * 1024 * 1024
+UPLOAD_FIELD_LIMITS = {
+    'image': int(os.environ.get('UPLOAD_SUBMISSION_MAX_MB', '15')) * 1024 * 1024,
+    'photo': int(os.environ.get('UPLOAD_PHOTO_MAX_MB', '5')) * 1024 * 1024,
+}
+UPLOAD_MAX_PIXELS = int(os.environ.get('UPLOAD_MAX_MEGAPIXELS', '50')) * 1_000_000
+UPLOAD_RESUMABLE_DIR = os.environ.get('UPLOAD_RESUMABLE_DIR', '/var/tmp/ecoapp_uploads')
+UPLOAD_RESUMABLE_TTL_HOURS = 24
+
+
+# Live events (eco.events): the SSE stream at /events/stream/ is served by the
+# ASGI process (`events` in the Procfile). EVENTS_BACKEND=postgres relays events
+# between processes with LISTEN/NOTIFY; `local` only reaches the same process.
+# Under WSGI (the gunicorn `web` process) /events/stream/ answers 204 so a stream
+# never pins a worker: route /events/stream/ to the ASGI process at the proxy.
+# Browsers then fall back to polling /events/poll/.
+
+EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'postgres' if DB_ENGINE == 'postgresql' else 'local')
+EVENTS_QUEUE_SIZE = 100
+EVENTS_KEEPALIVE_SECONDS = 25
+EVENTS_RETRY_MS = 5000
+
+
+# List pagination (eco.pagination.CachedCountPaginator): totals are cached per
+# query, and counting stops at PAGINATION_EXACT_COUNT_LIMIT rows
+
+PAGINATION_COUNT_TIMEOUT = int(os.environ.get('PAGINATION_COUNT_TIMEOUT', '60'))
+PAGINATION_EXACT_COUNT_LIMIT = int(os.environ.get('PAGINATION_EXACT_COUNT_LIMIT', '10000'))
+
+
+# JSON list API (/api/...): rows per response, ?limit= up to API_MAX_LIMIT
+
+API_DEFAULT_LIMIT = 1000
+API_MAX_LIMIT = 10000
+
+
+# Moderation queue (eco.moderation): each moderator holds a batch of pending
+# submissions for MODERATION_LEASE_SECONDS
+
+MODERATION_BATCH_SIZE = int(os.environ.get('MODERATION_BATCH_SIZE', '10'))
+MODERATION_LEASE_SECONDS = int(os.environ.get('MODERATION_LEASE_SECONDS', '900'))
+
+
+# Task ids each user has submitted (eco.submitted), cached as a packed array
+
+SUBMITTED_TASKS_TIMEOUT = int(os.environ.get('SUBMITTED_TASKS_TIMEOUT', str(24 * 60 * 60)))
+
+
+# Metrics (eco.metrics, /metrics in Prometheus text format): each process
+# writes its counters to METRICS_DIR every METRICS_FLUSH_SECONDS and a scrape
+# adds them up. Scrapers authenticate with `Authorization: Bearer METRICS_TOKEN`;
+# staff users can open the page in a browser.
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_DIR = os.environ.get('METRICS_DIR', '/var/tmp/ecoapp_metrics')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', '5'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+
+# Media delivery (eco.media, /media/<path>): Django checks access, then hands
+# the transfer to nginx (X-Accel-Redirect to MEDIA_ACCEL_PREFIX, an internal
+# location aliased to MEDIA_ROOT) or Apache/lighttpd (X-Sendfile). Unset,
+# gunicorn sends the file itself.
+
+MEDIA_ACCEL = os.environ.get('MEDIA_ACCEL', '')  # 'nginx', 'sendfile' or ''
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+
+# Broadcast announcements (eco.broadcasts) stay in the inbox and the unread
+# count for BROADCAST_MAX_AGE_DAYS
+
+BROADCAST_MAX_AGE_DAYS = int(os.environ.get('BROADCAST_MAX_AGE_DAYS', '30'))
@@ -8,6 +8,6 @@ urlpatterns = [
     path('', include('eco.urls')),
 ]
 
+# Media goes through eco.views.media_file, which checks access
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
@@ -37,8 +37,8 @@ for user_data in sample_users:
             first_name=user_data['first_name'],
             last_name=user_data['last_name']
         )
-        # Update profile with some coins
-        user.profile.coin_balance = 50
+        # Starting coins go through the ledger so balances reconcile
+        user.profile.add_coins(50, "Welcome bonus")
         user.profile.location = "New York, USA"
         user.profile.age = 25
         user.profile.bio = f"Eco enthusiast making the world greener!"